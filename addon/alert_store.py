@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import deque
+
+SEVERITY_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'critical': 50}
+
+
+class AlertStore:
+    def __init__(self, capacity=1000):
+        self.alerts = deque(maxlen=capacity)
+        self.last_seq = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def add(self, alert):
+        if not isinstance(alert, dict):
+            alert = {'message': alert}
+        severity = alert.get('severity', 'info')
+        if severity not in SEVERITY_LEVELS:
+            raise ValueError(f"Unknown alert severity: {severity}")
+        with self.condition:
+            self.last_seq += 1
+            record = dict(alert, seq=self.last_seq, severity=severity, timestamp=alert.get('timestamp', time.time()))
+            self.alerts.append(record)
+            self.condition.notify_all()
+            return record
+
+    def query(self, since=0, min_severity=None, client_id=None, limit=100):
+        if min_severity is not None and min_severity not in SEVERITY_LEVELS:
+            raise ValueError(f"Unknown alert severity: {min_severity}")
+        min_level = SEVERITY_LEVELS[min_severity] if min_severity else 0
+        with self.condition:
+            if not self.alerts:
+                return {'alerts': [], 'next': max(since, self.last_seq), 'has_more': False}
+            # Sequence ids are contiguous, so the first unseen alert is found by offset
+            start = max(0, since + 1 - self.alerts[0]['seq'])
+            matched = []
+            next_seq = since
+            has_more = False
+            for index in range(start, len(self.alerts)):
+                alert = self.alerts[index]
+                if limit and len(matched) >= limit:
+                    has_more = True
+                    break
+                next_seq = alert['seq']
+                if SEVERITY_LEVELS[alert['severity']] < min_level:
+                    continue
+                if client_id is not None and alert.get('client_id') != client_id:
+                    continue
+                matched.append(alert)
+            return {'alerts': matched, 'next': next_seq, 'has_more': has_more}
+
+    def wait_for(self, since, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.last_seq > since, timeout)
+            return self.last_seq > since
+
+    def clear(self):
+        with self.condition:
+            self.alerts.clear()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.alerts)
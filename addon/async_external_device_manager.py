@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+import grpc
+import workloads_pb2
+import workloads_pb2_grpc
+from google.protobuf.json_format import MessageToDict
+from channel_pool import DEFAULT_CHANNEL_OPTIONS
+from chunk_codec import RawVideoChunk, RawVideoStreamerStub
+from metrics import record_rpc, record_rpc_error
+from external_device_manager import filter_frames
+from log_setup import Lazy
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncExternalDeviceManager:
+    # grpc.aio channels are bound to the event loop they are created on, so
+    # instances must be created from a coroutine running on that loop.
+    def __init__(self, address, options=None, compression=None, max_retries=5, initial_backoff=0.5, max_backoff=10.0,
+                 ready_timeout=5.0):
+        self.address = address
+        self.options = list(options or DEFAULT_CHANNEL_OPTIONS)
+        self.compression = compression
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.ready_timeout = ready_timeout
+        self.channel = None
+        self.video_stub = None
+        self.task_stub = None
+        self.processing_type = "motion_detection"
+        self.connect()
+
+    def connect(self):
+        try:
+            self.channel = grpc.aio.insecure_channel(self.address, options=self.options, compression=self.compression)
+            self.video_stub = RawVideoStreamerStub(self.channel)
+            self.task_stub = workloads_pb2_grpc.TaskManagerStub(self.channel)
+            logger.info(f"Connected to gRPC server at {self.address} (asyncio)")
+        except Exception as e:
+            logger.error(f"Failed to connect to gRPC server: {e}")
+            raise
+
+    async def reconnect(self):
+        # Like the sync manager: the channel re-establishes its transport on its
+        # own, and is shared by every call to the device, so only wait for it.
+        logger.info(f"Reconnecting to gRPC server at {self.address}...")
+        try:
+            await asyncio.wait_for(self.channel.channel_ready(), self.ready_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"gRPC channel to {self.address} not ready")
+            return False
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+            self.channel = None
+
+    def _is_unavailable(self, error):
+        code = getattr(error, 'code', None)
+        return callable(code) and code() == grpc.StatusCode.UNAVAILABLE
+
+    def _backoff(self, attempt):
+        return min(self.initial_backoff * (2 ** attempt), self.max_backoff)
+
+    async def _call_with_retry(self, description, rpc, request):
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                response = await rpc(request)
+                record_rpc(self.address, description, started)
+                return response
+            except grpc.RpcError as e:
+                record_rpc_error(self.address, description, e)
+                if not self._is_unavailable(e) or attempt >= self.max_retries:
+                    record_rpc(self.address, description, started)
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning("%s to %s unavailable, retry %d/%d in %.1fs", description, self.address, attempt, self.max_retries,
+                               delay)
+                await asyncio.sleep(delay)
+                await self.reconnect()
+
+    async def stream_video(self, task_id, frame_source, stream_state=None):
+        progress = {'frames': 0, 'ended': False}
+        call = None
+
+        async def generate_video_chunks():
+            processing_type = frame_source.processing_type
+            yield RawVideoChunk(processing_type=processing_type)
+            while True:
+                frame = await frame_source.get_next_frame_async()
+                if not frame:
+                    progress['ended'] = True
+                    break
+                if getattr(stream_state, 'failover_requested', False):
+                    call.cancel()
+                    return
+                current = frame_source.processing_type
+                chunk = RawVideoChunk(frame, current if current != processing_type else '', frame_source.codec)
+                processing_type = current
+                sent_at = time.perf_counter()
+                yield chunk
+                progress['frames'] += 1
+                if stream_state is not None:
+                    stream_state.record_chunk(len(frame), time.perf_counter() - sent_at)
+
+        attempt = 0
+        frames_at_failure = 0
+        while True:
+            try:
+                call = self.video_stub.StreamVideo(generate_video_chunks())
+                if stream_state is not None:
+                    # request_failover() cancels the call from the health checker's thread
+                    stream_state.call_loop = asyncio.get_running_loop()
+                    stream_state.call = call
+                try:
+                    if getattr(stream_state, 'failover_requested', False):
+                        call.cancel()
+                    response = await call
+                finally:
+                    if stream_state is not None:
+                        stream_state.call = None
+                        stream_state.call_loop = None
+                if getattr(stream_state, 'failover_requested', False):
+                    raise RuntimeError(f"Video stream {task_id} is failing over")
+                logger.debug("Response from server: %s", Lazy(MessageToDict, response))
+                return response
+            except asyncio.CancelledError:
+                if call is None or not call.cancelled() or not getattr(stream_state, 'failover_requested', False):
+                    raise
+                # Only the call was cancelled, not the task awaiting it
+                logger.warning("Video stream %s to %s cancelled for failover", task_id, self.address)
+                raise RuntimeError(f"Video stream {task_id} is failing over")
+            except grpc.RpcError as e:
+                stopping = getattr(stream_state, 'stop_requested', False)
+                failing_over = getattr(stream_state, 'failover_requested', False)
+                if not self._is_unavailable(e) or progress['ended'] or stopping or failing_over:
+                    logger.error(f"gRPC error during video streaming: {e}")
+                    raise
+                if progress['frames'] > frames_at_failure:
+                    # The previous attempt made progress, so this is a new blip
+                    attempt = 0
+                frames_at_failure = progress['frames']
+                if attempt >= self.max_retries:
+                    logger.error(f"gRPC error during video streaming, giving up after {attempt} retries: {e}")
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning("Video stream %s to %s interrupted, retry %d/%d in %.1fs", task_id, self.address, attempt,
+                               self.max_retries, delay)
+                await asyncio.sleep(delay)
+                await self.reconnect()
+            except Exception as e:
+                logger.error(f"Error during video streaming: {e}")
+                raise
+
+    async def send_task(self, task_id, task_type, payload=""):
+        try:
+            request = workloads_pb2.TaskRequest(task_id=task_id, task_type=task_type, payload=payload)
+            return await self._call_with_retry("SendTask", self.task_stub.SendTask, request)
+        except grpc.RpcError as e:
+            logger.error(f"gRPC error during sending task: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during sending task: {e}")
+            raise
+
+    async def send_task_batch(self, tasks):
+        try:
+            request = workloads_pb2.TaskBatchRequest(tasks=[
+                workloads_pb2.TaskRequest(task_id=task_id, task_type=task_type, payload=payload)
+                for task_id, task_type, payload in tasks
+            ])
+            response = await self._call_with_retry("SendTaskBatch", self.task_stub.SendTaskBatch, request)
+            return list(response.responses)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                logger.error(f"gRPC error during sending task batch: {e}")
+                raise
+            logger.warning(f"External device at {self.address} does not support SendTaskBatch")
+            return [await self.send_task(task_id, task_type, payload) for task_id, task_type, payload in tasks]
+        except Exception as e:
+            logger.error(f"Error during sending task batch: {e}")
+            raise
+
+    async def retrieve_frames(self):
+        logger.debug("Requesting saved frames from external device at %s", self.address)
+        try:
+            request = workloads_pb2.TaskRequest(task_id="retrieve_frames", task_type="retrieve_frames", payload="")
+            response = await self._call_with_retry("RetrieveFrames", self.task_stub.RetrieveFrames, request)
+            return [
+                {"image": frame_data.image, "timestamp": frame_data.timestamp}
+                for frame_data in response.frames
+            ]
+        except grpc.RpcError as e:
+            logger.error(f"gRPC error during retrieving frames: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during retrieving frames: {e}")
+            raise
+
+    async def iter_frames(self, since_timestamp="", limit=0, metadata_only=False):
+        logger.debug("Streaming saved frames from external device at %s since %s", self.address, since_timestamp or 'start')
+        query = workloads_pb2.FrameQuery(since_timestamp=since_timestamp or "", limit=limit, metadata_only=metadata_only)
+        try:
+            async for frame_data in self.task_stub.RetrieveFramesStream(query):
+                yield {
+                    "image": frame_data.image,
+                    "timestamp": frame_data.timestamp,
+                    "size": frame_data.size or len(frame_data.image)
+                }
+            return
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                logger.error(f"gRPC error during streaming frames: {e}")
+                raise
+        # Older edge devices only implement the unary RetrieveFrames
+        logger.warning(f"External device at {self.address} does not support RetrieveFramesStream")
+        for frame in filter_frames(await self.retrieve_frames(), since_timestamp, limit, metadata_only):
+            yield frame
+
+    def update_processing_type(self, processing_type):
+        logger.info(f"Updating processing type to {processing_type} for external device at {self.address}")
+        self.processing_type = processing_type
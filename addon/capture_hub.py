@@ -0,0 +1,350 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from capture_profiles import resolve_profile
+from h264_demuxer import is_keyframe
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLICIES = ('drop_oldest', 'keep_latest')
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Subscription:
+    def __init__(self, capture, subscriber_id, cursor, max_frames=None, max_latency_ms=None, policy='drop_oldest'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.capture = capture
+        self.subscriber_id = subscriber_id
+        self.cursor = cursor
+        self.max_frames = max_frames
+        self.max_latency_ms = max_latency_ms
+        self.policy = policy
+        self.frames_read = 0
+        self.dropped_frames = 0
+        self.closed = False
+        self.codec = capture.profile['codec']
+        # H.264 subscribers can only start, or resume after a drop, on a keyframe
+        self.needs_keyframe = True
+
+    def queue_depth(self):
+        return self.capture.next_seq - self.cursor
+
+    def get_next_frame(self, timeout=None):
+        return self.capture.next_frame_for(self, timeout)
+
+    async def get_next_frame_async(self):
+        return await self.capture.next_frame_for_async(self)
+
+    def close(self):
+        self.capture.close_subscription(self)
+
+
+class DeviceCapture:
+    def __init__(self, ffmpeg_manager, input_device, ring_size=30, profile=None):
+        self.ffmpeg_manager = ffmpeg_manager
+        self.input_device = input_device
+        self.profile = resolve_profile(profile)
+        self.stream_id = f"capture:{input_device}"
+        self.ring = deque(maxlen=ring_size)
+        self.next_seq = 0
+        self.subscribers = {}
+        self.condition = threading.Condition()
+        self.async_waiters = []
+        # Called with each new ring entry on the reader thread, e.g. the event recorder's pre-roll
+        self.listeners = []
+        self.ended = False
+        self.stopping = False
+        self.reader = None
+
+    def start(self):
+        self.ffmpeg_manager.start_stream(self.stream_id, input_device=self.input_device, profile=self.profile)
+        self.reader = threading.Thread(target=self._read_frames, name=f"capture-{self.input_device}", daemon=True)
+        self.reader.start()
+        logger.info(f"Started capture for {self.input_device}")
+
+    def _read_frames(self):
+        try:
+            while True:
+                frame = self.ffmpeg_manager.get_next_frame(self.stream_id)
+                if not frame:
+                    break
+                # Read after the frame: a profile change respawns ffmpeg on this thread
+                codec = self.ffmpeg_manager.get_stream_codec(self.stream_id) or self.profile['codec']
+                self.publish(frame, codec)
+        except Exception as e:
+            if not self.stopping:
+                logger.error(f"Capture for {self.input_device} failed: {e}")
+        finally:
+            with self.condition:
+                self.ended = True
+                self._notify_waiters()
+            if not self.stopping:
+                logger.warning(f"Capture for {self.input_device} ended")
+
+    def publish(self, frame, codec='mjpeg'):
+        # Ring entries: (seq, capture time, frame, codec, keyframe)
+        keyframe = codec != 'h264' or is_keyframe(frame)
+        with self.condition:
+            entry = (self.next_seq, time.time(), frame, codec, keyframe)
+            self.ring.append(entry)
+            self.next_seq += 1
+            self._notify_waiters()
+            listeners = self.listeners
+        for listener in listeners:
+            try:
+                listener(entry)
+            except Exception as e:
+                logger.error("Frame listener on capture %s failed: %s", self.input_device, e)
+
+    def add_listener(self, listener):
+        with self.condition:
+            # Copy on write, so publish can iterate without holding the lock
+            self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners = [existing for existing in self.listeners if existing != listener]
+
+    def _notify_waiters(self):
+        self.condition.notify_all()
+        for loop, waiter in self.async_waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        self.async_waiters.clear()
+
+    def subscribe(self, subscriber_id, **queue_settings):
+        with self.condition:
+            # New subscribers start at the live edge rather than replaying the ring
+            subscription = Subscription(self, subscriber_id, self.next_seq, **queue_settings)
+            self.subscribers[subscriber_id] = subscription
+            return subscription
+
+    def next_frame_for(self, subscription, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if subscription.closed:
+                    return None
+                if subscription.cursor < self.next_seq:
+                    frame = self._take_frame(subscription)
+                    if frame is not None:
+                        return frame
+                    continue
+                if self.ended:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    async def next_frame_for_async(self, subscription):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if subscription.closed:
+                    return None
+                if subscription.cursor < self.next_seq:
+                    frame = self._take_frame(subscription)
+                    if frame is not None:
+                        return frame
+                    continue
+                if self.ended:
+                    return None
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            await waiter
+
+    def _take_frame(self, subscription):
+        oldest_seq = self.ring[0][0]
+        # The subscriber fell behind; skip ahead instead of holding frames
+        # back for it.
+        cursor = max(subscription.cursor, self._first_deliverable_seq(subscription))
+        if cursor > subscription.cursor:
+            subscription.needs_keyframe = True
+        if subscription.needs_keyframe:
+            # Skipping part of an H.264 group of pictures leaves the edge decoder
+            # with broken references, so jump to the next keyframe instead.
+            while cursor < self.next_seq and not self.ring[cursor - oldest_seq][4]:
+                cursor += 1
+            subscription.dropped_frames += cursor - subscription.cursor
+            subscription.cursor = cursor
+            if cursor == self.next_seq:
+                return None
+            subscription.needs_keyframe = False
+        subscription.dropped_frames += cursor - subscription.cursor
+        subscription.cursor = cursor + 1
+        subscription.frames_read += 1
+        entry = self.ring[cursor - oldest_seq]
+        subscription.codec = entry[3]
+        return entry[2]
+
+    def _first_deliverable_seq(self, subscription):
+        newest_seq = self.next_seq - 1
+        if subscription.policy == 'keep_latest':
+            return newest_seq
+        first_seq = self.ring[0][0]
+        if subscription.max_frames:
+            first_seq = max(first_seq, self.next_seq - subscription.max_frames)
+        if subscription.max_latency_ms:
+            cutoff = time.time() - subscription.max_latency_ms / 1000.0
+            oldest_seq = self.ring[0][0]
+            # Always leave the newest frame deliverable, even if capture has stalled
+            while first_seq < newest_seq and self.ring[first_seq - oldest_seq][1] < cutoff:
+                first_seq += 1
+        return first_seq
+
+    def latest_frame(self):
+        with self.condition:
+            return self.ring[-1][2] if self.ring else None
+
+    def wait_for_frame(self, after_seq=-1, timeout=None):
+        # Newest ring entry past after_seq, for viewers that only ever want the
+        # latest frame; unlike subscriptions they never queue or count drops.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.ring and self.ring[-1][0] > after_seq:
+                    return self.ring[-1]
+                if self.ended or self.stopping:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def reconfigure(self, profile):
+        profile = resolve_profile(profile)
+        if profile == self.profile:
+            return False
+        # Only once ffmpeg runs it: a refused swap must leave the old profile in
+        # place, both for readers of self.profile and for a retry of the same one
+        self.ffmpeg_manager.reconfigure_stream(self.stream_id, self.input_device, profile)
+        self.profile = profile
+        logger.info(f"Capture for {self.input_device} switched to profile {profile['name']}")
+        return True
+
+    def close_subscription(self, subscription):
+        with self.condition:
+            subscription.closed = True
+            self.subscribers.pop(subscription.subscriber_id, None)
+            self._notify_waiters()
+            return len(self.subscribers)
+
+    def stop(self):
+        self.stopping = True
+        with self.condition:
+            for subscription in self.subscribers.values():
+                subscription.closed = True
+            self.subscribers.clear()
+            self._notify_waiters()
+        if self.stream_id in self.ffmpeg_manager.processes:
+            self.ffmpeg_manager.stop_stream(self.stream_id)
+        if self.reader is not None and self.reader is not threading.current_thread():
+            self.reader.join(timeout=5)
+        logger.info(f"Stopped capture for {self.input_device}")
+
+
+class CaptureHub:
+    def __init__(self, ffmpeg_manager, ring_size=30):
+        self.ffmpeg_manager = ffmpeg_manager
+        self.ring_size = ring_size
+        self.captures = {}
+        # Captures being stopped, by device: stopping joins the reader thread, so
+        # it happens outside the lock, and the device is only reopened after it
+        self.stopping = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, input_device, subscriber_id, profile=None, **queue_settings):
+        policy = queue_settings.get('policy', 'drop_oldest')
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        if profile is not None:
+            profile = resolve_profile(profile)
+        while True:
+            ended = None
+            with self.lock:
+                stopped = self.stopping.get(input_device)
+                if stopped is None:
+                    capture = self.captures.get(input_device)
+                    if capture is not None and capture.ended:
+                        ended = capture
+                        stopped = self._detach(capture)
+                    else:
+                        # A device can only be opened once, so every subscriber shares its profile
+                        if capture is not None and profile is not None and profile != capture.profile:
+                            raise ValueError(
+                                f"{input_device} is already capturing with profile {capture.profile['name']}")
+                        if capture is None:
+                            capture = DeviceCapture(self.ffmpeg_manager, input_device, self.ring_size, profile)
+                            capture.start()
+                            self.captures[input_device] = capture
+                        subscription = capture.subscribe(subscriber_id, **queue_settings)
+                        break
+            if ended is not None:
+                self._stop(ended, stopped)
+            else:
+                stopped.wait()
+        logger.info(f"Subscriber {subscriber_id} attached to capture {input_device}")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        capture = subscription.capture
+        stopped = None
+        with self.lock:
+            remaining = capture.close_subscription(subscription)
+            if remaining == 0 and self.captures.get(capture.input_device) is capture:
+                stopped = self._detach(capture)
+        if stopped is not None:
+            self._stop(capture, stopped)
+        logger.info(f"Subscriber {subscription.subscriber_id} detached from capture {capture.input_device}")
+
+    def _detach(self, capture):
+        # Called with the lock held
+        del self.captures[capture.input_device]
+        stopped = self.stopping[capture.input_device] = threading.Event()
+        return stopped
+
+    def _stop(self, capture, stopped):
+        try:
+            capture.stop()
+        finally:
+            with self.lock:
+                self.stopping.pop(capture.input_device, None)
+            stopped.set()
+
+    def set_profile(self, input_device, profile):
+        with self.lock:
+            capture = self.captures.get(input_device)
+            if capture is None:
+                raise ValueError(f"No capture running for {input_device}")
+            return capture.reconfigure(profile)
+
+    def get_profile(self, input_device):
+        with self.lock:
+            capture = self.captures.get(input_device)
+        return dict(capture.profile) if capture else None
+
+    def get_latest_frame(self, input_device):
+        with self.lock:
+            capture = self.captures.get(input_device)
+        return capture.latest_frame() if capture else None
+
+    def list_captures(self):
+        with self.lock:
+            return {
+                input_device: list(capture.subscribers.keys())
+                for input_device, capture in self.captures.items()
+            }
+
+    def stop_all(self):
+        with self.lock:
+            captures = list(self.captures.values())
+            self.captures.clear()
+        for capture in captures:
+            capture.stop()
@@ -0,0 +1,128 @@
+import re
+
+CODECS = ('mjpeg', 'h264')
+
+DEFAULT_PROFILE = 'mjpeg_high'
+
+# Named presets trading camera-side CPU against edge-link bandwidth. Fields left
+# out keep the camera's own resolution and frame rate.
+CAPTURE_PROFILES = {
+    'mjpeg_high': {'codec': 'mjpeg', 'quality': 2},
+    'mjpeg_720p': {'codec': 'mjpeg', 'width': 1280, 'height': 720, 'fps': 15, 'quality': 5},
+    'mjpeg_low': {'codec': 'mjpeg', 'width': 640, 'height': 360, 'fps': 10, 'quality': 8},
+    'detection_gray': {'codec': 'mjpeg', 'width': 640, 'height': 360, 'fps': 5, 'quality': 8, 'grayscale': True},
+    'h264_720p': {'codec': 'h264', 'width': 1280, 'height': 720, 'fps': 15, 'keyframe_interval': 30},
+    'h264_low': {'codec': 'h264', 'width': 640, 'height': 360, 'fps': 10, 'keyframe_interval': 20,
+                 'bitrate_kbps': 500},
+}
+
+# Synthetic inputs for benchmarks and demos, e.g. "lavfi:testsrc=size=1280x720:rate=30".
+# Only a single test source with plain options is accepted: filters such as
+# movie= could read arbitrary files through the API.
+SYNTHETIC_INPUT_PREFIX = 'lavfi:'
+SYNTHETIC_SOURCE = re.compile(r'^(testsrc|testsrc2|smptebars|smptehdbars|rgbtestsrc|color)(=[\w:=./]*)?$')
+
+# Capture devices accepted without configuration. Anything else handed to
+# ffmpeg's -i (a file, an rtsp:// or http:// URL) would let API callers read
+# local files or reach other hosts, and get the frames back through /snapshot.
+VIDEO_DEVICE = re.compile(r'^/dev/video\d+$')
+
+PROFILE_FIELDS = ('name', 'codec', 'width', 'height', 'fps', 'quality', 'grayscale', 'keyframe_interval',
+                  'bitrate_kbps')
+
+
+def resolve_profile(profile=None):
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, str):
+        profile = {'name': profile}
+    if not isinstance(profile, dict):
+        raise ValueError(f"Capture profile must be a name or a dict, got {type(profile).__name__}")
+    unknown = set(profile) - set(PROFILE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown capture profile fields: {sorted(unknown)}")
+    name = profile.get('name', DEFAULT_PROFILE)
+    if name not in CAPTURE_PROFILES:
+        raise ValueError(f"Unknown capture profile: {name}")
+    resolved = dict(CAPTURE_PROFILES[name], name=name)
+    resolved.update(profile)
+    _validate(resolved)
+    return resolved
+
+
+def _validate(profile):
+    if profile['codec'] not in CODECS:
+        raise ValueError(f"Unsupported capture codec: {profile['codec']}")
+    if ('width' in profile) != ('height' in profile):
+        raise ValueError("Capture profile needs both width and height")
+    for field in ('width', 'height'):
+        if field in profile and (not isinstance(profile[field], int) or profile[field] <= 0 or profile[field] % 2):
+            raise ValueError(f"Capture {field} must be a positive even integer")
+    for field in ('fps', 'keyframe_interval', 'bitrate_kbps'):
+        if field in profile and (not isinstance(profile[field], (int, float)) or profile[field] <= 0):
+            raise ValueError(f"Capture {field} must be positive")
+    if 'quality' in profile and not 2 <= profile['quality'] <= 31:
+        raise ValueError("MJPEG quality must be between 2 (best) and 31")
+
+
+def validate_input_device(input_device, allowed_devices=()):
+    if not isinstance(input_device, str):
+        raise ValueError(f"Input device must be a string, got {type(input_device).__name__}")
+    if input_device in allowed_devices or VIDEO_DEVICE.match(input_device):
+        return input_device
+    if input_device.startswith(SYNTHETIC_INPUT_PREFIX):
+        source = input_device[len(SYNTHETIC_INPUT_PREFIX):]
+        if SYNTHETIC_SOURCE.match(source):
+            return input_device
+        raise ValueError(f"Unsupported synthetic input: {source}")
+    raise ValueError(f"Input device {input_device} is not a /dev/video* device or in the allowed devices")
+
+
+def build_ffmpeg_command(input_device, profile):
+    command = [
+        'ffmpeg',
+        '-nostats',
+        '-progress', 'pipe:2',
+    ]
+    if input_device.startswith(SYNTHETIC_INPUT_PREFIX):
+        source = input_device[len(SYNTHETIC_INPUT_PREFIX):]
+        if not SYNTHETIC_SOURCE.match(source):
+            raise ValueError(f"Unsupported synthetic input: {source}")
+        # -re paces the generator at its own frame rate, like a real camera
+        command += ['-re', '-f', 'lavfi', '-i', source]
+    else:
+        command += ['-i', input_device]
+    filters = []
+    if 'fps' in profile:
+        filters.append(f"fps={profile['fps']}")
+    if 'width' in profile:
+        filters.append(f"scale={profile['width']}:{profile['height']}")
+    if profile.get('grayscale'):
+        # Neither encoder takes a gray pixel format, so drop the chroma instead;
+        # flat chroma planes cost next to nothing after compression.
+        filters.append('hue=s=0')
+    if filters:
+        command += ['-vf', ','.join(filters)]
+
+    if profile['codec'] == 'h264':
+        command += [
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-g', str(profile.get('keyframe_interval', 30)),
+            '-bf', '0',
+            '-pix_fmt', 'yuv420p',
+            # Access unit delimiters let the demuxer split the stream into frames
+            '-x264-params', 'aud=1',
+        ]
+        if 'bitrate_kbps' in profile:
+            command += ['-b:v', f"{profile['bitrate_kbps']}k"]
+        command += ['-f', 'h264', 'pipe:1']
+    else:
+        command += [
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            '-qscale:v', str(profile.get('quality', 2)),
+            'pipe:1'
+        ]
+    return command
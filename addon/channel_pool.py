@@ -0,0 +1,90 @@
+import logging
+import threading
+import grpc
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 32 * 1024 * 1024
+
+DEFAULT_CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 20000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_send_message_length', MAX_MESSAGE_LENGTH),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_LENGTH),
+    ('grpc.initial_reconnect_backoff_ms', 500),
+    ('grpc.max_reconnect_backoff_ms', 10000),
+]
+
+COMPRESSION = {
+    None: grpc.Compression.NoCompression,
+    'none': grpc.Compression.NoCompression,
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+}
+
+
+def resolve_compression(compression):
+    if compression not in COMPRESSION:
+        raise ValueError(f"Unsupported gRPC compression: {compression}")
+    return COMPRESSION[compression]
+
+
+class ChannelPool:
+    def __init__(self, options=None, compression=None, ready_timeout=5.0):
+        self.options = list(options or DEFAULT_CHANNEL_OPTIONS)
+        self.compression = resolve_compression(compression)
+        self.ready_timeout = ready_timeout
+        self.channels = {}
+        self.refcounts = {}
+        self.lock = threading.Lock()
+
+    def _create(self, address):
+        logger.info(f"Opening gRPC channel to {address}")
+        return grpc.insecure_channel(address, options=self.options, compression=self.compression)
+
+    def acquire(self, address):
+        with self.lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                channel = self._create(address)
+                self.channels[address] = channel
+                self.refcounts[address] = 0
+            self.refcounts[address] += 1
+            return channel
+
+    def get(self, address):
+        with self.lock:
+            return self.channels.get(address)
+
+    def release(self, address):
+        with self.lock:
+            if address not in self.refcounts:
+                return
+            self.refcounts[address] -= 1
+            if self.refcounts[address] > 0:
+                return
+            del self.refcounts[address]
+            channel = self.channels.pop(address)
+        logger.info(f"Closing gRPC channel to {address}")
+        channel.close()
+
+    def wait_ready(self, address, timeout=None):
+        channel = self.get(address)
+        if channel is None:
+            return False
+        try:
+            grpc.channel_ready_future(channel).result(timeout=self.ready_timeout if timeout is None else timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            logger.warning(f"gRPC channel to {address} not ready")
+            return False
+
+    def close_all(self):
+        with self.lock:
+            channels = list(self.channels.values())
+            self.channels.clear()
+            self.refcounts.clear()
+        for channel in channels:
+            channel.close()
@@ -0,0 +1,65 @@
+import workloads_pb2
+
+# VideoChunk field keys from workloads.proto: (field number << 3) | length-delimited
+DATA_KEY = b'\x0a'
+PROCESSING_TYPE_KEY = b'\x12'
+CODEC_KEY = b'\x1a'
+MAX_CACHED_FIELDS = 256
+
+_field_cache = {}
+
+
+def encode_varint(value):
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _string_field(key, value):
+    # processing_type and codec take a handful of values, so their encoded
+    # fields are built once and reused for every chunk
+    field = _field_cache.get((key, value))
+    if field is None:
+        raw = value.encode('utf-8')
+        field = key + encode_varint(len(raw)) + raw
+        if len(_field_cache) < MAX_CACHED_FIELDS:
+            _field_cache[(key, value)] = field
+    return field
+
+
+class RawVideoChunk:
+    # Stand-in for workloads_pb2.VideoChunk on the streaming hot path; data may
+    # be any bytes-like object and is never copied into a message.
+    __slots__ = ('data', 'processing_type', 'codec')
+
+    def __init__(self, data=b'', processing_type='', codec=''):
+        self.data = data
+        self.processing_type = processing_type
+        self.codec = codec
+
+
+def encode_video_chunk(chunk):
+    # Same bytes as VideoChunk.SerializeToString, but the frame is copied once,
+    # straight into the wire buffer, instead of into a message and out again.
+    parts = []
+    if len(chunk.data):
+        parts += (DATA_KEY, encode_varint(len(chunk.data)), chunk.data)
+    if chunk.processing_type:
+        parts.append(_string_field(PROCESSING_TYPE_KEY, chunk.processing_type))
+    if chunk.codec:
+        parts.append(_string_field(CODEC_KEY, chunk.codec))
+    return b''.join(parts)
+
+
+class RawVideoStreamerStub:
+    # VideoStreamerStub with the hand-rolled serializer; works on both sync and
+    # grpc.aio channels.
+    def __init__(self, channel):
+        self.StreamVideo = channel.stream_unary(
+            '/workloads.VideoStreamer/StreamVideo',
+            request_serializer=encode_video_chunk,
+            response_deserializer=workloads_pb2.TaskResponse.FromString
+        )
@@ -1,125 +1,1001 @@
+import asyncio
 import logging
+import threading
+import time
 import uuid
+import grpc
+from concurrent.futures import ThreadPoolExecutor
 from ffmpeg_manager import FFmpegManager
+from capture_hub import CaptureHub
+from capture_profiles import validate_input_device
+from frame_store import FrameStore
+from event_recorder import EventRecorder
+from registry_snapshot import RegistrySnapshot
+from channel_pool import ChannelPool
+from task_registry import TaskRegistry
+from task_scheduler import TaskScheduler
+from health_checker import HealthChecker
+from alert_store import AlertStore
+from metrics import LATENCY_BUCKETS, SIZE_BUCKETS, HistogramChild, MetricFamilies
+from task_stream import LIVE_SETTINGS, StreamSettings, TaskStream
 from external_device_manager import ExternalDeviceManager
+from async_external_device_manager import AsyncExternalDeviceManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SETTINGS = {
+    'max_frames': 5,
+    'max_latency_ms': 500,
+    'policy': 'drop_oldest'
+}
+RATE_WINDOW_SECONDS = 1.0
+# Upper bound on TaskRequests per SendTaskBatch message
+TASK_BATCH_SIZE = 100
+# Alerts that say nothing about the scene, so they never start an event recording.
+# A device going down would otherwise record every one of its streams just as
+# they fail over to another device, and so would each stream's failover alert.
+UNRECORDED_ALERT_TYPES = ('device_up', 'device_down', 'stream_failover')
+
+class StreamState:
+    def __init__(self, task_id, client_id):
+        self.task_id = task_id
+        self.client_id = client_id
+        self.state = 'pending'
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+        self.error = None
+        self.started_at = None
+        self.ended_at = None
+        self.stop_requested = False
+        self.failover_requested = False
+        self.failovers = 0
+        # The in-flight StreamVideo call, set by the device manager, and the
+        # event loop it belongs to on the grpc.aio path
+        self.call = None
+        self.call_loop = None
+        self.frame_sizes = HistogramChild(SIZE_BUCKETS)
+        self.send_latency = HistogramChild(LATENCY_BUCKETS)
+        self.fps = 0.0
+        self.bytes_per_second = 0.0
+        self.window_started = None
+        self.window_chunks = 0
+        self.window_bytes = 0
+
+    def record_chunk(self, size, send_seconds=None):
+        # Only the stream's own worker writes here, so plain attributes are enough
+        self.chunks_sent += 1
+        self.bytes_sent += size
+        self.frame_sizes.observe(size)
+        if send_seconds is not None:
+            self.send_latency.observe(send_seconds)
+        now = time.monotonic()
+        if self.window_started is None:
+            self.window_started = now
+        self.window_chunks += 1
+        self.window_bytes += size
+        elapsed = now - self.window_started
+        if elapsed >= RATE_WINDOW_SECONDS:
+            self.fps = self.window_chunks / elapsed
+            self.bytes_per_second = self.window_bytes / elapsed
+            self.window_started = now
+            self.window_chunks = 0
+            self.window_bytes = 0
+
+    def request_failover(self):
+        # Cancelling the call, rather than waiting for the request generator to
+        # see the flag, bounds failover even when the device stopped reading
+        # and the send is stuck on a full flow-control window.
+        self.failover_requested = True
+        call, loop = self.call, self.call_loop
+        if call is None:
+            return
+        if loop is None:
+            call.cancel()
+        else:
+            # grpc.aio calls may only be touched from their own loop
+            loop.call_soon_threadsafe(call.cancel)
+
+    def rates(self):
+        # A stream that stopped sending keeps its last window's rate, so age it out
+        if (self.state != 'running' or self.window_started is None
+                or time.monotonic() - self.window_started > 2 * RATE_WINDOW_SECONDS):
+            return 0.0, 0.0
+        return self.fps, self.bytes_per_second
+
+    def to_dict(self):
+        return {
+            'task_id': self.task_id,
+            'client_id': self.client_id,
+            'state': self.state,
+            'bytes_sent': self.bytes_sent,
+            'chunks_sent': self.chunks_sent,
+            'fps': round(self.rates()[0], 2),
+            'failovers': self.failovers,
+            'error': self.error,
+            'started_at': self.started_at,
+            'ended_at': self.ended_at
+        }
+
+
+# Every stream worker is taken; the stream was refused and may be retried later
+class StreamCapacityError(RuntimeError):
+    pass
+
+
+class StreamSupervisor:
+    def __init__(self, max_streams=16):
+        # Each sync stream holds its own thread for as long as it runs, so a
+        # shared pool would leave streams past its size queued forever while
+        # reported as started. Past max_streams, new streams are refused.
+        self.max_streams = max_streams
+        self.streams = {}
+        self.workers = {}
+        self.async_tasks = {}
+        self.lock = threading.Lock()
+
+    def submit(self, task_id, client_id, stream_fn, on_exit=None):
+        state = StreamState(task_id, client_id)
+        worker = threading.Thread(target=self._run, args=(state, stream_fn, on_exit),
+                                  name=f"stream-worker-{task_id}", daemon=True)
+        with self.lock:
+            if len(self.workers) >= self.max_streams:
+                raise StreamCapacityError(f"All {self.max_streams} stream workers are busy")
+            self.streams[task_id] = state
+            self.workers[task_id] = worker
+        worker.start()
+        return state
+
+    def submit_async(self, task_id, client_id, stream_coro_fn, on_exit=None):
+        state = StreamState(task_id, client_id)
+        with self.lock:
+            self.streams[task_id] = state
+            self.async_tasks[task_id] = asyncio.get_running_loop().create_task(
+                self._run_async(state, stream_coro_fn, on_exit)
+            )
+        return state
+
+    def _run(self, state, stream_fn, on_exit):
+        try:
+            error = None
+            try:
+                if self._begin(state):
+                    stream_fn(state)
+            except Exception as e:
+                error = e
+            finally:
+                self._finish(state, error, on_exit)
+        finally:
+            with self.lock:
+                self.workers.pop(state.task_id, None)
+
+    async def _run_async(self, state, stream_coro_fn, on_exit):
+        error = None
+        try:
+            if self._begin(state):
+                await stream_coro_fn(state)
+        except Exception as e:
+            error = e
+        finally:
+            self._finish(state, error, on_exit)
+
+    def _begin(self, state):
+        # A stream stopped before its worker began still goes through _finish,
+        # so its task leaves 'stopping' and can be compacted
+        if state.stop_requested:
+            return False
+        state.state = 'running'
+        state.started_at = time.time()
+        logger.info(f"Stream worker started for task {state.task_id}")
+        return True
+
+    def _finish(self, state, error, on_exit):
+        if error is None or state.stop_requested:
+            state.state = 'stopped'
+        else:
+            state.state = 'failed'
+            state.error = str(error)
+            logger.error(f"Stream worker for task {state.task_id} failed: {error}")
+        state.ended_at = time.time()
+        logger.info(f"Stream worker for task {state.task_id} exited with state {state.state}")
+        if on_exit:
+            try:
+                on_exit(state)
+            except Exception as e:
+                logger.error(f"Cleanup for task {state.task_id} failed: {e}")
+
+    def request_stop(self, task_id):
+        with self.lock:
+            state = self.streams.get(task_id)
+        if state is None:
+            return False
+        state.stop_requested = True
+        if state.state in ('pending', 'running'):
+            state.state = 'stopping'
+        return True
+
+    def get_state(self, task_id):
+        with self.lock:
+            return self.streams.get(task_id)
+
+    def get_status(self, task_id):
+        with self.lock:
+            state = self.streams.get(task_id)
+        return state.to_dict() if state else None
+
+    def list_statuses(self):
+        with self.lock:
+            return [state.to_dict() for state in self.streams.values()]
+
+    def list_states(self):
+        with self.lock:
+            return list(self.streams.values())
+
+    async def wait_async(self, task_id):
+        with self.lock:
+            task = self.async_tasks.get(task_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    def forget(self, task_id):
+        with self.lock:
+            self.streams.pop(task_id, None)
+            self.async_tasks.pop(task_id, None)
+
+    def wait(self, task_id, timeout=None):
+        with self.lock:
+            worker = self.workers.get(task_id)
+        if worker is not None:
+            worker.join(timeout)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            task_ids = list(self.streams.keys())
+            workers = list(self.workers.values())
+        for task_id in task_ids:
+            self.request_stop(task_id)
+        if wait:
+            for worker in workers:
+                worker.join()
+
 
 class DistributionManager:
-    def __init__(self):
-        self.ffmpeg_manager = FFmpegManager()
-        self.external_devices = {}
-        self.tasks = {}
-        self.alerts = []
+    def __init__(self, max_stream_workers=16, frame_store_dir='/data/frames', grpc_compression=None,
+                 max_finished_tasks=500, alert_capacity=1000, max_dispatch_workers=8,
+                 scheduling_policy='least_loaded', max_tasks_per_device=4, health_interval=2.0, health_timeout=1.0,
+                 health_failure_threshold=2, max_stream_failovers=3, events_dir='/data/events', pre_roll_seconds=5.0,
+                 post_roll_seconds=10.0, max_event_bytes=1024 ** 3, snapshot_path=None, input_devices=()):
+        self.ffmpeg_manager = FFmpegManager(on_restart=self._on_ffmpeg_restart)
+        self.channel_pool = ChannelPool(compression=grpc_compression)
+        self.frame_store = FrameStore(frame_store_dir)
+        self.event_recorder = EventRecorder(events_dir, pre_roll_seconds=pre_roll_seconds,
+                                            post_roll_seconds=post_roll_seconds, max_bytes=max_event_bytes)
+        self.capture_hub = CaptureHub(self.ffmpeg_manager)
+        # Inputs other than /dev/video* that streams may capture from, e.g. an rtsp:// camera
+        self.input_devices = tuple(input_devices)
+        self.subscriptions = {}
+        self.task_streams = {}
+        self.stream_supervisor = StreamSupervisor(max_streams=max_stream_workers)
+        self.dispatch_executor = ThreadPoolExecutor(max_workers=max_dispatch_workers, thread_name_prefix='task-dispatch')
+        self.registry = TaskRegistry(max_finished_tasks=max_finished_tasks, on_evict=self.stream_supervisor.forget)
+        self.health_checker = HealthChecker(self.registry, on_down=self._on_device_down, on_up=self._on_device_up,
+                                            interval=health_interval, timeout=health_timeout,
+                                            failure_threshold=health_failure_threshold)
+        self.max_stream_failovers = max_stream_failovers
+        self.scheduler = TaskScheduler(self.registry, self._send_scheduled_task, self.dispatch_executor,
+                                       policy=scheduling_policy, max_in_flight=max_tasks_per_device,
+                                       available=self.health_checker.is_healthy)
+        # grpc.aio channels only work on the loop that created them, so devices
+        # are kept per event loop: {loop: {client_id: device}}
+        self.async_external_devices = {}
+        self.async_devices_lock = threading.Lock()
+        self.alert_store = AlertStore(capacity=alert_capacity)
+        # Clients and running streams survive a restart when a snapshot path is set, see restore()
+        self.snapshot = RegistrySnapshot(snapshot_path, self._collect_snapshot) if snapshot_path else None
 
     def add_client(self, client_id, address):
         try:
-            self.external_devices[client_id] = ExternalDeviceManager(address)
-            logging.info(f"Client {client_id} added with address {address}")
+            previous = self.registry.add_client(client_id, ExternalDeviceManager(address, channel_pool=self.channel_pool))
+            if previous is not None:
+                previous.close()
+            logger.info(f"Client {client_id} added with address {address}")
+            self._snapshot_changed()
+            self.health_checker.start()
+            # Tasks may be queued waiting for a device to appear
+            self.scheduler.drain()
         except Exception as e:
-            logging.error(f"Failed to add client {client_id}: {e}")
+            logger.error(f"Failed to add client {client_id}: {e}")
             raise
 
     def remove_client(self, client_id):
         try:
-            if client_id in self.external_devices:
-                del self.external_devices[client_id]
-                logging.info(f"Client {client_id} removed")
+            if self.registry.has_client(client_id):
+                # Stop the client's tasks first so no stream worker or capture
+                # subscription outlives the device.
+                for task_id in self.registry.task_ids_for_client(client_id):
+                    self.stop_task(task_id)
+                device, tasks = self.registry.remove_client(client_id)
+                for task in tasks:
+                    self.stream_supervisor.forget(task['task_id'])
+                device.close()
+                self._close_async_devices(client_id)
+                self.health_checker.forget(client_id)
+                logger.info(f"Client {client_id} removed with {len(tasks)} tasks")
+                self._snapshot_changed()
             else:
-                logging.warning(f"Client {client_id} does not exist")
+                logger.warning(f"Client {client_id} does not exist")
         except Exception as e:
-            logging.error(f"Failed to remove client {client_id}: {e}")
+            logger.error(f"Failed to remove client {client_id}: {e}")
             raise
 
     def list_clients(self):
-        return list(self.external_devices.keys())
+        return self.registry.list_clients()
+
+    def _snapshot_changed(self):
+        if self.snapshot is not None:
+            self.snapshot.mark_dirty()
+
+    def _collect_snapshot(self):
+        streams = []
+        for task_id in self.registry.task_ids_of_type('video_stream'):
+            task = self.registry.get_task(task_id)
+            task_stream = self.task_streams.get(task_id)
+            subscription = self.subscriptions.get(task_id)
+            if task is None or task['state'] != 'running' or task_stream is None or subscription is None:
+                continue
+            settings = task_stream.settings.to_dict()
+            settings.pop('version')
+            streams.append({
+                'task_id': task_id,
+                'client_id': task['client_id'],
+                'input_device': task['input_device'],
+                'queue_settings': task.get('queue_settings'),
+                'profile': subscription.capture.profile,
+                'settings': settings
+            })
+        return {
+            'clients': {client_id: device.address for client_id, device in self.registry.list_devices()},
+            'streams': streams
+        }
+
+    def restore(self):
+        # Re-adds the clients and restarts the streams of the last snapshot.
+        # Channels connect in the background, in parallel; until a device
+        # answers, its stream retries like after any other connection loss.
+        if self.snapshot is None:
+            return None
+        data = self.snapshot.load()
+        if data is None:
+            return None
+        started = time.monotonic()
+        # Written once at the end, so a crash halfway through does not leave a partial snapshot
+        snapshot, self.snapshot = self.snapshot, None
+        try:
+            summary = self._restore(data)
+        finally:
+            self.snapshot = snapshot
+            self._snapshot_changed()
+        logger.info(f"Restored {summary['clients']} clients and {summary['streams']} streams in "
+                    f"{time.monotonic() - started:.2f}s, {len(summary['failed'])} failed")
+        return summary
+
+    def _restore(self, data):
+        summary = {'clients': 0, 'streams': 0, 'failed': []}
+        for client_id, address in data.get('clients', {}).items():
+            try:
+                self.add_client(client_id, address)
+                self.dispatch_executor.submit(self.channel_pool.wait_ready, address)
+                summary['clients'] += 1
+            except Exception as e:
+                summary['failed'].append({'client_id': client_id, 'error': str(e)})
+        for stream in data.get('streams', []):
+            try:
+                if self.start_task('video_stream', stream['client_id'], stream['input_device'],
+                                   stream.get('queue_settings'), stream.get('profile'), stream.get('settings'),
+                                   task_id=stream['task_id']) is None:
+                    raise ValueError(f"Unknown client {stream['client_id']}")
+                summary['streams'] += 1
+            except Exception as e:
+                summary['failed'].append({'task_id': stream.get('task_id'), 'error': str(e)})
+        return summary
+
+    def start_task(self, task_type, client_id, input_device='/dev/video0', queue_settings=None, profile=None,
+                   settings=None, task_id=None):
+        device = self.registry.get_client(client_id)
+        if device is None:
+            logger.error(f"Invalid client ID: {client_id}")
+            return
+        # Restored streams keep the task_id they had before the restart
+        task_id = task_id or str(uuid.uuid4())
+        try:
+            if task_type == 'video_stream':
+                task_stream = self._subscribe_stream(task_id, client_id, input_device, queue_settings, profile,
+                                                     self._stream_settings(device, settings))
+                try:
+                    self.stream_supervisor.submit(
+                        task_id,
+                        client_id,
+                        lambda state: self._run_stream(task_id, task_stream, state),
+                        on_exit=self._on_stream_exit
+                    )
+                except StreamCapacityError:
+                    # Refused, not queued: nothing of the stream may stay behind
+                    self._release_subscription(task_id)
+                    self.registry.remove_task(task_id)
+                    raise
+                logger.info(f"Started video stream task {task_id} for client {client_id}")
+                self._snapshot_changed()
+            else:
+                self.registry.add_task(task_id, task_type, client_id)
+                try:
+                    device.send_task(task_id, task_type)
+                except Exception as e:
+                    self._task_failed(task_id, e)
+                    raise
+                self.registry.set_state(task_id, 'sent')
+                logger.info(f"Started task {task_id} of type {task_type} for client {client_id}")
+            return task_id
+        except Exception as e:
+            logger.error(f"Failed to start task {task_id}: {e}")
+            raise
+
+    def start_tasks(self, tasks):
+        # tasks: dicts with task_type, client_id and optionally payload (input_device
+        # for video_stream); tasks without a client_id go to the scheduler. Returns one
+        # result per task, in order; a failure on one device does not fail the rest.
+        results = [None] * len(tasks)
+        by_client = {}
+        for index, task in enumerate(tasks):
+            task_type, client_id = task['task_type'], task.get('client_id')
+            result = {'task_id': None, 'task_type': task_type, 'client_id': client_id}
+            results[index] = result
+            if client_id is None:
+                try:
+                    result.update(task_id=self.schedule_task(task_type, task.get('payload', ""),
+                                                             task.get('input_device', '/dev/video0')))
+                    result['state'] = self.registry.get_task(result['task_id'])['state']
+                except Exception as e:
+                    result.update(state='failed', error=str(e))
+                continue
+            device = self.registry.get_client(client_id)
+            if device is None:
+                logger.error(f"Invalid client ID: {client_id}")
+                result.update(state='failed', error=f"Unknown client: {client_id}")
+                continue
+            if task_type == 'video_stream':
+                try:
+                    task_id = self.start_task(task_type, client_id, input_device=task.get('input_device', '/dev/video0'))
+                    result.update(task_id=task_id, state='running')
+                except Exception as e:
+                    result.update(state='failed', error=str(e))
+                continue
+            result['task_id'] = str(uuid.uuid4())
+            self.registry.add_task(result['task_id'], task_type, client_id)
+            by_client.setdefault(client_id, (device, []))[1].append((result, task.get('payload', "")))
+        # One batch RPC per device, and the devices dispatched concurrently
+        futures = [
+            self.dispatch_executor.submit(self._dispatch_batch, client_id, device, entries[offset:offset + TASK_BATCH_SIZE])
+            for client_id, (device, entries) in by_client.items()
+            for offset in range(0, len(entries), TASK_BATCH_SIZE)
+        ]
+        for future in futures:
+            future.result()
+        logger.info(f"Dispatched {len(tasks)} tasks to {len(by_client)} devices")
+        return results
+
+    def _dispatch_batch(self, client_id, device, entries):
+        try:
+            device.send_task_batch([(result['task_id'], result['task_type'], payload) for result, payload in entries])
+            state, error = 'sent', None
+        except Exception as e:
+            logger.error(f"Failed to send task batch to client {client_id}: {e}")
+            state, error = 'failed', str(e)
+        for result, _ in entries:
+            self.registry.set_state(result['task_id'], state)
+            result['state'] = state
+            if error is not None:
+                result['error'] = error
+
+    def schedule_task(self, task_type, payload="", input_device='/dev/video0'):
+        if task_type == 'video_stream':
+            client_id = self.scheduler.choose()
+            if client_id is None:
+                raise ValueError("No edge devices registered")
+            return self.start_task(task_type, client_id, input_device=input_device)
+        task_id = str(uuid.uuid4())
+        self.registry.add_task(task_id, task_type, None, state='queued')
+        self.scheduler.submit({'task_id': task_id, 'task_type': task_type, 'payload': payload})
+        logger.info(f"Queued task {task_id} of type {task_type} for scheduling")
+        return task_id
+
+    def _send_scheduled_task(self, client_id, task):
+        task_id = task['task_id']
+        self.registry.assign_client(task_id, client_id)
+        self.registry.set_state(task_id, 'pending')
+        try:
+            device = self.registry.get_client(client_id)
+            if device is None:
+                raise ValueError(f"Client {client_id} was removed")
+            device.send_task(task_id, task['task_type'], task['payload'])
+            self.registry.set_state(task_id, 'sent')
+            logger.info(f"Scheduled task {task_id} of type {task['task_type']} on client {client_id}")
+        except Exception as e:
+            self._task_failed(task_id, e)
+            raise
+
+    def _task_failed(self, task_id, error):
+        # A task left pending would count against its device's load forever
+        self.registry.update_task(task_id, error=str(error))
+        self.registry.set_state(task_id, 'failed')
+
+    def get_scheduler_stats(self):
+        return self.scheduler.stats()
+
+    def _run_stream(self, task_id, task_stream, state):
+        # Streams outlive their edge device: on failure the same subscription is
+        # re-sent to another healthy device, so capture never restarts.
+        while True:
+            device = self.registry.get_client(state.client_id)
+            if device is None:
+                raise ValueError(f"Client {state.client_id} was removed")
+            try:
+                return device.stream_video(task_id, task_stream, state)
+            except Exception as e:
+                if not self._fail_over(task_id, task_stream, state, e):
+                    raise
+
+    async def _run_stream_async(self, task_id, task_stream, state):
+        while True:
+            device = self._get_async_device(state.client_id)
+            try:
+                return await device.stream_video(task_id, task_stream, state)
+            except Exception as e:
+                if not self._fail_over(task_id, task_stream, state, e):
+                    raise
 
-    def start_task(self, task_type, client_id):
-        if client_id not in self.external_devices:
-            logging.error(f"Invalid client ID: {client_id}")
+    def _fail_over(self, task_id, task_stream, state, error):
+        if state.stop_requested or not (isinstance(error, grpc.RpcError) or state.failover_requested):
+            return False
+        state.failover_requested = False
+        source = state.client_id
+        if state.failovers >= self.max_stream_failovers:
+            logger.error(f"Stream {task_id} reached {state.failovers} failovers, giving up")
+            return False
+        target = self.scheduler.choose(
+            accept=lambda client_id: client_id != source
+            and self.health_checker.supports(client_id, task_stream.processing_type)
+        )
+        if target is None:
+            logger.error(f"No healthy device supports {task_stream.processing_type} for stream {task_id}")
+            return False
+        state.failovers += 1
+        state.client_id = target
+        self.registry.assign_client(task_id, target)
+        self.event_recorder.reassign(task_id, target)
+        self._snapshot_changed()
+        logger.warning(f"Stream {task_id} failing over from {source} to {target}: {error}")
+        self.add_alert({
+            'type': 'stream_failover',
+            'severity': 'warning',
+            'message': f"Stream {task_id} moved from {source} to {target}: {error}",
+            'task_id': task_id,
+            'client_id': source,
+            'target_client_id': target
+        })
+        return True
+
+    def _on_device_down(self, client_id, error):
+        self.add_alert({
+            'type': 'device_down',
+            'severity': 'error',
+            'message': f"Edge device {client_id} is not answering health checks: {error}",
+            'client_id': client_id
+        })
+        for task_id in self.registry.task_ids_for_client(client_id):
+            state = self.stream_supervisor.get_state(task_id)
+            if state is not None and state.state == 'running':
+                state.request_failover()
+
+    def _on_device_up(self, client_id):
+        self.add_alert({
+            'type': 'device_up',
+            'severity': 'info',
+            'message': f"Edge device {client_id} is answering health checks again",
+            'client_id': client_id
+        })
+
+    def get_device_health(self):
+        return self.health_checker.stats()
+
+    async def start_task_async(self, task_type, client_id, input_device='/dev/video0', queue_settings=None, payload="",
+                               profile=None, settings=None):
+        if not self.registry.has_client(client_id):
+            logger.error(f"Invalid client ID: {client_id}")
             return
         task_id = str(uuid.uuid4())
         try:
+            device = self._get_async_device(client_id)
             if task_type == 'video_stream':
-                self.ffmpeg_manager.start_stream(task_id)
-                if client_id in self.external_devices:
-                    self.tasks[task_id] = {
-                        'type': task_type,
-                        'client_id': client_id
-                    }
-                    logging.info(f"Started video stream task {task_id} for client {client_id}")
-                    self.external_devices[client_id].stream_video(task_id, self.ffmpeg_manager)
+                task_stream = self._subscribe_stream(task_id, client_id, input_device, queue_settings, profile,
+                                                     self._stream_settings(device, settings))
+                self.stream_supervisor.submit_async(
+                    task_id,
+                    client_id,
+                    lambda state: self._run_stream_async(task_id, task_stream, state),
+                    on_exit=self._on_stream_exit
+                )
+                logger.info(f"Started video stream task {task_id} for client {client_id} (asyncio)")
             else:
-                if client_id in self.external_devices:
-                    self.tasks[task_id] = {
-                        'type': task_type,
-                        'client_id': client_id
-                    }
-                    self.external_devices[client_id].send_task(task_id, task_type)
-                    logging.info(f"Started task {task_id} of type {task_type} for client {client_id}")
+                self.registry.add_task(task_id, task_type, client_id)
+                try:
+                    await device.send_task(task_id, task_type, payload)
+                except Exception as e:
+                    self._task_failed(task_id, e)
+                    raise
+                self.registry.set_state(task_id, 'sent')
+                logger.info(f"Started task {task_id} of type {task_type} for client {client_id} (asyncio)")
             return task_id
         except Exception as e:
-            logging.error(f"Failed to start task {task_id}: {e}")
+            logger.error(f"Failed to start task {task_id}: {e}")
+            raise
+
+    async def retrieve_saved_frames_async(self, client_id):
+        try:
+            if self.registry.has_client(client_id):
+                return await self._get_async_device(client_id).retrieve_frames()
+            else:
+                logger.error(f"Client {client_id} does not exist")
+                return None
+        except Exception as e:
+            logger.error(f"Failed to retrieve saved frames for client {client_id}: {e}")
             raise
 
+    async def close_async(self):
+        # Closes the devices of the calling event loop
+        with self.async_devices_lock:
+            devices = list(self.async_external_devices.pop(asyncio.get_running_loop(), {}).values())
+        await asyncio.gather(*(device.close() for device in devices), return_exceptions=True)
+
+    def _get_async_device(self, client_id):
+        # Created lazily on the caller's event loop, which grpc.aio channels are bound to
+        loop = asyncio.get_running_loop()
+        with self.async_devices_lock:
+            # Devices of event loops that have since closed can never be used again
+            for closed in [other for other in self.async_external_devices if other.is_closed()]:
+                del self.async_external_devices[closed]
+            devices = self.async_external_devices.setdefault(loop, {})
+            device = devices.get(client_id)
+            if device is None:
+                sync_device = self.registry.get_client(client_id)
+                device = AsyncExternalDeviceManager(
+                    sync_device.address,
+                    options=self.channel_pool.options,
+                    compression=self.channel_pool.compression
+                )
+                device.processing_type = sync_device.processing_type
+                devices[client_id] = device
+        return device
+
+    def _async_devices_for(self, client_id):
+        with self.async_devices_lock:
+            return [devices[client_id] for devices in self.async_external_devices.values() if client_id in devices]
+
+    def _close_async_devices(self, client_id):
+        # Each channel has to be closed on its own loop, which may belong to another thread
+        with self.async_devices_lock:
+            removed = [(loop, devices.pop(client_id)) for loop, devices in self.async_external_devices.items()
+                       if client_id in devices]
+        for loop, device in removed:
+            if loop.is_closed():
+                continue
+            try:
+                asyncio.run_coroutine_threadsafe(device.close(), loop)
+            except RuntimeError as e:
+                logger.warning(f"Could not close asyncio channel of client {client_id}: {e}")
+
+    def _stream_settings(self, device, settings):
+        # The device's processing type is only the default for new streams
+        stream_settings = StreamSettings(processing_type=device.processing_type)
+        if settings:
+            stream_settings.update(**settings)
+        return stream_settings
+
+    def _subscribe_stream(self, task_id, client_id, input_device, queue_settings, profile=None, stream_settings=None):
+        validate_input_device(input_device, self.input_devices)
+        settings = dict(DEFAULT_QUEUE_SETTINGS)
+        settings.update(queue_settings or {})
+        unknown = set(settings) - set(DEFAULT_QUEUE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown queue settings: {sorted(unknown)}")
+        subscription = self.capture_hub.subscribe(input_device, task_id, profile=profile, **settings)
+        task_stream = TaskStream(subscription, stream_settings or StreamSettings())
+        self.subscriptions[task_id] = subscription
+        self.task_streams[task_id] = task_stream
+        self.registry.add_task(task_id, 'video_stream', client_id, state='running', input_device=input_device,
+                               queue_settings=settings)
+        self.event_recorder.attach(task_id, client_id, subscription.capture)
+        return task_stream
+
     def stop_task(self, task_id):
-        if task_id not in self.tasks:
-            logging.warning(f"Task {task_id} does not exist")
+        task = self.registry.get_task(task_id)
+        if task is None:
+            logger.warning(f"Task {task_id} does not exist")
             return
         try:
-            if task_id in self.tasks:
-                task_type = self.tasks[task_id]['type']
-                if task_type == 'video_stream':
-                    self.ffmpeg_manager.stop_stream(task_id)
-                #del self.tasks[task_id]
-                logging.info(f"Stopped task {task_id}")
+            if task['type'] == 'video_stream':
+                if task['state'] not in ('stopped', 'failed'):
+                    self.registry.set_state(task_id, 'stopping')
+                self.stream_supervisor.request_stop(task_id)
+                self._release_subscription(task_id)
+                self._snapshot_changed()
             else:
-                logging.warning(f"Task {task_id} does not exist")
+                self.registry.set_state(task_id, 'stopped')
+            logger.info(f"Stopped task {task_id}")
         except Exception as e:
-            logging.error(f"Failed to stop task {task_id}: {e}")
+            logger.error(f"Failed to stop task {task_id}: {e}")
             raise
 
+    def _release_subscription(self, task_id):
+        self.event_recorder.detach(task_id)
+        self.task_streams.pop(task_id, None)
+        subscription = self.subscriptions.pop(task_id, None)
+        if subscription is not None:
+            self.capture_hub.unsubscribe(subscription)
+
+    def _on_stream_exit(self, state):
+        # The worker may exit on its own (edge device gone, ffmpeg died), so make
+        # sure the capture does not outlive its last subscriber.
+        self._release_subscription(state.task_id)
+        self.registry.set_state(state.task_id, state.state)
+        self._snapshot_changed()
+
+    def get_task_status(self, task_id):
+        task = self.registry.get_task(task_id)
+        if task is None:
+            logger.warning(f"Task {task_id} does not exist")
+            return None
+        status = self.stream_supervisor.get_status(task_id)
+        if status is None:
+            status = {'task_id': task_id, 'client_id': task['client_id'], 'state': task['state']}
+            if task.get('error'):
+                status['error'] = task['error']
+        status['type'] = task['type']
+        subscription = self.subscriptions.get(task_id)
+        if subscription is not None:
+            status['queue_depth'] = subscription.queue_depth()
+            status['dropped_frames'] = subscription.dropped_frames
+            status['profile'] = subscription.capture.profile['name']
+            status['codec'] = subscription.codec
+        task_stream = self.task_streams.get(task_id)
+        if task_stream is not None:
+            status['settings'] = task_stream.to_dict()
+        return status
+
+    def get_latest_frame(self, task_id, after_seq=-1, timeout=0):
+        # (seq, frame, codec) from the task's capture ring, waiting up to timeout
+        # for a frame newer than after_seq; frame is None if none arrived. None
+        # when the task has no running stream.
+        subscription = self.subscriptions.get(task_id)
+        if subscription is None:
+            return None
+        capture = subscription.capture
+        entry = capture.wait_for_frame(after_seq, timeout)
+        if entry is None:
+            if capture.ended or capture.stopping:
+                return None
+            return after_seq, None, capture.profile['codec']
+        return entry[0], entry[2], entry[3]
+
+    def list_task_statuses(self, client_id=None, task_type=None, state=None):
+        if client_id is not None:
+            task_ids = self.registry.task_ids_for_client(client_id)
+        elif task_type is not None:
+            task_ids = self.registry.task_ids_of_type(task_type)
+        elif state is not None:
+            task_ids = self.registry.task_ids_in_state(state)
+        else:
+            task_ids = self.registry.list_task_ids()
+        statuses = []
+        for task_id in task_ids:
+            status = self.get_task_status(task_id)
+            if status is None:
+                continue
+            if task_type is not None and status['type'] != task_type:
+                continue
+            if state is not None and status['state'] != state:
+                continue
+            statuses.append(status)
+        return statuses
+
+    def shutdown(self):
+        logger.info("Shutting down distribution manager")
+        if self.snapshot is not None:
+            # Before the tasks are stopped, so the next start brings them back
+            self.snapshot.close()
+        self.alert_store.close()
+        active = self.registry.task_ids_in_state('pending') + self.registry.task_ids_in_state('running')
+        for task_id in active:
+            try:
+                self.stop_task(task_id)
+            except Exception as e:
+                logger.error(f"Failed to stop task {task_id} during shutdown: {e}")
+        self.health_checker.stop()
+        self.stream_supervisor.shutdown(wait=False)
+        self.dispatch_executor.shutdown(wait=False)
+        self.event_recorder.close()
+        self.capture_hub.stop_all()
+        self.ffmpeg_manager.shutdown()
+        self.frame_store.close()
+        self.channel_pool.close_all()
+
     def update_task_settings(self, task_id, settings):
         try:
-            if task_id in self.tasks:
-                client_id = self.tasks[task_id]['client_id']
-                if 'processing_type' in settings and client_id in self.external_devices:
-                    self.external_devices[client_id].update_processing_type(settings['processing_type'])
-                logging.info(f"Updated settings for task {task_id} with settings {settings}")
+            task = self.registry.get_task(task_id)
+            if task is not None:
+                client_id = task['client_id']
+                device = self.registry.get_client(client_id)
+                task_stream = self.task_streams.get(task_id)
+                live = {key: settings[key] for key in LIVE_SETTINGS if key in settings}
+                if task_stream is not None:
+                    # Picked up by the stream worker on the next VideoChunk
+                    task_stream.settings.update(**live)
+                elif 'processing_type' in settings and device is not None:
+                    # Not a running stream: set the default for streams started later
+                    device.update_processing_type(settings['processing_type'])
+                    for async_device in self._async_devices_for(client_id):
+                        async_device.update_processing_type(settings['processing_type'])
+                if 'profile' in settings:
+                    if task['type'] != 'video_stream' or task_id not in self.subscriptions:
+                        raise ValueError(f"Task {task_id} is not a running video stream")
+                    # The profile belongs to the device capture, so it applies to every stream sharing it
+                    self.capture_hub.set_profile(task['input_device'], settings['profile'])
+                logger.info(f"Updated settings for task {task_id} with settings {settings}")
+                self._snapshot_changed()
             else:
-                logging.warning(f"Task {task_id} does not exist")
+                logger.warning(f"Task {task_id} does not exist")
         except Exception as e:
-            logging.error(f"Failed to update settings for task {task_id}: {e}")
+            logger.error(f"Failed to update settings for task {task_id}: {e}")
             raise
 
     def add_alert(self, alert):
         try:
-            self.alerts.append(alert)
-            logging.info(f"New alert added: {alert}")
+            record = self.alert_store.add(alert)
+            logger.info("New alert %d added with severity %s", record['seq'], record['severity'])
+            if record.get('type') not in UNRECORDED_ALERT_TYPES:
+                try:
+                    self.event_recorder.trigger(record)
+                except Exception as e:
+                    # The alert itself is already stored, a failed recording must not lose it
+                    logger.error(f"Failed to start event recording for alert {record['seq']}: {e}")
+            return record
         except Exception as e:
-            logging.error(f"Failed to add alert: {e}")
+            logger.error(f"Failed to add alert: {e}")
             raise
 
-    def get_alerts(self):
+    def _on_ffmpeg_restart(self, stream_id, reason, restarts, gave_up):
+        if gave_up:
+            message = f"ffmpeg for {stream_id} gave up after {restarts} restarts: {reason}"
+        else:
+            message = f"ffmpeg for {stream_id} restarted (restart {restarts}): {reason}"
+        self.add_alert({
+            'type': 'ffmpeg_restart',
+            'severity': 'error' if gave_up else 'warning',
+            'message': message,
+            'stream_id': stream_id,
+            'restarts': restarts,
+            'gave_up': gave_up
+        })
+
+    def get_alerts(self, since=0, min_severity=None, client_id=None, limit=100):
         try:
-            return self.alerts
+            return self.alert_store.query(since=since, min_severity=min_severity, client_id=client_id, limit=limit)
         except Exception as e:
-            logging.error(f"Failed to get alerts: {e}")
+            logger.error(f"Failed to get alerts: {e}")
             raise
 
+    def list_event_segments(self, client_id=None):
+        return self.event_recorder.list_segments(client_id)
+
+    def get_event_segment_path(self, client_id, name):
+        return self.event_recorder.segment_path(client_id, name)
+
+    def get_event_recorder_stats(self):
+        return self.event_recorder.stats()
+
+    def wait_for_alerts(self, since, timeout=None):
+        return self.alert_store.wait_for(since, timeout)
+
     def clear_alerts(self):
         try:
-            self.alerts.clear()
-            logging.info("All alerts cleared")
+            self.alert_store.clear()
+            logger.info("All alerts cleared")
+        except Exception as e:
+            logger.error(f"Failed to clear alerts: {e}")
+            raise
+
+    def collect_metrics(self):
+        families = MetricFamilies()
+        for state in self.stream_supervisor.list_states():
+            labels = {'task_id': state.task_id, 'client_id': state.client_id}
+            fps, bytes_per_second = state.rates()
+            families.add('addon_stream_frames_total', 'counter', 'Frames sent to the edge device', labels, state.chunks_sent)
+            families.add('addon_stream_bytes_total', 'counter', 'Frame bytes sent to the edge device', labels, state.bytes_sent)
+            families.add('addon_stream_fps', 'gauge', 'Frames sent per second over the last second', labels, fps)
+            families.add('addon_stream_bytes_per_second', 'gauge', 'Bytes sent per second over the last second',
+                         labels, bytes_per_second)
+            families.add_histogram('addon_stream_frame_size_bytes', 'Size of frames sent to the edge device',
+                                   labels, state.frame_sizes)
+            families.add_histogram('addon_stream_send_latency_seconds', 'Time gRPC took to send each VideoChunk',
+                                   labels, state.send_latency)
+            subscription = self.subscriptions.get(state.task_id)
+            if subscription is not None:
+                families.add('addon_stream_queue_depth', 'gauge', 'Captured frames waiting for the stream',
+                             labels, subscription.queue_depth())
+                families.add('addon_stream_dropped_frames_total', 'counter', 'Frames dropped because the stream fell behind',
+                             labels, subscription.dropped_frames)
+            task_stream = self.task_streams.get(state.task_id)
+            if task_stream is not None:
+                families.add('addon_stream_skipped_frames_total', 'counter', 'Frames removed by frame_skip/max_fps',
+                             labels, task_stream.skipped_frames)
+                families.add('addon_stream_suppressed_frames_total', 'counter', 'Frames held back by the motion gate',
+                             labels, task_stream.suppressed_frames)
+        for stream_id, stats in self.ffmpeg_manager.list_stream_stats().items():
+            labels = {'stream_id': stream_id}
+            families.add('addon_ffmpeg_up', 'gauge', 'Whether the ffmpeg process is running', labels, int(stats['running']))
+            families.add('addon_ffmpeg_restarts_total', 'counter', 'ffmpeg restarts', labels, stats['restarts'])
+            families.add('addon_ffmpeg_fps', 'gauge', 'Encoding fps reported by ffmpeg', labels, stats.get('fps'))
+            families.add('addon_ffmpeg_cpu_seconds_total', 'counter', 'CPU time used by the ffmpeg process',
+                         labels, stats.get('cpu_seconds'))
+            families.add('addon_ffmpeg_resident_memory_bytes', 'gauge', 'Resident memory of the ffmpeg process',
+                         labels, stats.get('rss_bytes'))
+        return families
+
+    def sync_saved_frames(self, client_id):
+        try:
+            device = self.registry.get_client(client_id)
+            if device is not None:
+                since_timestamp = self.frame_store.last_timestamp(client_id)
+                frames = device.iter_frames(since_timestamp=since_timestamp)
+                added = self.frame_store.append_many(client_id, frames)
+                logger.debug("Synced %d new frames for client %s", added, client_id)
+                return {
+                    'new': added,
+                    'count': self.frame_store.count(client_id),
+                    'latest': self.frame_store.last_timestamp(client_id)
+                }
+            else:
+                logger.error(f"Client {client_id} does not exist")
+                return None
+        except Exception as e:
+            logger.error(f"Failed to sync saved frames for client {client_id}: {e}")
+            raise
+
+    def get_stored_frames(self, client_id, start=None, end=None, limit=0, with_images=True):
+        try:
+            return self.frame_store.query(client_id, start=start, end=end, limit=limit, with_images=with_images)
+        except Exception as e:
+            logger.error(f"Failed to query stored frames for client {client_id}: {e}")
+            raise
+
+    def retrieve_saved_frames(self, client_id, since_timestamp=None, limit=0):
+        try:
+            if self.registry.has_client(client_id):
+                self.sync_saved_frames(client_id)
+                return self.frame_store.query(client_id, start=since_timestamp, limit=limit)
+            else:
+                logger.error(f"Client {client_id} does not exist")
+                return None
         except Exception as e:
-            logging.error(f"Failed to clear alerts: {e}")
+            logger.error(f"Failed to retrieve saved frames for client {client_id}: {e}")
             raise
 
-    def retrieve_saved_frames(self, client_id):
+    def get_frame_summary(self, client_id, since_timestamp=None):
         try:
-            if client_id in self.external_devices:
-                return self.external_devices[client_id].retrieve_frames()
+            device = self.registry.get_client(client_id)
+            if device is not None:
+                return device.retrieve_frame_summary(since_timestamp=since_timestamp)
             else:
-                logging.error(f"Client {client_id} does not exist")
+                logger.error(f"Client {client_id} does not exist")
                 return None
         except Exception as e:
-            logging.error(f"Failed to retrieve saved frames for client {client_id}: {e}")
+            logger.error(f"Failed to retrieve frame summary for client {client_id}: {e}")
             raise
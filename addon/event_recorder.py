@@ -0,0 +1,343 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_EXTENSIONS = {'mjpeg': '.mjpeg', 'h264': '.h264'}
+SEGMENT_NAME = re.compile(r'^[\w.-]+\.(mjpeg|h264)$')
+
+
+class PreRoll:
+    # The last `seconds` of capture ring entries (seq, capture time, frame, codec, keyframe)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.entries = deque()
+
+    def append(self, entry):
+        self.entries.append(entry)
+        cutoff = entry[1] - self.seconds
+        while self.entries[0][1] < cutoff:
+            self.entries.popleft()
+
+    def snapshot(self):
+        entries = list(self.entries)
+        # An H.264 segment has to open on a keyframe to be decodable
+        for index, entry in enumerate(entries):
+            if entry[4]:
+                return entries[index:]
+        return []
+
+
+class Recording:
+    def __init__(self, task_id, client_id, alert, codec, path, ends_at, pre_roll):
+        self.task_id = task_id
+        self.client_id = client_id
+        self.alerts = [alert.get('seq')]
+        self.codec = codec
+        self.path = path
+        self.ends_at = ends_at
+        # Written when the writer opens the file
+        self.pre_roll = pre_roll
+        self.finished = False
+        self.started_at = None
+        self.last_frame_at = None
+        self.frames = 0
+        self.bytes = 0
+        self.file = None
+
+    def to_dict(self):
+        return {
+            'name': os.path.basename(self.path),
+            'task_id': self.task_id,
+            'client_id': self.client_id,
+            'alerts': self.alerts,
+            'codec': self.codec,
+            'start': self.started_at,
+            'end': self.last_frame_at,
+            'frames': self.frames,
+            'bytes': self.bytes
+        }
+
+
+class RecordedStream:
+    def __init__(self, task_id, client_id, capture, pre_roll_seconds):
+        self.task_id = task_id
+        self.client_id = client_id
+        self.capture = capture
+        self.pre_roll = PreRoll(pre_roll_seconds)
+        self.recording = None
+        self.listener = None
+
+
+class EventRecorder:
+    # Keeps a pre-roll of every stream in memory and, when an alert names the
+    # stream's client, writes the pre-roll plus the next post_roll_seconds to a
+    # segment file: concatenated JPEGs or an Annex B H.264 elementary stream,
+    # with a JSON sidecar. Capture threads only append to deques and never
+    # block; file I/O runs on a single writer thread.
+
+    def __init__(self, root_dir='/data/events', pre_roll_seconds=5.0, post_roll_seconds=10.0,
+                 max_bytes=1024 ** 3, queue_size=1024):
+        if pre_roll_seconds < 0 or post_roll_seconds < 0:
+            raise ValueError("pre_roll_seconds and post_roll_seconds must not be negative")
+        self.root_dir = root_dir
+        self.pre_roll_seconds = pre_roll_seconds
+        self.post_roll_seconds = post_roll_seconds
+        self.max_bytes = max_bytes
+        self.streams = {}
+        self.lock = threading.Lock()
+        # Unbounded so opening and finishing a segment never block or get lost;
+        # only frames are bounded, by write_slots, and dropped when the writer
+        # falls behind
+        self.queue = queue.Queue()
+        self.write_slots = threading.Semaphore(queue_size)
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        # Finished segments, oldest first: (path, bytes including sidecar)
+        self.segments = None
+        self.segments_lock = threading.Lock()
+        self.dropped_frames = 0
+        self.closed = False
+
+    def attach(self, task_id, client_id, capture):
+        stream = RecordedStream(task_id, client_id, capture, self.pre_roll_seconds)
+        stream.listener = lambda entry: self._on_frame(stream, entry)
+        with self.lock:
+            previous = self.streams.pop(task_id, None)
+            self.streams[task_id] = stream
+        if previous is not None:
+            self._detach(previous)
+        capture.add_listener(stream.listener)
+
+    def detach(self, task_id):
+        with self.lock:
+            stream = self.streams.pop(task_id, None)
+        if stream is not None:
+            self._detach(stream)
+
+    def _detach(self, stream):
+        stream.capture.remove_listener(stream.listener)
+        with self.lock:
+            recording, stream.recording = stream.recording, None
+        if recording is not None:
+            self._enqueue(('finish', recording, None))
+
+    def reassign(self, task_id, client_id):
+        # After a failover the stream answers to alerts from its new device
+        with self.lock:
+            stream = self.streams.get(task_id)
+            if stream is not None:
+                stream.client_id = client_id
+
+    def trigger(self, alert):
+        client_id = alert.get('client_id')
+        if client_id is None or self.closed:
+            return []
+        ends_at = time.time() + self.post_roll_seconds
+        started = []
+        with self.lock:
+            for stream in self.streams.values():
+                if stream.client_id != client_id:
+                    continue
+                if stream.recording is not None:
+                    # Alerts that overlap a recording extend it instead of opening another file
+                    stream.recording.ends_at = max(stream.recording.ends_at, ends_at)
+                    stream.recording.alerts.append(alert.get('seq'))
+                    continue
+                entries = stream.pre_roll.snapshot()
+                codec = entries[0][3] if entries else stream.capture.profile['codec']
+                recording = Recording(stream.task_id, client_id, alert, codec,
+                                      self._segment_path(stream.task_id, client_id, alert, codec), ends_at, entries)
+                stream.recording = recording
+                started.append(recording)
+        for recording in started:
+            self._enqueue(('open', recording, None))
+            logger.info(f"Recording event segment {recording.path} for alert {alert.get('seq')}")
+        return [recording.path for recording in started]
+
+    def _segment_path(self, task_id, client_id, alert, codec):
+        if not client_id or client_id.startswith('.') or os.sep in client_id:
+            raise ValueError(f"Invalid client ID for event recording: {client_id}")
+        alerted_at = alert.get('timestamp')
+        if not isinstance(alerted_at, (int, float)):
+            alerted_at = time.time()
+        stamp = datetime.fromtimestamp(alerted_at).strftime('%Y%m%dT%H%M%S')
+        name = f"{stamp}-{alert.get('seq', 0)}-{task_id}{SEGMENT_EXTENSIONS.get(codec, '.bin')}"
+        return os.path.join(self.root_dir, client_id, name)
+
+    def _on_frame(self, stream, entry):
+        # Runs on the capture reader thread, so it must stay cheap
+        with self.lock:
+            stream.pre_roll.append(entry)
+            recording = stream.recording
+            if recording is None:
+                return
+            if entry[1] >= recording.ends_at or entry[3] != recording.codec:
+                stream.recording = None
+                operation = ('finish', recording, None)
+            else:
+                operation = ('write', recording, entry)
+        self._enqueue(operation)
+
+    def _enqueue(self, operation):
+        if self.writer is None:
+            self._start_writer()
+        if operation[0] == 'write' and not self.write_slots.acquire(blocking=False):
+            self.dropped_frames += 1
+            return
+        self.queue.put(operation)
+
+    def _start_writer(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name='event-recorder', daemon=True)
+                self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            operation, recording, data = self.queue.get()
+            try:
+                if operation == 'stop':
+                    return
+                if operation == 'open':
+                    self._open(recording)
+                elif operation == 'write':
+                    self._write(recording, data)
+                elif operation == 'finish':
+                    self._finish(recording)
+            except Exception as e:
+                logger.error("Event recorder failed to %s %s: %s", operation, recording.path, e)
+            finally:
+                if operation == 'write':
+                    self.write_slots.release()
+                self.queue.task_done()
+
+    def flush(self):
+        # Wait until everything queued so far is on disk
+        if self.writer is not None:
+            self.queue.join()
+
+    def _open(self, recording):
+        # trigger() enqueues the open after releasing the lock, so a frame or the
+        # finish can reach the writer first; whichever does opens the file
+        if recording.file is not None or recording.finished:
+            return
+        os.makedirs(os.path.dirname(recording.path), exist_ok=True)
+        recording.file = open(recording.path, 'wb')
+        entries, recording.pre_roll = recording.pre_roll, []
+        for entry in entries:
+            self._write(recording, entry)
+
+    def _write(self, recording, entry):
+        self._open(recording)
+        if recording.file is None:
+            return
+        if recording.started_at is None:
+            recording.started_at = entry[1]
+        recording.file.write(entry[2])
+        recording.last_frame_at = entry[1]
+        recording.frames += 1
+        recording.bytes += len(entry[2])
+
+    def _finish(self, recording):
+        self._open(recording)
+        if recording.file is None:
+            return
+        recording.file.close()
+        recording.file = None
+        recording.finished = True
+        with self.segments_lock:
+            # Before the sidecar exists, so the scan does not pick this segment up as well
+            self._load_segments()
+            sidecar = recording.path + '.json'
+            with open(sidecar, 'w') as metadata_file:
+                json.dump(recording.to_dict(), metadata_file)
+            logger.info(f"Finished event segment {recording.path}: {recording.frames} frames, "
+                         f"{recording.bytes} bytes")
+            self.segments.append((recording.path, recording.bytes + os.path.getsize(sidecar)))
+            self._evict()
+
+    def _load_segments(self):
+        # Segments left by an earlier run count against the budget too
+        if self.segments is not None:
+            return
+        found = []
+        if os.path.isdir(self.root_dir):
+            for client_id in os.listdir(self.root_dir):
+                directory = os.path.join(self.root_dir, client_id)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    if SEGMENT_NAME.match(name) and os.path.exists(path + '.json'):
+                        size = os.path.getsize(path) + os.path.getsize(path + '.json')
+                        found.append((os.path.getmtime(path), path, size))
+        self.segments = deque((path, size) for _, path, size in sorted(found))
+
+    def _evict(self):
+        total = sum(size for _, size in self.segments)
+        # Keep the newest segment even if it alone is over the budget
+        while self.max_bytes and total > self.max_bytes and len(self.segments) > 1:
+            path, size = self.segments.popleft()
+            total -= size
+            logger.info(f"Evicting event segment {path}")
+            for stale in (path, path + '.json'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+    def list_segments(self, client_id=None):
+        # Metadata of finished segments, oldest first
+        with self.segments_lock:
+            self._load_segments()
+            paths = [path for path, _ in self.segments]
+        segments = []
+        for path in paths:
+            if client_id is not None and os.path.basename(os.path.dirname(path)) != client_id:
+                continue
+            try:
+                with open(path + '.json') as metadata_file:
+                    segments.append(json.load(metadata_file))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read metadata of event segment {path}: {e}")
+        return segments
+
+    def segment_path(self, client_id, name):
+        if not SEGMENT_NAME.match(name) or not client_id or os.sep in client_id or client_id.startswith('.'):
+            return None
+        path = os.path.join(self.root_dir, client_id, name)
+        return path if os.path.exists(path + '.json') else None
+
+    def stats(self):
+        with self.lock:
+            recording = [stream.task_id for stream in self.streams.values() if stream.recording is not None]
+            streams = len(self.streams)
+        with self.segments_lock:
+            self._load_segments()
+            segments = list(self.segments)
+        return {
+            'streams': streams,
+            'recording': recording,
+            'segments': len(segments),
+            'bytes': sum(size for _, size in segments),
+            'dropped_frames': self.dropped_frames
+        }
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            task_ids = list(self.streams)
+        for task_id in task_ids:
+            self.detach(task_id)
+        if self.writer is not None:
+            self.queue.put(('stop', None, None))
+            self.writer.join(timeout=5)
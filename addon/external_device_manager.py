@@ -1,14 +1,40 @@
 import logging
+import time
 import grpc
 import workloads_pb2
 import workloads_pb2_grpc
 from google.protobuf.json_format import MessageToDict
+from channel_pool import ChannelPool
+from chunk_codec import RawVideoChunk, RawVideoStreamerStub
+from metrics import record_rpc, record_rpc_error
+from log_setup import Lazy
+
+logger = logging.getLogger(__name__)
+
+
+def filter_frames(frames, since_timestamp, limit, metadata_only):
+    # Applies a FrameQuery to the full RetrieveFrames answer of an older edge device
+    count = 0
+    for frame in frames:
+        if since_timestamp and frame["timestamp"] <= since_timestamp:
+            continue
+        if limit and count >= limit:
+            return
+        count += 1
+        yield {
+            "image": b"" if metadata_only else frame["image"],
+            "timestamp": frame["timestamp"],
+            "size": len(frame["image"])
+        }
+
 
 class ExternalDeviceManager:
-    logging.basicConfig(level=logging.INFO)
-    
-    def __init__(self, address):
+    def __init__(self, address, channel_pool=None, max_retries=5, initial_backoff=0.5, max_backoff=10.0):
         self.address = address
+        self.channel_pool = channel_pool or ChannelPool()
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
         self.channel = None
         self.video_stub = None
         self.task_stub = None
@@ -17,76 +43,231 @@ class ExternalDeviceManager:
 
     def connect(self):
         try:
-            self.channel = grpc.insecure_channel(self.address)
-            self.video_stub = workloads_pb2_grpc.VideoStreamerStub(self.channel)
+            self.channel = self.channel_pool.acquire(self.address)
+            self.video_stub = RawVideoStreamerStub(self.channel)
             self.task_stub = workloads_pb2_grpc.TaskManagerStub(self.channel)
-            logging.info(f"Connected to gRPC server at {self.address}")
+            logger.info(f"Connected to gRPC server at {self.address}")
         except Exception as e:
-            logging.error(f"Failed to connect to gRPC server: {e}")
+            logger.error(f"Failed to connect to gRPC server: {e}")
             raise
 
     def reconnect(self):
-        logging.info("Reconnecting to gRPC server...")
-        self.connect()
+        # The pooled channel re-establishes its transport on its own; waiting for
+        # readiness triggers the connection attempt and tells us when to retry.
+        logger.info(f"Reconnecting to gRPC server at {self.address}...")
+        return self.channel_pool.wait_ready(self.address)
+
+    def wait_ready(self, timeout=None):
+        return self.channel_pool.wait_ready(self.address, timeout)
+
+    def close(self):
+        if self.channel is not None:
+            self.channel_pool.release(self.address)
+            self.channel = None
+
+    def _is_unavailable(self, error):
+        code = getattr(error, 'code', None)
+        return callable(code) and code() == grpc.StatusCode.UNAVAILABLE
+
+    def _backoff(self, attempt):
+        return min(self.initial_backoff * (2 ** attempt), self.max_backoff)
+
+    def _call_with_retry(self, description, rpc, request):
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                response = rpc(request)
+                record_rpc(self.address, description, started)
+                return response
+            except grpc.RpcError as e:
+                record_rpc_error(self.address, description, e)
+                if not self._is_unavailable(e) or attempt >= self.max_retries:
+                    record_rpc(self.address, description, started)
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning("%s to %s unavailable, retry %d/%d in %.1fs", description, self.address, attempt, self.max_retries,
+                               delay)
+                time.sleep(delay)
+                self.reconnect()
+
+    def stream_video(self, task_id, frame_source, stream_state=None):
+        progress = {'frames': 0, 'ended': False}
+
+        def generate_video_chunks(call_ref):
+            processing_type = frame_source.processing_type
+            yield RawVideoChunk(processing_type=processing_type)
+            while True:
+                frame = frame_source.get_next_frame()
+                if not frame:
+                    progress['ended'] = True
+                    break
+                if getattr(stream_state, 'failover_requested', False):
+                    # Cancel rather than raise: grpc logs a traceback for a request
+                    # iterator that raises
+                    if call_ref:
+                        call_ref[0].cancel()
+                    return
+                # Read per chunk so live settings changes apply to the next frame, but
+                # only put processing_type on the wire when it actually changed
+                current = frame_source.processing_type
+                chunk = RawVideoChunk(frame, current if current != processing_type else '', frame_source.codec)
+                processing_type = current
+                # gRPC resumes the generator once it has written the chunk, so the
+                # time spent suspended here is the send (and flow control) latency
+                sent_at = time.perf_counter()
+                yield chunk
+                progress['frames'] += 1
+                if stream_state is not None:
+                    stream_state.record_chunk(len(frame), time.perf_counter() - sent_at)
+
+        attempt = 0
+        frames_at_failure = 0
+        while True:
+            try:
+                # StreamVideo is client-streaming: the server answers once, after
+                # the request stream has ended.
+                call_ref = []
+                call = self.video_stub.StreamVideo.future(generate_video_chunks(call_ref))
+                call_ref.append(call)
+                if stream_state is not None:
+                    stream_state.call = call
+                try:
+                    if getattr(stream_state, 'failover_requested', False):
+                        call.cancel()
+                    response = call.result()
+                finally:
+                    if stream_state is not None:
+                        stream_state.call = None
+                if getattr(stream_state, 'failover_requested', False):
+                    # The request stream ended for the failover before the call could be cancelled
+                    raise RuntimeError(f"Video stream {task_id} is failing over")
+                logger.debug("Response from server: %s", Lazy(MessageToDict, response))
+                return response
+            except grpc.FutureCancelledError:
+                logger.warning("Video stream %s to %s cancelled for failover", task_id, self.address)
+                raise RuntimeError(f"Video stream {task_id} is failing over")
+            except grpc.RpcError as e:
+                stopping = getattr(stream_state, 'stop_requested', False)
+                failing_over = getattr(stream_state, 'failover_requested', False)
+                if not self._is_unavailable(e) or progress['ended'] or stopping or failing_over:
+                    logger.error(f"gRPC error during video streaming: {e}")
+                    raise
+                if progress['frames'] > frames_at_failure:
+                    # The previous attempt made progress, so this is a new blip
+                    attempt = 0
+                frames_at_failure = progress['frames']
+                if attempt >= self.max_retries:
+                    logger.error(f"gRPC error during video streaming, giving up after {attempt} retries: {e}")
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning("Video stream %s to %s interrupted, retry %d/%d in %.1fs", task_id, self.address, attempt,
+                               self.max_retries, delay)
+                time.sleep(delay)
+                self.reconnect()
+            except Exception as e:
+                logger.error(f"Error during video streaming: {e}")
+                raise
 
-    def stream_video(self, task_id, ffmpeg_manager):
+    def ping(self, timeout=2.0):
+        started = time.perf_counter()
         try:
-            def generate_video_chunks():
-                first_chunk = workloads_pb2.VideoChunk(processing_type=self.processing_type)
-                yield first_chunk
-                while True:
-                    chunk = ffmpeg_manager.get_stream_output(task_id)
-                    if not chunk:
-                        break
-                    yield workloads_pb2.VideoChunk(data=chunk, processing_type=self.processing_type)
-
-            response_iterator = self.video_stub.StreamVideo(generate_video_chunks())
-            for response in response_iterator:
-                logging.info(f"Response from server: {MessageToDict(response)}")
+            response = self.task_stub.Ping(workloads_pb2.PingRequest(), timeout=timeout)
+            processing_types = list(response.processing_types)
         except grpc.RpcError as e:
-            logging.error(f"gRPC error during video streaming: {e}")
-            raise
-        except Exception as e:
-            logging.error(f"Error during video streaming: {e}")
-            raise
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                record_rpc(self.address, "Ping", started, e)
+                raise
+            # Older edge devices have no Ping; answering at all shows they are up
+            processing_types = []
+        record_rpc(self.address, "Ping", started)
+        return {'latency': time.perf_counter() - started, 'processing_types': processing_types}
 
     def send_task(self, task_id, task_type, payload=""):
         try:
             request = workloads_pb2.TaskRequest(task_id=task_id, task_type=task_type, payload=payload)
-            response = self.task_stub.SendTask(request)
+            response = self._call_with_retry("SendTask", self.task_stub.SendTask, request)
             return response
         except grpc.RpcError as e:
-            logging.error(f"gRPC error during sending task: {e}")
+            logger.error(f"gRPC error during sending task: {e}")
             raise
         except Exception as e:
-            logging.error(f"Error during sending task: {e}")
+            logger.error(f"Error during sending task: {e}")
+            raise
+
+    def send_task_batch(self, tasks):
+        # tasks: (task_id, task_type, payload) tuples for this device
+        try:
+            request = workloads_pb2.TaskBatchRequest(tasks=[
+                workloads_pb2.TaskRequest(task_id=task_id, task_type=task_type, payload=payload)
+                for task_id, task_type, payload in tasks
+            ])
+            response = self._call_with_retry("SendTaskBatch", self.task_stub.SendTaskBatch, request)
+            return list(response.responses)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                logger.error(f"gRPC error during sending task batch: {e}")
+                raise
+            # Older edge devices only implement the unary SendTask
+            logger.warning(f"External device at {self.address} does not support SendTaskBatch")
+            return [self.send_task(task_id, task_type, payload) for task_id, task_type, payload in tasks]
+        except Exception as e:
+            logger.error(f"Error during sending task batch: {e}")
             raise
 
     def retrieve_frames(self):
-        logging.info(f"Requesting saved frames from external device at {self.address}")
+        logger.debug("Requesting saved frames from external device at %s", self.address)
         try:
             request = workloads_pb2.TaskRequest(task_id="retrieve_frames", task_type="retrieve_frames", payload="")
-            response = self.task_stub.RetrieveFrames(request)
+            response = self._call_with_retry("RetrieveFrames", self.task_stub.RetrieveFrames, request)
             frames = []
             for frame_data in response.frames:
                 frames.append({
                     "image": frame_data.image,
                     "timestamp": frame_data.timestamp
                 })
-            #logging.info(f"Retrieved frames: {frames}")
+            #logger.info(f"Retrieved frames: {frames}")
             return frames
         except grpc.RpcError as e:
-            logging.error(f"gRPC error during retrieving frames: {e}")
+            logger.error(f"gRPC error during retrieving frames: {e}")
             raise
         except Exception as e:
-            logging.error(f"Error during retrieving frames: {e}")
+            logger.error(f"Error during retrieving frames: {e}")
             raise
 
+    def iter_frames(self, since_timestamp="", limit=0, metadata_only=False):
+        logger.debug("Streaming saved frames from external device at %s since %s", self.address, since_timestamp or 'start')
+        query = workloads_pb2.FrameQuery(since_timestamp=since_timestamp or "", limit=limit, metadata_only=metadata_only)
+        try:
+            for frame_data in self.task_stub.RetrieveFramesStream(query):
+                yield {
+                    "image": frame_data.image,
+                    "timestamp": frame_data.timestamp,
+                    "size": frame_data.size or len(frame_data.image)
+                }
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                logger.error(f"gRPC error during streaming frames: {e}")
+                raise
+            # Older edge devices only implement the unary RetrieveFrames
+            logger.warning(f"External device at {self.address} does not support RetrieveFramesStream")
+            yield from filter_frames(self.retrieve_frames(), since_timestamp, limit, metadata_only)
+
+    def retrieve_frame_summary(self, since_timestamp=""):
+        count = 0
+        latest = None
+        for frame in self.iter_frames(since_timestamp=since_timestamp, metadata_only=True):
+            count += 1
+            latest = frame["timestamp"]
+        return {"count": count, "latest": latest}
+
     def update_processing_type(self, processing_type):
-        logging.info(f"Updating processing type to {processing_type} for external device at {self.address}")
+        logger.info(f"Updating processing type to {processing_type} for external device at {self.address}")
         try:
             self.processing_type = processing_type
-            logging.info(f"Successfully updated processing type to {processing_type}")
+            logger.info(f"Successfully updated processing type to {processing_type}")
         except Exception as e:
-            logging.error(f"Failed to update processing type: {e}")
+            logger.error(f"Failed to update processing type: {e}")
             raise
\ No newline at end of file
@@ -1,60 +1,161 @@
-import subprocess
 import logging
+import threading
+from capture_profiles import build_ffmpeg_command, resolve_profile
+from ffmpeg_supervisor import SupervisedStream
+from h264_demuxer import H264Demuxer
+from mjpeg_demuxer import MJPEGDemuxer
 
-class FFmpegManager:
-    def __init__(self):
-        self.processes = {}
+logger = logging.getLogger(__name__)
 
-    def start_stream(self, stream_id, input_device='/dev/video0'):
-        try:
-            if stream_id in self.processes and self.processes[stream_id].poll() is None:
-                logging.error(f"Stream {stream_id} is already running")
-                return
+DEMUXERS = {
+    'mjpeg': MJPEGDemuxer,
+    'h264': H264Demuxer,
+}
 
-            command = [
-                'ffmpeg',
-                '-i', input_device,
-                '-f', 'image2pipe',
-                '-vcodec', 'mjpeg',
-                '-qscale:v', '2',
-                'pipe:1'
-            ]
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=10**8)
-            self.processes[stream_id] = process
-            logging.info(f"Started stream {stream_id} with input device {input_device}")
+class FFmpegManager:
+    def __init__(self, on_restart=None, stall_timeout=10.0, watchdog_interval=1.0, max_restarts=10):
+        self.on_restart = on_restart
+        self.stall_timeout = stall_timeout
+        self.watchdog_interval = watchdog_interval
+        self.max_restarts = max_restarts
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.watchdog = None
+        self.watchdog_stop = threading.Event()
+
+    @property
+    def processes(self):
+        with self.lock:
+            return {stream_id: stream.process for stream_id, stream in self.streams.items()}
+
+    def start_stream(self, stream_id, input_device='/dev/video0', profile=None):
+        try:
+            with self.lock:
+                previous = self.streams.get(stream_id)
+            if previous is not None:
+                if previous.process.poll() is None:
+                    logger.error(f"Stream {stream_id} is already running")
+                    return
+                self.stop_stream(stream_id)
+
+            profile = resolve_profile(profile)
+            stream = SupervisedStream(
+                stream_id,
+                build_ffmpeg_command(input_device, profile),
+                on_restart=self.on_restart,
+                max_restarts=self.max_restarts,
+                demuxer_factory=DEMUXERS[profile['codec']],
+                codec=profile['codec']
+            )
+            stream.spawn()
+            with self.lock:
+                self.streams[stream_id] = stream
+            self._ensure_watchdog()
+            logger.info(f"Started stream {stream_id} with input device {input_device} and profile {profile['name']}")
         except Exception as e:
-            logging.error(f"Failed to start stream {stream_id}: {e}")
+            logger.error(f"Failed to start stream {stream_id}: {e}")
             raise
 
+    def reconfigure_stream(self, stream_id, input_device, profile):
+        with self.lock:
+            stream = self.streams.get(stream_id)
+        if stream is None:
+            logger.error(f"Stream {stream_id} does not exist")
+            return False
+        profile = resolve_profile(profile)
+        stream.reconfigure(build_ffmpeg_command(input_device, profile), DEMUXERS[profile['codec']], profile['codec'])
+        logger.info(f"Reconfiguring stream {stream_id} with profile {profile['name']}")
+        return True
+
+    def get_stream_codec(self, stream_id):
+        with self.lock:
+            stream = self.streams.get(stream_id)
+        return stream.codec if stream is not None else None
+
     def stop_stream(self, stream_id):
+        # Take the stream out of the table first so concurrent stop calls (HTTP
+        # request and stream worker cleanup) cannot both try to remove it.
+        with self.lock:
+            stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            logger.error(f"Stream {stream_id} does not exist")
+            return
         try:
-            if stream_id in self.processes:
-                self.processes[stream_id].terminate()
-                self.processes[stream_id].wait()
-                del self.processes[stream_id]
-                logging.info(f"Stopped stream {stream_id}")
-            else:
-                logging.error(f"Stream {stream_id} does not exist")
+            stream.stop()
+            logger.info(f"Stopped stream {stream_id}")
         except Exception as e:
-            logging.error(f"Failed to stop stream {stream_id}: {e}")
+            logger.error(f"Failed to stop stream {stream_id}: {e}")
+            # Ensure process is terminated
+            stream.process.kill()
             raise
-        finally:
-            # Ensure process is terminated and removed
-            if stream_id in self.processes:
-                self.processes[stream_id].kill()
-                del self.processes[stream_id]
 
     def get_stream_output(self, stream_id):
         try:
-            if stream_id in self.processes:
-                return self.processes[stream_id].stdout.read(1024 * 1024)
+            with self.lock:
+                stream = self.streams.get(stream_id)
+            if stream is not None:
+                return stream.process.stdout.read(1024 * 1024)
+            else:
+                logger.error(f"Stream {stream_id} does not exist")
+                return None
+        except Exception as e:
+            logger.error(f"Failed to get stream output for {stream_id}: {e}")
+            raise
+
+    def get_next_frame(self, stream_id):
+        try:
+            with self.lock:
+                stream = self.streams.get(stream_id)
+            if stream is not None:
+                return stream.read_frame()
             else:
-                logging.error(f"Stream {stream_id} does not exist")
+                logger.error(f"Stream {stream_id} does not exist")
                 return None
         except Exception as e:
-            logging.error(f"Failed to get stream output for {stream_id}: {e}")
+            logger.error("Failed to get next frame for %s: %s", stream_id, e)
             raise
 
+    def get_stream_stats(self, stream_id):
+        with self.lock:
+            stream = self.streams.get(stream_id)
+        return stream.stats() if stream is not None else None
+
+    def list_stream_stats(self):
+        with self.lock:
+            streams = list(self.streams.items())
+        return {stream_id: stream.stats() for stream_id, stream in streams}
+
+    def get_stream_log(self, stream_id):
+        with self.lock:
+            stream = self.streams.get(stream_id)
+        return list(stream.log) if stream is not None else None
+
+    def _ensure_watchdog(self):
+        with self.lock:
+            if self.watchdog is not None or self.watchdog_stop.is_set():
+                return
+            self.watchdog = threading.Thread(target=self._watch, name='ffmpeg-watchdog', daemon=True)
+            self.watchdog.start()
+
+    def _watch(self):
+        while not self.watchdog_stop.wait(self.watchdog_interval):
+            with self.lock:
+                streams = list(self.streams.values())
+            for stream in streams:
+                try:
+                    stream.check_stall(self.stall_timeout)
+                except Exception as e:
+                    logger.error(f"Watchdog check failed for stream {stream.stream_id}: {e}")
+
+    def shutdown(self):
+        self.watchdog_stop.set()
+        with self.lock:
+            stream_ids = list(self.streams.keys())
+        for stream_id in stream_ids:
+            self.stop_stream(stream_id)
+        if self.watchdog is not None:
+            self.watchdog.join(timeout=5)
+
 
 
 '''
@@ -0,0 +1,352 @@
+import io
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from mjpeg_demuxer import MJPEGDemuxer
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg -progress keys and the metric names they are reported under
+PROGRESS_FIELDS = {
+    'frame': 'frames',
+    'fps': 'fps',
+    'bitrate': 'bitrate_kbps',
+    'total_size': 'total_bytes',
+    'drop_frames': 'dropped_frames',
+    'dup_frames': 'duplicated_frames',
+    'speed': 'speed',
+}
+
+RECONFIGURED = 'reconfigured'
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_usage(pid):
+    # Straight from /proc rather than pulling in psutil; None off Linux or once the process is gone
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/statm') as f:
+            statm = f.read().split()
+    except OSError:
+        return None
+    # comm may contain spaces; utime and stime are fields 14 and 15, counted from state (field 3)
+    fields = stat[stat.rindex(')') + 2:].split()
+    return {
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        'rss_bytes': int(statm[1]) * PAGE_SIZE
+    }
+
+
+def parse_progress_value(value):
+    value = value.strip()
+    for suffix in ('kbits/s', 'x'):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class SupervisedStream:
+    def __init__(self, stream_id, command, on_restart=None, log_size=200, initial_backoff=1.0,
+                 max_backoff=30.0, max_restarts=10, healthy_after=30.0, demuxer_factory=MJPEGDemuxer, codec='mjpeg',
+                 swap_timeout=10.0):
+        self.stream_id = stream_id
+        self.command = command
+        self.demuxer_factory = demuxer_factory
+        self.codec = codec
+        self.pending_config = None
+        self.swap_timeout = swap_timeout
+        self.swapping = False
+        self.swap_process = None
+        self.swap = None
+        self.on_restart = on_restart
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.healthy_after = healthy_after
+        self.log = deque(maxlen=log_size)
+        self.metrics = {}
+        self.process = None
+        self.demuxer = None
+        self.drainer = None
+        self.started_at = None
+        self.last_progress_at = None
+        self.restarts = 0
+        self.consecutive_restarts = 0
+        self.kill_reason = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def spawn(self):
+        with self.lock:
+            if self.stopped.is_set():
+                return None
+            if self.pending_config is not None:
+                self.command, self.demuxer_factory, self.codec = self.pending_config
+                self.pending_config = None
+            process = self._popen(self.command)
+            self.process = process
+            self.demuxer = self.demuxer_factory(process.stdout)
+            self.started_at = self.last_progress_at = time.monotonic()
+            self.kill_reason = None
+            self.metrics = {}
+        self.drainer = self._start_drainer(process)
+        return process
+
+    def _popen(self, command):
+        # Unbuffered: the demuxer reads into its own buffer, and a large pipe
+        # buffer only lets stale video pile up behind a slow consumer.
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def _start_drainer(self, process):
+        # ffmpeg blocks once the stderr pipe fills up, so it has to be read continuously
+        drainer = threading.Thread(target=self._drain_stderr, args=(process,),
+                                   name=f"ffmpeg-stderr-{self.stream_id}", daemon=True)
+        drainer.start()
+        return drainer
+
+    def _drain_stderr(self, process):
+        stream = process.stderr
+        if isinstance(stream, io.RawIOBase):
+            stream = io.BufferedReader(stream)
+        try:
+            for raw_line in stream:
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                if line:
+                    self._handle_stderr_line(process, line)
+        except (OSError, ValueError) as e:
+            if not self.stopped.is_set():
+                logger.warning(f"Lost ffmpeg stderr for stream {self.stream_id}: {e}")
+
+    def _handle_stderr_line(self, process, line):
+        key, separator, value = line.partition('=')
+        if separator and ' ' not in key:
+            field = PROGRESS_FIELDS.get(key)
+            # Progress from a replacement that is still warming up is not ours yet
+            if field is None or process is not self.process:
+                return
+            parsed = parse_progress_value(value)
+            with self.lock:
+                if field == 'frames' and parsed is not None and parsed > self.metrics.get('frames', -1):
+                    self.last_progress_at = time.monotonic()
+                self.metrics[field] = parsed
+            return
+        with self.lock:
+            self.log.append(line)
+        logger.debug("ffmpeg %s: %s", self.stream_id, line)
+
+    def read_frame(self):
+        while True:
+            try:
+                frame = self.demuxer.read_frame() if self.demuxer is not None else None
+            except (OSError, ValueError) as e:
+                if self.stopped.is_set():
+                    return None
+                logger.error(f"Failed to read from ffmpeg for stream {self.stream_id}: {e}")
+                frame = None
+            swapped = self._take_swap()
+            if swapped is not None:
+                # The frame from the old process, if any, is dropped in favour of the new one
+                return swapped
+            if frame:
+                if self.consecutive_restarts and time.monotonic() - self.started_at >= self.healthy_after:
+                    self.consecutive_restarts = 0
+                return frame
+            if self.stopped.is_set() or not self._restart():
+                return None
+
+    def _restart(self):
+        exit_reason = self._reap(self.process)
+        if self.kill_reason == RECONFIGURED:
+            logger.info(f"Respawning ffmpeg for stream {self.stream_id} with new settings")
+            return self.spawn() is not None
+        reason = self.kill_reason or exit_reason
+        with self.lock:
+            last_line = self.log[-1] if self.log else None
+        if last_line:
+            reason = f"{reason} ({last_line})"
+        if self.max_restarts is not None and self.consecutive_restarts >= self.max_restarts:
+            logger.error(f"Giving up on ffmpeg for stream {self.stream_id} after "
+                          f"{self.consecutive_restarts} restarts: {reason}")
+            self._notify(reason, gave_up=True)
+            return False
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** self.consecutive_restarts)
+        self.consecutive_restarts += 1
+        self.restarts += 1
+        logger.warning(f"Restarting ffmpeg for stream {self.stream_id} in {delay:.1f}s: {reason}")
+        if self.stopped.wait(delay):
+            return False
+        self._notify(reason)
+        return self.spawn() is not None
+
+    def _reap(self, process):
+        if process is None:
+            return "not running"
+        if process.poll() is None:
+            process.kill()
+        try:
+            returncode = process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            return "did not exit"
+        if self.drainer is not None and self.drainer is not threading.current_thread():
+            self.drainer.join(timeout=1)
+        return f"exited with code {returncode}"
+
+    def _notify(self, reason, gave_up=False):
+        if self.on_restart is None:
+            return
+        try:
+            self.on_restart(self.stream_id, reason, self.restarts, gave_up)
+        except Exception as e:
+            logger.error(f"Restart callback failed for stream {self.stream_id}: {e}")
+
+    def check_stall(self, timeout):
+        with self.lock:
+            process = self.process
+            if process is None or self.stopped.is_set() or self.kill_reason:
+                return False
+            idle = time.monotonic() - self.last_progress_at
+            if idle < timeout:
+                return False
+            self.kill_reason = f"stalled for {idle:.0f}s without new frames"
+        logger.warning(f"ffmpeg for stream {self.stream_id} {self.kill_reason}; killing it")
+        # The reader sees end of stream and restarts the process
+        process.kill()
+        return True
+
+    def reconfigure(self, command, demuxer_factory, codec):
+        with self.lock:
+            if self.swapping:
+                raise ValueError(f"A capture change for stream {self.stream_id} is already in progress")
+            if self.process is None or self.stopped.is_set():
+                self.pending_config = (command, demuxer_factory, codec)
+                return
+            self.swapping = True
+        threading.Thread(target=self._prepare_swap, args=(command, demuxer_factory, codec),
+                         name=f"ffmpeg-swap-{self.stream_id}", daemon=True).start()
+
+    def _prepare_swap(self, command, demuxer_factory, codec):
+        # Start the replacement next to the running process and switch over once
+        # it delivers its first frame, so subscribers see no gap.
+        try:
+            process = self._popen(command)
+        except OSError as e:
+            logger.error(f"Failed to start replacement ffmpeg for stream {self.stream_id}: {e}")
+            self._restart_in_place(command, demuxer_factory, codec)
+            return
+        with self.lock:
+            self.swap_process = process
+            stopped = self.stopped.is_set()
+        if stopped:
+            self._finish_swap()
+            self._retire(process)
+            return
+        drainer = self._start_drainer(process)
+        demuxer = demuxer_factory(process.stdout)
+        timer = threading.Timer(self.swap_timeout, process.kill)
+        timer.start()
+        try:
+            first_frame = demuxer.read_frame()
+        except (OSError, ValueError):
+            first_frame = None
+        finally:
+            timer.cancel()
+        if not first_frame:
+            self._retire(process)
+            # Typically a V4L2 device that refuses to be opened twice
+            logger.warning(f"Replacement ffmpeg for stream {self.stream_id} produced no frame; restarting in place")
+            self._restart_in_place(command, demuxer_factory, codec)
+            return
+        with self.lock:
+            if not self.stopped.is_set():
+                self.swap = (process, demuxer, drainer, command, demuxer_factory, codec, first_frame)
+                return
+        self._finish_swap()
+        self._retire(process)
+
+    def _finish_swap(self):
+        with self.lock:
+            self.swapping = False
+            self.swap_process = None
+            self.swap = None
+
+    def _take_swap(self):
+        with self.lock:
+            if self.swap is None:
+                return None
+            process, demuxer, drainer, command, demuxer_factory, codec, first_frame = self.swap
+            old_process = self.process
+            self.process, self.demuxer, self.drainer = process, demuxer, drainer
+            self.command, self.demuxer_factory, self.codec = command, demuxer_factory, codec
+            self.started_at = self.last_progress_at = time.monotonic()
+            self.kill_reason = None
+            self.metrics = {}
+            self.swapping = False
+            self.swap_process = None
+            self.swap = None
+        logger.info(f"Swapped ffmpeg for stream {self.stream_id} to the new settings")
+        threading.Thread(target=self._retire, args=(old_process,), daemon=True).start()
+        return first_frame
+
+    def _restart_in_place(self, command, demuxer_factory, codec):
+        self._finish_swap()
+        with self.lock:
+            self.pending_config = (command, demuxer_factory, codec)
+            process = self.process
+            if process is None or self.stopped.is_set():
+                return
+            self.kill_reason = RECONFIGURED
+        # The reader respawns with the pending command as soon as it sees end of stream
+        process.terminate()
+
+    def _retire(self, process):
+        if process.poll() is None:
+            process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stop(self):
+        with self.lock:
+            self.stopped.set()
+            process = self.process
+            replacement = self.swap_process
+            self.swap = None
+        if replacement is not None:
+            self._retire(replacement)
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stats(self):
+        with self.lock:
+            process = self.process
+            stats = dict(
+                self.metrics,
+                running=process is not None and process.poll() is None,
+                pid=process.pid if process is not None else None,
+                codec=self.codec,
+                restarts=self.restarts,
+                uptime=time.monotonic() - self.started_at if self.started_at else 0,
+                seconds_since_progress=time.monotonic() - self.last_progress_at if self.last_progress_at else None,
+                log_tail=list(self.log)[-5:]
+            )
+        if stats['running']:
+            stats.update(process_usage(process.pid) or {})
+        return stats
@@ -0,0 +1,70 @@
+import io
+import logging
+import time
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (64, 48)
+
+
+def gray_thumbnail(jpeg, size=THUMBNAIL_SIZE):
+    image = Image.open(io.BytesIO(jpeg))
+    # draft() makes the JPEG decoder scale down by up to 8x in the DCT domain and
+    # skip the chroma planes, so the full-size image is never materialised.
+    image.draft('L', size)
+    image = image.convert('L').resize(size, Image.BILINEAR)
+    return np.asarray(image, dtype=np.int16)
+
+
+class FrameDecimator:
+    def __init__(self):
+        self.frames_seen = 0
+        self.last_sent_at = None
+
+    def accept(self, frame_skip=0, max_fps=None, now=None):
+        self.frames_seen += 1
+        if frame_skip and (self.frames_seen - 1) % (frame_skip + 1):
+            return False
+        if max_fps:
+            now = time.monotonic() if now is None else now
+            # A little slack so a camera running at exactly max_fps is not halved by jitter
+            if self.last_sent_at is not None and now - self.last_sent_at < 0.9 / max_fps:
+                return False
+            self.last_sent_at = now
+        return True
+
+
+class MotionGate:
+    def __init__(self, pixel_delta=20, keepalive_seconds=10.0):
+        self.pixel_delta = pixel_delta
+        self.keepalive_seconds = keepalive_seconds
+        self.reference = None
+        self.reference_at = None
+        self.last_change = 0.0
+
+    def accept(self, frame, threshold, now=None):
+        now = time.monotonic() if now is None else now
+        try:
+            current = gray_thumbnail(frame)
+        except (OSError, ValueError) as e:
+            logger.debug("Motion gate could not decode frame, passing it through: %s", e)
+            return True
+        if self.reference is None or self.reference.shape != current.shape:
+            return self._keep(current, now, 1.0)
+        # Share of thumbnail pixels that moved noticeably since the last frame sent
+        changed = np.count_nonzero(np.abs(current - self.reference) > self.pixel_delta) / current.size
+        if changed >= threshold:
+            return self._keep(current, now, changed)
+        if self.keepalive_seconds and now - self.reference_at >= self.keepalive_seconds:
+            # Still send the odd frame of a static scene so the edge sees the stream is alive
+            return self._keep(current, now, changed)
+        self.last_change = changed
+        return False
+
+    def _keep(self, current, now, changed):
+        self.reference = current
+        self.reference_at = now
+        self.last_change = changed
+        return True
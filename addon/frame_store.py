@@ -0,0 +1,293 @@
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+# Segment records: image length, timestamp length, timestamp, image
+RECORD_HEADER = struct.Struct('<IH')
+# Index entries: parsed timestamp, segment number, record offset
+INDEX_ENTRY = struct.Struct('<dIQ')
+SEGMENT_NAME = re.compile(r'^(\d{8})\.seg$')
+# Frames pulled from the source per store lock acquisition in append_many
+APPEND_BATCH_FRAMES = 32
+
+
+def parse_timestamp(timestamp):
+    try:
+        return float(timestamp)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except ValueError:
+        raise ValueError(f"Unsupported timestamp format: {timestamp}")
+
+
+class ClientFrames:
+    def __init__(self, directory):
+        self.directory = directory
+        self.times = array('d')
+        self.segments = array('I')
+        self.offsets = array('Q')
+        self.last_timestamp = None
+        self.last_parsed = None
+        self.segment_sizes = {}
+        self.segment_newest = {}
+        self.active_segment = None
+        self.next_segment = 0
+        self.writer = None
+        self.index_writer = None
+        self.maps = {}
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:08d}.seg")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.bin')
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                self.segment_sizes[int(match.group(1))] = os.path.getsize(os.path.join(self.directory, name))
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for parsed, segment, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+                # Entries pointing past the end of a segment come from an interrupted write
+                if segment not in self.segment_sizes or offset >= self.segment_sizes[segment]:
+                    continue
+                self.times.append(parsed)
+                self.segments.append(segment)
+                self.offsets.append(offset)
+                self.segment_newest[segment] = parsed
+        if self.segment_sizes:
+            self.active_segment = max(self.segment_sizes)
+            self.next_segment = self.active_segment + 1
+        if self.times:
+            self.last_timestamp = self.read_record(len(self.times) - 1, with_image=False)['timestamp']
+            self.last_parsed = self.times[-1]
+
+    def read_record(self, position, with_image=True):
+        segment = self.segments[position]
+        offset = self.offsets[position]
+        view = self.map_segment(segment, offset + RECORD_HEADER.size)
+        image_length, timestamp_length = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + timestamp_length + image_length
+        view = self.map_segment(segment, end)
+        timestamp = view[start:start + timestamp_length].decode('utf-8')
+        image = view[start + timestamp_length:end] if with_image else b''
+        return {'timestamp': timestamp, 'image': image, 'size': image_length}
+
+    def map_segment(self, segment, needed):
+        mapped = self.maps.get(segment)
+        if mapped is None or len(mapped) < needed:
+            if mapped is not None:
+                mapped.close()
+            if segment == self.active_segment and self.writer is not None:
+                self.writer.flush()
+            with open(self.segment_path(segment), 'rb') as segment_file:
+                mapped = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = mapped
+        return mapped
+
+    def close_segment(self, segment):
+        mapped = self.maps.pop(segment, None)
+        if mapped is not None:
+            mapped.close()
+        if segment == self.active_segment and self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        for segment in list(self.maps):
+            self.close_segment(segment)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.index_writer is not None:
+            self.index_writer.close()
+            self.index_writer = None
+
+
+class FrameStore:
+    def __init__(self, root_dir='/data/frames', max_bytes=2 * 1024 ** 3, max_age_seconds=7 * 24 * 3600,
+                 segment_size=64 * 1024 ** 2, evict_interval=60.0):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.segment_size = segment_size
+        # Reads evict at most this often, so the frames of a client that
+        # stopped syncing still age out
+        self.evict_interval = evict_interval
+        self.last_evicted = time.monotonic()
+        self.clients = {}
+        self.lock = threading.RLock()
+
+    def _client(self, client_id):
+        frames = self.clients.get(client_id)
+        if frames is None:
+            if not client_id or client_id.startswith('.') or os.sep in client_id:
+                raise ValueError(f"Invalid client ID for frame store: {client_id}")
+            frames = ClientFrames(os.path.join(self.root_dir, client_id))
+            frames.load()
+            self.clients[client_id] = frames
+        return frames
+
+    def append_many(self, client_id, frames):
+        # frames is usually a network stream, so batches are pulled from it
+        # without the lock; a stalled device then only holds up its own sync
+        frames = iter(frames)
+        added = 0
+        while True:
+            batch = list(islice(frames, APPEND_BATCH_FRAMES))
+            if not batch:
+                return added
+            with self.lock:
+                client = self._client(client_id)
+                batch_added = 0
+                try:
+                    for frame in batch:
+                        if self._append(client, frame['timestamp'], frame['image']):
+                            batch_added += 1
+                finally:
+                    if client.writer is not None:
+                        client.writer.flush()
+                    if client.index_writer is not None:
+                        client.index_writer.flush()
+                if batch_added:
+                    self.evict()
+            added += batch_added
+
+    def append(self, client_id, timestamp, image):
+        return self.append_many(client_id, [{'timestamp': timestamp, 'image': image}]) == 1
+
+    def _append(self, client, timestamp, image):
+        parsed = parse_timestamp(timestamp)
+        # Frames arrive in timestamp order; anything not newer is a resync duplicate
+        if client.last_parsed is not None and parsed <= client.last_parsed:
+            return False
+        if client.active_segment is None or client.segment_sizes[client.active_segment] >= self.segment_size:
+            self._open_segment(client)
+        elif client.writer is None:
+            client.writer = open(client.segment_path(client.active_segment), 'ab')
+        if client.index_writer is None:
+            client.index_writer = open(client.index_path, 'ab')
+
+        encoded = timestamp.encode('utf-8')
+        offset = client.segment_sizes[client.active_segment]
+        client.writer.write(RECORD_HEADER.pack(len(image), len(encoded)))
+        client.writer.write(encoded)
+        client.writer.write(image)
+        client.index_writer.write(INDEX_ENTRY.pack(parsed, client.active_segment, offset))
+
+        client.segment_sizes[client.active_segment] = offset + RECORD_HEADER.size + len(encoded) + len(image)
+        client.segment_newest[client.active_segment] = parsed
+        client.times.append(parsed)
+        client.segments.append(client.active_segment)
+        client.offsets.append(offset)
+        client.last_timestamp = timestamp
+        client.last_parsed = parsed
+        return True
+
+    def _open_segment(self, client):
+        if client.writer is not None:
+            client.writer.close()
+        segment = client.next_segment
+        client.next_segment += 1
+        client.active_segment = segment
+        client.segment_sizes[segment] = 0
+        client.writer = open(client.segment_path(segment), 'wb')
+
+    def last_timestamp(self, client_id):
+        with self.lock:
+            return self._client(client_id).last_timestamp
+
+    def count(self, client_id):
+        with self.lock:
+            return len(self._client(client_id).times)
+
+    def query(self, client_id, start=None, end=None, limit=0, with_images=True):
+        with self.lock:
+            if self.max_age_seconds and time.monotonic() - self.last_evicted >= self.evict_interval:
+                self.evict()
+            client = self._client(client_id)
+            first = bisect_left(client.times, parse_timestamp(start)) if start else 0
+            last = bisect_right(client.times, parse_timestamp(end)) if end else len(client.times)
+            if limit:
+                last = min(last, first + limit)
+            return [client.read_record(position, with_image=with_images) for position in range(first, last)]
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(sum(client.segment_sizes.values()) for client in self.clients.values())
+
+    def evict(self):
+        with self.lock:
+            self.last_evicted = time.monotonic()
+            cutoff = time.time() - self.max_age_seconds if self.max_age_seconds else None
+            total = self.total_bytes()
+            while True:
+                oldest = None
+                for client in self.clients.values():
+                    if not client.segment_sizes:
+                        continue
+                    segment = min(client.segment_sizes)
+                    newest = client.segment_newest.get(segment, 0)
+                    if oldest is None or newest < oldest[2]:
+                        oldest = (client, segment, newest)
+                if oldest is None:
+                    return
+                client, segment, newest = oldest
+                over_size = self.max_bytes and total > self.max_bytes
+                too_old = cutoff is not None and newest < cutoff
+                if not over_size and not too_old:
+                    return
+                total -= client.segment_sizes[segment]
+                self._drop_segment(client, segment)
+
+    def _drop_segment(self, client, segment):
+        logger.info(f"Evicting frame segment {client.segment_path(segment)}")
+        client.close_segment(segment)
+        os.remove(client.segment_path(segment))
+        del client.segment_sizes[segment]
+        client.segment_newest.pop(segment, None)
+        # Segments are written in order, so the evicted entries are a prefix of the index
+        keep = 0
+        while keep < len(client.segments) and client.segments[keep] == segment:
+            keep += 1
+        del client.times[:keep]
+        del client.segments[:keep]
+        del client.offsets[:keep]
+        if segment == client.active_segment:
+            client.active_segment = None
+        self._rewrite_index(client)
+
+    def _rewrite_index(self, client):
+        if client.index_writer is not None:
+            client.index_writer.close()
+            client.index_writer = None
+        temp_path = client.index_path + '.tmp'
+        with open(temp_path, 'wb') as index_file:
+            for position in range(len(client.times)):
+                index_file.write(INDEX_ENTRY.pack(client.times[position], client.segments[position], client.offsets[position]))
+        os.replace(temp_path, client.index_path)
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
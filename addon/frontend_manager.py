@@ -1,147 +1,536 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
+from gunicorn.app.base import BaseApplication
+from metrics import REGISTRY
+from distribution_manager import StreamCapacityError
+from log_setup import dropped_records, restart_after_fork
+import json
 import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HTTP_LATENCY = REGISTRY.histogram('addon_http_request_duration_seconds', 'Flask request latency by route',
+                                  ('method', 'route', 'status'))
+MAX_PREVIEW_FPS = 15
+PREVIEW_BOUNDARY = 'frame'
 
 class FrontendManager:
-    def __init__(self, distribution_manager):
+    def __init__(self, distribution_manager, max_streaming_connections=4):
         self.app = Flask(__name__)
         CORS(self.app, resources={r"/*": {"origins": "*"}})
         self.distribution_manager = distribution_manager
+        self.shut_down = False
+        # Previews and alert streams hold a server thread for as long as they
+        # stay open; past this many, new ones get a 503 so the control routes
+        # keep threads to run on.
+        self.max_streaming_connections = max_streaming_connections
+        self.streaming_connections = 0
+        self.streaming_lock = threading.Lock()
+        self.setup_metrics()
         self.setup_routes()
 
+    def setup_metrics(self):
+        @self.app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+
+        @self.app.after_request
+        def observe_latency(response):
+            started = g.pop('request_started', None)
+            if started is not None:
+                # The rule, not the path, so query strings and ids do not explode the label set
+                route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+                HTTP_LATENCY.labels(request.method, route, response.status_code).observe(time.perf_counter() - started)
+            return response
+
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            try:
+                families = list(self.distribution_manager.collect_metrics())
+                families.append(('addon_log_records_dropped_total', 'counter',
+                                 'Log records dropped because the log queue was full',
+                                 [('addon_log_records_dropped_total', {}, dropped_records())]))
+                body = REGISTRY.render(families)
+                return Response(body, mimetype='text/plain; version=0.0.4')
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+    def _streaming_response(self, body, **kwargs):
+        # Wraps a long-lived response so it counts against max_streaming_connections
+        # until the server closes it, or answers 503 when the limit is reached
+        with self.streaming_lock:
+            if self.streaming_connections >= self.max_streaming_connections:
+                logger.warning("Refusing %s, %d streaming connections already open", request.path,
+                               self.streaming_connections)
+                return jsonify({'error': 'Too many open streams, try again later'}), 503, {'Retry-After': '5'}
+            self.streaming_connections += 1
+        response = Response(body, **kwargs)
+        response.call_on_close(self._release_streaming_connection)
+        return response
+
+    def _release_streaming_connection(self):
+        with self.streaming_lock:
+            self.streaming_connections -= 1
+
     def setup_routes(self):
         @self.app.route('/start_stream', methods=['POST'])
         def start_stream():
-            logging.info("Received request to start stream")
+            logger.info("Received request to start stream")
             try:
                 data = request.get_json()
                 client_id = data['client_id']
-                task_id = self.distribution_manager.start_task('video_stream', client_id)
-                logging.info(f"Stream started with task_id: {task_id} for client_id: {client_id}")
+                input_device = data.get('input_device', '/dev/video0')
+                queue_settings = data.get('queue')
+                profile = data.get('profile')
+                settings = data.get('settings')
+                task_id = self.distribution_manager.start_task(
+                    'video_stream', client_id, input_device=input_device, queue_settings=queue_settings,
+                    profile=profile, settings=settings
+                )
+                logger.info(f"Stream started with task_id: {task_id} for client_id: {client_id}")
                 return jsonify({'message': 'Stream started', 'task_id': task_id}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
+                return jsonify({'error': f'Missing key: {e}'}), 400
+            except StreamCapacityError as e:
+                logger.error(f"StreamCapacityError: {e}")
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/start_tasks', methods=['POST'])
+        def start_tasks():
+            logger.info("Received request to start a batch of tasks")
+            try:
+                tasks = request.get_json()['tasks']
+                # Reject a malformed entry before anything is dispatched; client_id is optional
+                if not isinstance(tasks, list) or not tasks or not all(
+                        isinstance(task, dict) and 'task_type' in task for task in tasks):
+                    return jsonify({'error': 'tasks must be a non-empty list with a task_type each'}), 400
+                results = self.distribution_manager.start_tasks(tasks)
+                logger.info(f"Started {len(results)} tasks")
+                return jsonify({'results': results}), 200
+            except KeyError as e:
+                logger.error(f"KeyError: {e}")
+                return jsonify({'error': f'Missing key: {e}'}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/submit_task', methods=['POST'])
+        def submit_task():
+            logger.info("Received request to schedule a task")
+            try:
+                data = request.get_json()
+                task_id = self.distribution_manager.schedule_task(
+                    data['task_type'], data.get('payload', ""), data.get('input_device', '/dev/video0')
+                )
+                logger.info(f"Scheduled task {task_id}")
+                return jsonify({'message': 'Task scheduled', 'task_id': task_id}), 200
+            except KeyError as e:
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
+            except StreamCapacityError as e:
+                logger.error(f"StreamCapacityError: {e}")
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/scheduler', methods=['GET'])
+        def scheduler_stats():
+            try:
+                return jsonify(self.distribution_manager.get_scheduler_stats()), 200
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/devices/health', methods=['GET'])
+        def device_health():
+            try:
+                return jsonify(self.distribution_manager.get_device_health()), 200
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/stop_stream', methods=['POST'])
         def stop_stream():
-            logging.info("Received request to stop stream")
+            logger.info("Received request to stop stream")
             try:
                 data = request.get_json()
                 task_id = data['task_id']
                 self.distribution_manager.stop_task(task_id)
-                logging.info(f"Stream stopped for task_id: {task_id}")
+                logger.info(f"Stream stopped for task_id: {task_id}")
                 return jsonify({'message': 'Stream stopped'}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
+                return jsonify({'error': f'Missing key: {e}'}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/task_status', methods=['POST'])
+        def task_status():
+            logger.debug("Received request to get task status")
+            try:
+                data = request.get_json()
+                task_id = data['task_id']
+                status = self.distribution_manager.get_task_status(task_id)
+                if status is None:
+                    return jsonify({'error': f'Unknown task: {task_id}'}), 404
+                return jsonify(status), 200
+            except KeyError as e:
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/tasks', methods=['GET'])
+        def list_tasks():
+            logger.debug("Received request to list tasks")
+            try:
+                tasks = self.distribution_manager.list_task_statuses(
+                    client_id=request.args.get('client_id'),
+                    task_type=request.args.get('type'),
+                    state=request.args.get('state')
+                )
+                return jsonify({'tasks': tasks}), 200
+            except Exception as e:
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/update_settings', methods=['POST'])
         def update_settings():
-            logging.info("Received request to update settings")
+            logger.info("Received request to update settings")
             try:
                 data = request.get_json()
                 task_id = data['task_id']
                 settings = data['settings']
                 self.distribution_manager.update_task_settings(task_id, settings)
-                logging.info(f"Settings updated for task_id: {task_id} with settings: {settings}")
+                logger.info(f"Settings updated for task_id: {task_id} with settings: {settings}")
                 return jsonify({'message': 'Settings updated'}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/add_client', methods=['POST'])
         def add_client():
-            logging.info("Received request to add client")
+            logger.info("Received request to add client")
             try:
                 data = request.get_json()
                 client_id = data['client_id']
                 address = data['address']
                 self.distribution_manager.add_client(client_id, address)
-                logging.info(f"Client added with client_id: {client_id}, address: {address}")
+                logger.info(f"Client added with client_id: {client_id}, address: {address}")
                 return jsonify({'message': 'Client added'}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/remove_client', methods=['POST'])
         def remove_client():
-            logging.info("Received request to remove client")
+            logger.info("Received request to remove client")
             try:
                 data = request.get_json()
                 client_id = data['client_id']
                 self.distribution_manager.remove_client(client_id)
-                logging.info(f"Client removed with client_id: {client_id}")
+                logger.info(f"Client removed with client_id: {client_id}")
                 return jsonify({'message': 'Client removed'}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/list_clients', methods=['GET'])
         def list_clients():
-            logging.info("Received request to list clients")
+            logger.debug("Received request to list clients")
             try:
                 clients = self.distribution_manager.list_clients()
-                logging.info(f"Listing clients: {clients}")
+                logger.debug("Listing clients: %s", clients)
                 return jsonify({'clients': clients}), 200
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/alerts', methods=['GET'])
         def get_alerts():
-            logging.info("Received request to get alerts")
+            logger.debug("Received request to get alerts")
+            try:
+                result = self.distribution_manager.get_alerts(
+                    since=request.args.get('since', 0, type=int),
+                    min_severity=request.args.get('severity'),
+                    client_id=request.args.get('client_id'),
+                    limit=min(request.args.get('limit', 100, type=int), 1000)
+                )
+                logger.debug("Retrieved %d alerts", len(result['alerts']))
+                return jsonify(result), 200
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/alerts', methods=['POST'])
+        def add_alert():
+            data = request.json
+            if not isinstance(data, dict) or not data.get('message'):
+                return jsonify({'error': 'Missing required parameter: message'}), 400
+            logger.info(f"Received alert for client {data.get('client_id')}")
+            try:
+                record = self.distribution_manager.add_alert(data)
+                return jsonify(record), 201
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/events', methods=['GET'])
+        def list_events():
+            try:
+                client_id = request.args.get('client_id')
+                return jsonify({
+                    'segments': self.distribution_manager.list_event_segments(client_id),
+                    'recorder': self.distribution_manager.get_event_recorder_stats()
+                }), 200
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+        @self.app.route('/events/<client_id>/<name>', methods=['GET'])
+        def get_event(client_id, name):
+            path = self.distribution_manager.get_event_segment_path(client_id, name)
+            if path is None:
+                return jsonify({'error': f'No event segment {name} for client {client_id}'}), 404
+            mimetype = 'video/x-motion-jpeg' if name.endswith('.mjpeg') else 'video/h264'
+            return send_file(path, mimetype=mimetype, as_attachment=True, download_name=name)
+
+        @self.app.route('/alerts/stream', methods=['GET'])
+        def stream_alerts():
+            logger.info("Received request to stream alerts")
+            since = request.headers.get('Last-Event-ID', type=int)
+            if since is None:
+                since = request.args.get('since', 0, type=int)
+            min_severity = request.args.get('severity')
+            client_id = request.args.get('client_id')
+            try:
+                # Validate the filter up front so a bad request fails before the stream starts
+                self.distribution_manager.get_alerts(since=since, min_severity=min_severity, limit=1)
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+
+            def events():
+                cursor = since
+                while not self.shut_down:
+                    if not self.distribution_manager.wait_for_alerts(cursor, timeout=15):
+                        if self.distribution_manager.alert_store.closed:
+                            return
+                        yield ": keepalive\n\n"
+                        continue
+                    result = self.distribution_manager.get_alerts(
+                        since=cursor, min_severity=min_severity, client_id=client_id, limit=100
+                    )
+                    for alert in result['alerts']:
+                        yield f"id: {alert['seq']}\nevent: alert\ndata: {json.dumps(alert)}\n\n"
+                    cursor = result['next']
+
+            return self._streaming_response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+        @self.app.route('/snapshot/<task_id>', methods=['GET'])
+        def snapshot(task_id):
             try:
-                alerts = self.distribution_manager.get_alerts()
-                logging.info(f"Retrieved alerts: {alerts}")
-                return jsonify({'alerts': alerts}), 200
+                latest = self.distribution_manager.get_latest_frame(task_id, timeout=2)
+                if latest is None:
+                    return jsonify({'error': f'No running stream for task {task_id}'}), 404
+                seq, frame, codec = latest
+                if codec != 'mjpeg':
+                    return jsonify({'error': f'Snapshots need an MJPEG capture profile, stream is {codec}'}), 409
+                if frame is None:
+                    return jsonify({'error': 'No frame captured yet'}), 503
+                return Response(frame, mimetype='image/jpeg', headers={'Cache-Control': 'no-store', 'X-Frame-Seq': str(seq)})
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
+        @self.app.route('/preview/<task_id>', methods=['GET'])
+        def preview(task_id):
+            fps = request.args.get('fps', 5, type=float)
+            if not 0 < fps <= MAX_PREVIEW_FPS:
+                return jsonify({'error': f'fps must be between 0 and {MAX_PREVIEW_FPS}'}), 400
+            latest = self.distribution_manager.get_latest_frame(task_id)
+            if latest is None:
+                return jsonify({'error': f'No running stream for task {task_id}'}), 404
+            if latest[2] != 'mjpeg':
+                return jsonify({'error': f'Previews need an MJPEG capture profile, stream is {latest[2]}'}), 409
+            logger.info(f"Starting preview of task {task_id} at {fps} fps")
+
+            def parts():
+                # Every viewer just takes the newest frame from the capture ring, so
+                # frames in between are skipped rather than queued per viewer
+                seq = -1
+                interval = 1.0 / fps
+                while not self.shut_down:
+                    started = time.monotonic()
+                    latest = self.distribution_manager.get_latest_frame(task_id, seq, timeout=5)
+                    if latest is None:
+                        return
+                    seq, frame, codec = latest
+                    if frame is None or codec != 'mjpeg':
+                        continue
+                    yield (f"--{PREVIEW_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                           f"Content-Length: {len(frame)}\r\n\r\n").encode()
+                    yield frame
+                    yield b'\r\n'
+                    time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+            return self._streaming_response(parts(), mimetype=f'multipart/x-mixed-replace; boundary={PREVIEW_BOUNDARY}',
+                                            headers={'Cache-Control': 'no-store'})
+
         @self.app.route('/clear_alerts', methods=['POST'])
         def clear_alerts():
-            logging.info("Received request to clear alerts")
+            logger.info("Received request to clear alerts")
             try:
                 self.distribution_manager.clear_alerts()
-                logging.info("All alerts cleared")
+                logger.info("All alerts cleared")
                 return jsonify({'message': 'Alerts cleared'}), 200
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
         @self.app.route('/retrieve_frames', methods=['POST'])
         def retrieve_frames():
-            logging.info("Received request to retrieve frames")
+            logger.debug("Received request to retrieve frames")
             try:
                 data = request.get_json()
                 client_id = data['client_id']
-                frames = self.distribution_manager.retrieve_saved_frames(client_id)
-                framecount = len(frames)
-                newest_timestamp = frames[-1]['timestamp'] if framecount > 0 else None
-                logging.info(f"Retrieved {framecount} frames for client_id: {client_id} with newest timestamp: {newest_timestamp}")
-                return jsonify({'frames': framecount, 'latest': newest_timestamp}), 200
+                summary = self.distribution_manager.sync_saved_frames(client_id)
+                if summary is None:
+                    return jsonify({'error': f'Unknown client: {client_id}'}), 404
+                framecount = summary['count']
+                newest_timestamp = summary['latest']
+                logger.debug("Retrieved %d frames for client_id: %s with newest timestamp: %s", framecount, client_id,
+                             newest_timestamp)
+                return jsonify({'frames': framecount, 'latest': newest_timestamp, 'new': summary['new']}), 200
             except KeyError as e:
-                logging.error(f"KeyError: {e}")
+                logger.error(f"KeyError: {e}")
                 return jsonify({'error': f'Missing key: {e}'}), 400
             except Exception as e:
-                logging.error(f"Exception: {e}")
+                logger.error(f"Exception: {e}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
-    def run(self):
-        self.app.run(host='0.0.0.0', port=5000)
+        @self.app.route('/frames_range', methods=['POST'])
+        def frames_range():
+            logger.debug("Received request to query stored frames")
+            try:
+                data = request.get_json()
+                client_id = data['client_id']
+                frames = self.distribution_manager.get_stored_frames(
+                    client_id,
+                    start=data.get('start'),
+                    end=data.get('end'),
+                    limit=data.get('limit', 0),
+                    with_images=False
+                )
+                return jsonify({
+                    'frames': [{'timestamp': frame['timestamp'], 'size': frame['size']} for frame in frames]
+                }), 200
+            except ValueError as e:
+                logger.error(f"ValueError: {e}")
+                return jsonify({'error': str(e)}), 400
+            except KeyError as e:
+                logger.error(f"KeyError: {e}")
+                return jsonify({'error': f'Missing key: {e}'}), 400
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                return jsonify({'error': 'Internal Server Error'}), 500
+
+    def shutdown(self):
+        if self.shut_down:
+            return
+        self.shut_down = True
+        logger.info("Shutting down frontend")
+        self.distribution_manager.shutdown()
+
+    def run(self, mode='production', host='0.0.0.0', port=5000, workers=1, threads=8, graceful_timeout=10):
+        # gthread pins one of a worker's threads to every open connection,
+        # including previews and alert streams for as long as they stay open. Only
+        # max_streaming_connections of them may be streams, the rest are kept
+        # for the control routes, so threads must be larger.
+        if mode == 'development':
+            self.distribution_manager.restore()
+            try:
+                self.app.run(host=host, port=port, threaded=True)
+            finally:
+                self.shutdown()
+            return
+        if mode != 'production':
+            raise ValueError(f"Unknown serving mode: {mode}")
+        if threads <= self.max_streaming_connections:
+            raise ValueError(f"threads ({threads}) must be more than max_streaming_connections "
+                             f"({self.max_streaming_connections}), or streams can take every thread")
+        if workers > 1:
+            # Tasks, streams and clients live in the worker process, so each
+            # worker would see its own registry. Restoring a snapshot in every
+            # worker would open the same cameras and restart the same streams
+            # once per worker, all rewriting one file.
+            if self.distribution_manager.snapshot is not None:
+                raise ValueError("A registry snapshot can only be restored into one worker; "
+                                 "unset ADDON_SNAPSHOT_PATH to serve with more than one")
+            logger.warning(f"Serving with {workers} workers; each worker keeps its own clients and tasks")
+        ProductionServer(self, {
+            'bind': f"{host}:{port}",
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'graceful_timeout': graceful_timeout,
+            'timeout': 0,
+        }).run()
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, frontend_manager, options):
+        self.frontend_manager = frontend_manager
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('worker_exit', self._worker_exit)
+        self.cfg.set('post_fork', self._post_fork)
+
+    def _post_fork(self, server, worker):
+        restart_after_fork()
+        # Streams run on threads, which only exist in the process that starts them
+        self.frontend_manager.distribution_manager.restore()
+
+    def _worker_exit(self, server, worker):
+        self.frontend_manager.shutdown()
+
+    def load(self):
+        return self.frontend_manager.app
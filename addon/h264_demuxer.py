@@ -0,0 +1,56 @@
+import logging
+from mjpeg_demuxer import MJPEGDemuxer
+
+logger = logging.getLogger(__name__)
+
+START_CODE = b'\x00\x00\x01'
+AUD_START = b'\x00\x00\x01\x09'
+NAL_IDR_SLICE = 5
+NAL_SLICE = 1
+
+
+def is_keyframe(access_unit):
+    position = access_unit.find(START_CODE)
+    while 0 <= position < len(access_unit) - len(START_CODE):
+        nal_type = access_unit[position + len(START_CODE)] & 0x1F
+        if nal_type == NAL_IDR_SLICE:
+            return True
+        if nal_type == NAL_SLICE:
+            return False
+        position = access_unit.find(START_CODE, position + len(START_CODE))
+    return False
+
+
+class H264Demuxer(MJPEGDemuxer):
+    # Splits an Annex B stream into access units on the delimiters that libx264
+    # writes with aud=1. An access unit is complete once the next one begins.
+
+    def next_frame(self):
+        if self.frame_start < 0:
+            start = self.buffer.find(AUD_START, 0, self.length)
+            if start < 0:
+                # Keep enough bytes for a four byte delimiter split across reads
+                self._consume(self.length - min(self.length, len(AUD_START)))
+                return None
+            if start > 0 and self.buffer[start - 1] == 0:
+                start -= 1
+            if start > 0:
+                self._consume(start)
+            self.frame_start = 0
+            self.scan_pos = self.buffer.find(AUD_START, 0, self.length) + len(AUD_START)
+
+        end = self.buffer.find(AUD_START, self.scan_pos, self.length)
+        if end < 0:
+            if self.eof and self.length > len(AUD_START):
+                end = self.length
+            elif self.length > self.max_frame_size:
+                logger.warning("Discarding %d bytes without an access unit delimiter", self.length)
+                self._discard()
+                return None
+            else:
+                self.scan_pos = max(self.length - len(AUD_START) + 1, len(AUD_START))
+                return None
+        elif self.buffer[end - 1] == 0:
+            # Four byte start code: the leading zero belongs to the next unit
+            end -= 1
+        return self._take(end)
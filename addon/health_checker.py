@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceHealth:
+    def __init__(self):
+        self.healthy = True
+        self.latency = None
+        self.last_seen = None
+        self.failures = 0
+        self.processing_types = []
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'healthy': self.healthy,
+            'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+            'last_seen': self.last_seen,
+            'failures': self.failures,
+            'processing_types': list(self.processing_types),
+            'error': self.error
+        }
+
+
+class HealthChecker:
+    # Pings every registered edge device. A device is declared down after
+    # failure_threshold consecutive failed probes, so an outage is noticed within
+    # detection_time seconds. Rounds start every interval however long their
+    # probes took, or back to back when a probe can outlast the interval.
+
+    def __init__(self, registry, on_down=None, on_up=None, interval=2.0, timeout=1.0, failure_threshold=2,
+                 max_workers=8):
+        self.registry = registry
+        self.on_down = on_down
+        self.on_up = on_up
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.health = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='health-probe')
+
+    @property
+    def detection_time(self):
+        # The outage may start just after a round; the last failing probe then
+        # starts failure_threshold rounds later and gives up timeout after that
+        return max(self.interval, self.timeout) * self.failure_threshold + self.timeout
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None or self.stop_event.is_set():
+                return
+            self.thread = threading.Thread(target=self._run, name='health-checker', daemon=True)
+            self.thread.start()
+        logger.info(f"Health checker started, devices are declared down within {self.detection_time:.1f}s")
+
+    def _run(self):
+        wait = self.interval
+        while not self.stop_event.wait(wait):
+            started = time.monotonic()
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Health check round failed: {e}")
+            wait = max(0.0, self.interval - (time.monotonic() - started))
+
+    def check_all(self):
+        # Probes run in parallel so one unreachable device cannot delay the others
+        futures = [self.executor.submit(self.probe, client_id, device) for client_id, device in self.registry.list_devices()]
+        for future in futures:
+            future.result()
+
+    def probe(self, client_id, device):
+        try:
+            result = device.ping(timeout=self.timeout)
+        except Exception as e:
+            self._record_failure(client_id, e)
+            return False
+        self._record_success(client_id, result)
+        return True
+
+    def _record_success(self, client_id, result):
+        with self.lock:
+            health = self.health.setdefault(client_id, DeviceHealth())
+            recovered = not health.healthy
+            health.healthy = True
+            health.failures = 0
+            health.error = None
+            health.latency = result['latency']
+            health.processing_types = result['processing_types']
+            health.last_seen = time.time()
+        if recovered:
+            logger.info(f"Edge device {client_id} is reachable again")
+            if self.on_up:
+                self.on_up(client_id)
+
+    def _record_failure(self, client_id, error):
+        with self.lock:
+            health = self.health.setdefault(client_id, DeviceHealth())
+            health.failures += 1
+            health.error = str(error)
+            went_down = health.healthy and health.failures >= self.failure_threshold
+            if went_down:
+                health.healthy = False
+        logger.debug("Health probe of %s failed (%d): %s", client_id, health.failures, error)
+        if went_down:
+            logger.warning(f"Edge device {client_id} is down after {self.failure_threshold} failed probes: {error}")
+            if self.on_down:
+                self.on_down(client_id, error)
+
+    def is_healthy(self, client_id):
+        # Devices that have not been probed yet get the benefit of the doubt
+        with self.lock:
+            health = self.health.get(client_id)
+            return health is None or health.healthy
+
+    def supports(self, client_id, processing_type):
+        with self.lock:
+            health = self.health.get(client_id)
+            return health is None or not health.processing_types or processing_type in health.processing_types
+
+    def forget(self, client_id):
+        with self.lock:
+            self.health.pop(client_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'detection_time': self.detection_time,
+                'devices': {client_id: health.to_dict() for client_id, health in self.health.items()}
+            }
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval + self.timeout)
+        self.executor.shutdown(wait=False)
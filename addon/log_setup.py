@@ -0,0 +1,144 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_handler = None
+_listener = None
+_atexit_registered = False
+
+
+class Lazy:
+    # Defers an expensive log argument, e.g. Lazy(MessageToDict, response):
+    # func only runs if the record is actually formatted.
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message on the calling thread before
+    # enqueueing it. This one hands the record over untouched, so a stream
+    # worker only pays for creating the record; the listener thread does the
+    # formatting and the write. Arguments are therefore formatted a little
+    # later, and must not be mutated after the logging call.
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Losing log lines beats blocking a stream on a slow stderr
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    # Token bucket per call site (file and line): a site may log `burst`
+    # records at once and `rate` per second after that. The next record let
+    # through says how many were suppressed in between. Loops that log per
+    # frame or per chunk stay readable without every site needing a guard.
+
+    def __init__(self, rate=10.0, burst=20, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate:
+            return True
+        key = (record.pathname, record.lineno)
+        now = self.clock()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                # tokens, last refill, suppressed since the last record let through
+                site = self.sites[key] = [self.burst, now, 0]
+            site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[2] += 1
+                return False
+            site[0] -= 1
+            suppressed, site[2] = site[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def parse_module_levels(spec):
+    # "distribution_manager=DEBUG,frontend_manager=WARNING" -> {name: level}
+    levels = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        name, separator, level = item.partition('=')
+        if not separator or not name.strip():
+            raise ValueError(f"Invalid module log level: {item!r}, expected module=LEVEL")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level='INFO', module_levels=None, rate=10.0, burst=20, queue_size=10000, stream=None):
+    # Replaces the root handlers (like basicConfig(force=True)) with a queue
+    # that a single listener thread drains into stderr.
+    global _handler, _listener, _atexit_registered
+    stop_logging()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _handler = DeferredQueueHandler(queue.Queue(queue_size))
+    _handler.addFilter(RateLimitFilter(rate, burst))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    if not _atexit_registered:
+        atexit.register(stop_logging)
+        _atexit_registered = True
+    return _handler
+
+
+def restart_after_fork():
+    # The listener thread does not survive a fork (gunicorn workers), and the
+    # queue's locks may have been held by it, so the child gets fresh ones.
+    global _listener
+    if _listener is None:
+        return
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    # Flushes everything still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
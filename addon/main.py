@@ -1,12 +1,47 @@
+import os
 from distribution_manager import DistributionManager
 from frontend_manager import FrontendManager
+from log_setup import configure_logging, parse_module_levels
 
 def main():
-    distribution_manager = DistributionManager()
-    frontend_manager = FrontendManager(distribution_manager)
+    configure_logging(
+        level=os.environ.get('ADDON_LOG_LEVEL', 'INFO'),
+        # e.g. "external_device_manager=DEBUG,frontend_manager=WARNING"
+        module_levels=parse_module_levels(os.environ.get('ADDON_LOG_LEVELS', '')),
+        # Records per second each call site may log before it is throttled (0 disables)
+        rate=float(os.environ.get('ADDON_LOG_RATE', '10'))
+    )
+    distribution_manager = DistributionManager(
+        scheduling_policy=os.environ.get('ADDON_SCHEDULING_POLICY', 'least_loaded'),
+        max_tasks_per_device=int(os.environ.get('ADDON_MAX_TASKS_PER_DEVICE', '4')),
+        # Video streams running at once, each on its own thread; more get a 503
+        max_stream_workers=int(os.environ.get('ADDON_MAX_STREAMS', '16')),
+        # A dead device is noticed within max(interval, timeout) * failures + timeout seconds
+        health_interval=float(os.environ.get('ADDON_HEALTH_INTERVAL', '2.0')),
+        health_timeout=float(os.environ.get('ADDON_HEALTH_TIMEOUT', '1.0')),
+        health_failure_threshold=int(os.environ.get('ADDON_HEALTH_FAILURES', '2')),
+        # Alerts record pre-roll + post-roll seconds of every stream of the alerting client
+        pre_roll_seconds=float(os.environ.get('ADDON_PRE_ROLL_SECONDS', '5')),
+        post_roll_seconds=float(os.environ.get('ADDON_POST_ROLL_SECONDS', '10')),
+        max_event_bytes=int(os.environ.get('ADDON_MAX_EVENT_MB', '1024')) * 1024 ** 2,
+        # Clients and running streams are restored from here when the server starts
+        snapshot_path=os.environ.get('ADDON_SNAPSHOT_PATH', '/data/registry.json') or None,
+        # Comma-separated inputs besides /dev/video* that streams may capture, e.g. "rtsp://camera1/stream"
+        input_devices=[device for device in os.environ.get('ADDON_INPUT_DEVICES', '').split(',') if device]
+    )
+    frontend_manager = FrontendManager(
+        distribution_manager,
+        # Open previews and alert streams per worker; each holds one of ADDON_THREADS while open
+        max_streaming_connections=int(os.environ.get('ADDON_MAX_STREAMING_CONNECTIONS', '4'))
+    )
 
     # Start the frontend server
-    frontend_manager.run()
+    frontend_manager.run(
+        mode=os.environ.get('ADDON_SERVER_MODE', 'production'),
+        port=int(os.environ.get('ADDON_PORT', '5000')),
+        workers=int(os.environ.get('ADDON_WORKERS', '1')),
+        threads=int(os.environ.get('ADDON_THREADS', '8'))
+    )
 
 if __name__ == '__main__':
     main()
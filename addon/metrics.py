@@ -0,0 +1,243 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (4096, 16384, 65536, 131072, 262144, 524288, 1048576, 2097152, 4194304, 8388608)
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class LocalCell:
+    # Held only by a thread's threading.local, so it is dropped when that thread exits
+    __slots__ = ('values', '__weakref__')
+
+    def __init__(self, width):
+        self.values = [0.0] * width
+
+
+class ThreadCells:
+    # Each thread adds into its own list, so updates need no lock; a scrape sums
+    # the cells of the live threads plus what exited threads left behind. Folding
+    # a thread's cell away when it exits keeps servers that start a thread per
+    # request from growing the list forever.
+
+    def __init__(self, width):
+        self.width = width
+        self.local = threading.local()
+        self.cells = {}
+        self.retired = [0.0] * width
+        # Reentrant: a finalizer may run on a thread that is already inside totals()
+        self.lock = threading.RLock()
+
+    def cell(self):
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            holder = LocalCell(self.width)
+            with self.lock:
+                self.cells[id(holder.values)] = holder.values
+            weakref.finalize(holder, self._retire, holder.values)
+            self.local.holder = holder
+        return holder.values
+
+    def _retire(self, values):
+        with self.lock:
+            del self.cells[id(values)]
+            self.retired = [retired + value for retired, value in zip(self.retired, values)]
+
+    def totals(self):
+        with self.lock:
+            cells = [self.retired] + list(self.cells.values())
+        return [sum(values) for values in zip(*cells)]
+
+
+class CounterChild:
+    def __init__(self):
+        self.cells = ThreadCells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.cells.totals()[0])]
+
+
+class GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, then the running sum
+        self.cells = ThreadCells(len(buckets) + 2)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def samples(self, name, labels):
+        totals = self.cells.totals()
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else format_value(bound)
+            samples.append((f"{name}_bucket", dict(labels, le=le), cumulative))
+        samples.append((f"{name}_sum", labels, totals[-1]))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Metric:
+    def __init__(self, name, help_text, kind, labelnames=(), buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def _new_child(self):
+        if self.kind == 'counter':
+            return CounterChild()
+        if self.kind == 'gauge':
+            return GaugeChild()
+        return HistogramChild(self.buckets)
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(value) for value in values), None)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        with self.lock:
+            children = list(self.children.items())
+        samples = []
+        for key, child in children:
+            samples.extend(child.samples(self.name, dict(zip(self.labelnames, key))))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, name, help_text, kind, labelnames, buckets=None):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(name, help_text, kind, labelnames, buckets)
+                self.metrics[name] = metric
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(name, help_text, 'counter', labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(name, help_text, 'gauge', labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, help_text, 'histogram', labelnames, buckets)
+
+    def render(self, extra_families=()):
+        # extra_families holds values computed at scrape time, see MetricFamilies
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        families = [(metric.name, metric.kind, metric.help_text, metric.samples()) for metric in metrics]
+        lines = []
+        for name, kind, help_text, samples in families + list(extra_families):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricFamilies:
+    # Collects per-object values (streams, ffmpeg processes) when /metrics is
+    # scraped, so nothing has to be registered or removed as they come and go.
+
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, name, kind, help_text):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = (name, kind, help_text, [])
+        return family[3]
+
+    def add(self, name, kind, help_text, labels, value):
+        if value is not None:
+            self._family(name, kind, help_text).append((name, labels, value))
+
+    def add_histogram(self, name, help_text, labels, histogram):
+        self._family(name, 'histogram', help_text).extend(histogram.samples(name, labels))
+
+    def __iter__(self):
+        return iter(self.families.values())
+
+
+REGISTRY = MetricsRegistry()
+
+RPC_LATENCY = REGISTRY.histogram('addon_rpc_latency_seconds', 'Unary RPC latency to edge devices, retries included',
+                                 ('address', 'method'))
+RPC_ERRORS = REGISTRY.counter('addon_rpc_errors_total', 'Failed RPC attempts to edge devices',
+                              ('address', 'method', 'code'))
+
+
+def record_rpc(address, method, started, error=None):
+    RPC_LATENCY.labels(address, method).observe(time.perf_counter() - started)
+    if error is not None:
+        record_rpc_error(address, method, error)
+
+
+def record_rpc_error(address, method, error):
+    code = getattr(error, 'code', None)
+    code = getattr(code(), 'name', code()) if callable(code) else type(error).__name__
+    RPC_ERRORS.labels(address, method, code).inc()
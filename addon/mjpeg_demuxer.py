@@ -0,0 +1,94 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOI_MARKER = b'\xff\xd8'
+EOI_MARKER = b'\xff\xd9'
+
+
+class MJPEGDemuxer:
+    def __init__(self, stream, read_size=64 * 1024, max_frame_size=16 * 1024 * 1024):
+        self.stream = stream
+        self.read_size = read_size
+        self.max_frame_size = max_frame_size
+        # Frames are assembled in place: reads land directly in the free tail of
+        # buffer and only buffer[:length] is live, so each byte is copied once
+        # more, when its frame is complete.
+        self.buffer = bytearray(read_size * 4)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.frame_start = -1
+        self.scan_pos = 0
+        self.eof = False
+        # BufferedReader.readinto blocks until the whole buffer is filled, which
+        # would hold back small frames; readinto1 returns after a single read.
+        self._readinto = getattr(stream, 'readinto1', None) or stream.readinto
+
+    def _reserve(self, size):
+        if len(self.buffer) - self.length >= size:
+            return
+        # A bytearray cannot be resized while a memoryview of it is alive
+        self.view.release()
+        self.buffer.extend(bytes(max(size, len(self.buffer))))
+        self.view = memoryview(self.buffer)
+
+    def _consume(self, size):
+        # Move the remainder (usually a partial next frame) to the front
+        remaining = self.length - size
+        if remaining:
+            self.view[:remaining] = self.view[size:self.length]
+        self.length = remaining
+
+    def _take(self, end):
+        frame = bytes(self.view[:end])
+        self._consume(end)
+        self.frame_start = -1
+        self.scan_pos = 0
+        return frame
+
+    def _discard(self):
+        self.length = 0
+        self.frame_start = -1
+        self.scan_pos = 0
+
+    def feed(self, data):
+        self._reserve(len(data))
+        self.view[self.length:self.length + len(data)] = data
+        self.length += len(data)
+
+    def next_frame(self):
+        if self.frame_start < 0:
+            start = self.buffer.find(SOI_MARKER, 0, self.length)
+            if start < 0:
+                # Keep a trailing 0xFF in case the marker is split across reads
+                keep = 1 if self.length and self.buffer[self.length - 1] == 0xFF else 0
+                self._consume(self.length - keep)
+                return None
+            if start > 0:
+                self._consume(start)
+            self.frame_start = 0
+            self.scan_pos = len(SOI_MARKER)
+
+        end = self.buffer.find(EOI_MARKER, self.scan_pos, self.length)
+        if end < 0:
+            if self.length > self.max_frame_size:
+                logger.warning("Discarding %d bytes without an end of image marker", self.length)
+                self._discard()
+            else:
+                self.scan_pos = max(self.length - 1, len(SOI_MARKER))
+            return None
+        return self._take(end + len(EOI_MARKER))
+
+    def read_frame(self):
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if self.eof:
+                return None
+            self._reserve(self.read_size)
+            size = self._readinto(self.view[self.length:self.length + self.read_size])
+            if not size:
+                self.eof = True
+                continue
+            self.length += size
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class RegistrySnapshot:
+    # Clients and running streams as one small JSON file, so a restart can pick
+    # up where the last run left off. Every write goes to a temp file that then
+    # replaces the snapshot, so a crash leaves either the old or the new one.
+    # Changes only mark the snapshot dirty; a background thread coalesces them
+    # into at most one write per min_interval.
+
+    def __init__(self, path, collect, min_interval=0.5):
+        self.path = path
+        self.collect = collect
+        self.min_interval = min_interval
+        self.dirty = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.writes = 0
+        self.closed = False
+
+    def load(self):
+        try:
+            with open(self.path) as snapshot_file:
+                data = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable registry snapshot {self.path}: {e}")
+            return None
+        if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring registry snapshot {self.path} with unsupported version")
+            return None
+        return data
+
+    def mark_dirty(self):
+        if self.closed:
+            return
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name='registry-snapshot', daemon=True)
+                self.writer.start()
+        self.dirty.set()
+
+    def _write_loop(self):
+        while True:
+            self.dirty.wait()
+            if self.closed:
+                return
+            self.dirty.clear()
+            try:
+                self.save(self.collect())
+            except Exception as e:
+                logger.error(f"Failed to write registry snapshot {self.path}: {e}")
+            if self.stopping.wait(self.min_interval):
+                return
+
+    def save(self, state):
+        with self.lock:
+            data = dict(state, version=SNAPSHOT_VERSION, saved_at=time.time())
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as snapshot_file:
+                json.dump(data, snapshot_file, separators=(',', ':'))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temp_path, self.path)
+            # The rename only survives a power cut once the directory is synced too
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+            self.writes += 1
+
+    def close(self):
+        # Writes any change still pending, then stops the writer; later changes
+        # (tasks being stopped on shutdown) are not persisted.
+        if self.closed:
+            return
+        pending = self.dirty.is_set()
+        self.closed = True
+        self.stopping.set()
+        self.dirty.set()
+        if self.writer is not None:
+            self.writer.join(timeout=5)
+        if pending:
+            try:
+                self.save(self.collect())
+            except Exception as e:
+                logger.error(f"Failed to write registry snapshot {self.path}: {e}")
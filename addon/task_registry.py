@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = ('sent', 'stopped', 'failed')
+
+
+class TaskRegistry:
+    def __init__(self, max_finished_tasks=500, on_evict=None):
+        self.max_finished_tasks = max_finished_tasks
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        self.clients = {}
+        self.tasks = {}
+        self.by_client = {}
+        self.by_type = {}
+        self.by_state = {}
+        self.finished = OrderedDict()
+
+    def add_client(self, client_id, device):
+        with self.lock:
+            previous = self.clients.get(client_id)
+            self.clients[client_id] = device
+            self.by_client.setdefault(client_id, set())
+            return previous
+
+    def remove_client(self, client_id):
+        with self.lock:
+            device = self.clients.pop(client_id, None)
+            task_ids = self.by_client.pop(client_id, set())
+            tasks = [self.tasks[task_id] for task_id in task_ids if task_id in self.tasks]
+            for task in tasks:
+                self._unindex(task)
+                self.finished.pop(task['task_id'], None)
+                del self.tasks[task['task_id']]
+            return device, tasks
+
+    def get_client(self, client_id):
+        with self.lock:
+            return self.clients.get(client_id)
+
+    def has_client(self, client_id):
+        with self.lock:
+            return client_id in self.clients
+
+    def list_clients(self):
+        with self.lock:
+            return list(self.clients.keys())
+
+    def list_devices(self):
+        with self.lock:
+            return list(self.clients.items())
+
+    def add_task(self, task_id, task_type, client_id, state='pending', **fields):
+        with self.lock:
+            task = dict(fields, task_id=task_id, type=task_type, client_id=client_id, state=state, updated_at=time.time())
+            self.tasks[task_id] = task
+            self.by_client.setdefault(client_id, set()).add(task_id)
+            self.by_type.setdefault(task_type, set()).add(task_id)
+            self.by_state.setdefault(state, set()).add(task_id)
+            if state in FINISHED_STATES:
+                self._mark_finished(task_id)
+            return task
+
+    def get_task(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def has_task(self, task_id):
+        with self.lock:
+            return task_id in self.tasks
+
+    def update_task(self, task_id, **fields):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            task.update(fields)
+            return True
+
+    def assign_client(self, task_id, client_id):
+        # Scheduled tasks are registered before the scheduler has placed them
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            self.by_client.get(task['client_id'], set()).discard(task_id)
+            task['client_id'] = client_id
+            self.by_client.setdefault(client_id, set()).add(task_id)
+            return True
+
+    def set_state(self, task_id, state):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            self.by_state[task['state']].discard(task_id)
+            task['state'] = state
+            task['updated_at'] = time.time()
+            self.by_state.setdefault(state, set()).add(task_id)
+            if state in FINISHED_STATES:
+                self._mark_finished(task_id)
+            else:
+                self.finished.pop(task_id, None)
+            return True
+
+    def remove_task(self, task_id):
+        with self.lock:
+            task = self.tasks.pop(task_id, None)
+            if task is None:
+                return None
+            self._unindex(task)
+            self.by_client.get(task['client_id'], set()).discard(task_id)
+            self.finished.pop(task_id, None)
+            return task
+
+    def task_ids_for_client(self, client_id):
+        with self.lock:
+            return list(self.by_client.get(client_id, ()))
+
+    def task_ids_of_type(self, task_type):
+        with self.lock:
+            return list(self.by_type.get(task_type, ()))
+
+    def task_ids_in_state(self, state):
+        with self.lock:
+            return list(self.by_state.get(state, ()))
+
+    def list_task_ids(self):
+        with self.lock:
+            return list(self.tasks.keys())
+
+    def count_tasks(self, client_id=None, task_type=None, state=None):
+        with self.lock:
+            sets = []
+            if client_id is not None:
+                sets.append(self.by_client.get(client_id, set()))
+            if task_type is not None:
+                sets.append(self.by_type.get(task_type, set()))
+            if state is not None:
+                sets.append(self.by_state.get(state, set()))
+            if not sets:
+                return len(self.tasks)
+            if len(sets) == 1:
+                return len(sets[0])
+            return len(set.intersection(*sets))
+
+    def _unindex(self, task):
+        self.by_type.get(task['type'], set()).discard(task['task_id'])
+        self.by_state.get(task['state'], set()).discard(task['task_id'])
+
+    def _mark_finished(self, task_id):
+        self.finished[task_id] = None
+        self.finished.move_to_end(task_id)
+        evicted = []
+        while len(self.finished) > self.max_finished_tasks:
+            old_task_id, _ = self.finished.popitem(last=False)
+            task = self.tasks.pop(old_task_id, None)
+            if task is not None:
+                self._unindex(task)
+                self.by_client.get(task['client_id'], set()).discard(old_task_id)
+                evicted.append(old_task_id)
+        if evicted:
+            logger.info(f"Compacted {len(evicted)} finished tasks from the registry")
+            if self.on_evict:
+                for old_task_id in evicted:
+                    self.on_evict(old_task_id)
@@ -0,0 +1,146 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SCHEDULING_POLICIES = ('least_loaded', 'power_of_two')
+
+
+class DeviceLoad:
+    def __init__(self):
+        self.in_flight = 0
+        self.latency = None
+        self.dispatched = 0
+        self.errors = 0
+
+    def observe_latency(self, seconds, alpha):
+        # Exponentially weighted, so one slow call does not blacklist a device
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+
+
+class TaskScheduler:
+    # Places tasks submitted without a client_id. Each device takes at most
+    # max_in_flight tasks at a time; the rest wait here in FIFO order until a
+    # slot frees up on any device.
+
+    def __init__(self, registry, send, executor, policy='least_loaded', max_in_flight=4, stream_weight=1.0,
+                 latency_weight=10.0, latency_alpha=0.2, rng=None, available=None):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.registry = registry
+        self.send = send
+        self.executor = executor
+        self.policy = policy
+        self.max_in_flight = max_in_flight
+        self.stream_weight = stream_weight
+        # Seconds of EWMA latency are worth this many in-flight tasks
+        self.latency_weight = latency_weight
+        self.latency_alpha = latency_alpha
+        self.rng = rng or random.Random()
+        # available(client_id) -> False keeps a device out of placement (health checks)
+        self.available = available
+        self.loads = {}
+        self.queue = deque()
+        self.lock = threading.Lock()
+
+    def submit(self, task):
+        # task: dict with task_id, task_type and payload; send(client_id, task) runs the RPC
+        with self.lock:
+            self.queue.append(task)
+        self.drain()
+
+    def drain(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return
+                client_id = self._choose(respect_limit=True)
+                if client_id is None:
+                    return
+                task = self.queue.popleft()
+                self.loads[client_id].in_flight += 1
+            try:
+                self.executor.submit(self._run, client_id, task)
+            except RuntimeError:
+                # Executor already shut down
+                with self.lock:
+                    self.loads[client_id].in_flight -= 1
+                    self.queue.appendleft(task)
+                return
+
+    def _run(self, client_id, task):
+        started = time.monotonic()
+        error = None
+        try:
+            self.send(client_id, task)
+        except Exception as e:
+            error = e
+            logger.warning(f"Scheduled task {task['task_id']} failed on client {client_id}: {e}")
+        with self.lock:
+            load = self.loads.get(client_id)
+            if load is not None:
+                load.in_flight -= 1
+                load.dispatched += 1
+                if error is None:
+                    load.observe_latency(time.monotonic() - started, self.latency_alpha)
+                else:
+                    load.errors += 1
+        self.drain()
+
+    def choose(self, accept=None):
+        # Placement for long-lived work (streams), which is not bound by max_in_flight
+        with self.lock:
+            return self._choose(respect_limit=False, accept=accept)
+
+    def _refresh_loads(self):
+        client_ids = self.registry.list_clients()
+        for client_id in list(self.loads):
+            if client_id not in client_ids and not self.loads[client_id].in_flight:
+                del self.loads[client_id]
+        for client_id in client_ids:
+            self.loads.setdefault(client_id, DeviceLoad())
+        return client_ids
+
+    def _choose(self, respect_limit, accept=None):
+        candidates = [
+            client_id for client_id in self._refresh_loads()
+            if (not respect_limit or self.loads[client_id].in_flight < self.max_in_flight)
+            and (self.available is None or self.available(client_id))
+            and (accept is None or accept(client_id))
+        ]
+        if not candidates:
+            return None
+        if self.policy == 'power_of_two' and len(candidates) > 2:
+            candidates = self.rng.sample(candidates, 2)
+        return min(candidates, key=self._score)
+
+    def _score(self, client_id):
+        load = self.loads[client_id]
+        streams = self.registry.count_tasks(client_id=client_id, task_type='video_stream', state='running')
+        return load.in_flight + self.stream_weight * streams + self.latency_weight * (load.latency or 0.0)
+
+    def stats(self):
+        with self.lock:
+            self._refresh_loads()
+            return {
+                'policy': self.policy,
+                'max_in_flight': self.max_in_flight,
+                'queued': len(self.queue),
+                'devices': {
+                    client_id: {
+                        'in_flight': load.in_flight,
+                        'streams': self.registry.count_tasks(client_id=client_id, task_type='video_stream',
+                                                             state='running'),
+                        'latency_ms': round(load.latency * 1000, 2) if load.latency is not None else None,
+                        'dispatched': load.dispatched,
+                        'errors': load.errors,
+                        'score': round(self._score(client_id), 3)
+                    }
+                    for client_id, load in self.loads.items()
+                }
+            }
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from frame_filter import FrameDecimator, MotionGate
+
+# Settings the stream worker picks up on the next VideoChunk; anything else
+# about a stream (the capture profile) needs ffmpeg to be respawned.
+LIVE_SETTINGS = ('processing_type', 'frame_skip', 'max_fps', 'motion_threshold')
+
+
+class StreamSettings:
+    def __init__(self, processing_type='motion_detection', frame_skip=0, max_fps=None, motion_threshold=None):
+        self.lock = threading.Lock()
+        self.processing_type = None
+        self.frame_skip = 0
+        self.max_fps = None
+        self.motion_threshold = None
+        self.version = 0
+        self.update(processing_type=processing_type, frame_skip=frame_skip, max_fps=max_fps,
+                    motion_threshold=motion_threshold)
+
+    def update(self, **changes):
+        unknown = set(changes) - set(LIVE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown live settings: {sorted(unknown)}")
+        if 'processing_type' in changes and (not isinstance(changes['processing_type'], str)
+                                             or not changes['processing_type']):
+            raise ValueError("processing_type must be a non-empty string")
+        if 'frame_skip' in changes and (not isinstance(changes['frame_skip'], int) or changes['frame_skip'] < 0):
+            raise ValueError("frame_skip must be a non-negative integer")
+        if changes.get('max_fps') is not None and (not isinstance(changes['max_fps'], (int, float))
+                                                   or changes['max_fps'] <= 0):
+            raise ValueError("max_fps must be positive")
+        if changes.get('motion_threshold') is not None and (
+                not isinstance(changes['motion_threshold'], (int, float)) or not 0 <= changes['motion_threshold'] <= 1):
+            raise ValueError("motion_threshold must be between 0 and 1")
+        with self.lock:
+            for key, value in changes.items():
+                setattr(self, key, value)
+            self.version += 1
+            return self.version
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'processing_type': self.processing_type,
+                'frame_skip': self.frame_skip,
+                'max_fps': self.max_fps,
+                'motion_threshold': self.motion_threshold,
+                'version': self.version
+            }
+
+
+class TaskStream:
+    # Frame source handed to ExternalDeviceManager.stream_video: a capture
+    # subscription plus the task's live settings and pre-send filters.
+
+    def __init__(self, subscription, settings):
+        self.subscription = subscription
+        self.settings = settings
+        self.decimator = FrameDecimator()
+        self.motion_gate = MotionGate()
+        self.skipped_frames = 0
+        self.suppressed_frames = 0
+
+    @property
+    def codec(self):
+        return self.subscription.codec
+
+    @property
+    def processing_type(self):
+        return self.settings.processing_type
+
+    def _decimate(self):
+        # Dropping H.264 access units would break the edge decoder's references
+        if self.codec != 'mjpeg':
+            return True
+        if self.decimator.accept(self.settings.frame_skip, self.settings.max_fps):
+            return True
+        self.skipped_frames += 1
+        return False
+
+    def _gate(self, frame):
+        if self.motion_gate.accept(frame, self.settings.motion_threshold):
+            return True
+        self.suppressed_frames += 1
+        return False
+
+    def _gated(self):
+        return bool(self.settings.motion_threshold) and self.codec == 'mjpeg'
+
+    def get_next_frame(self, timeout=None):
+        while True:
+            frame = self.subscription.get_next_frame(timeout)
+            if not frame:
+                return frame
+            if self._decimate() and (not self._gated() or self._gate(frame)):
+                return frame
+
+    async def get_next_frame_async(self):
+        while True:
+            frame = await self.subscription.get_next_frame_async()
+            if not frame:
+                return frame
+            if not self._decimate():
+                continue
+            # Decoding the thumbnail is CPU work, keep it off the event loop
+            if not self._gated() or await asyncio.to_thread(self._gate, frame):
+                return frame
+
+    def to_dict(self):
+        return dict(
+            self.settings.to_dict(),
+            skipped_frames=self.skipped_frames,
+            suppressed_frames=self.suppressed_frames,
+            motion=self.motion_gate.last_change
+        )
@@ -4,9 +4,12 @@
 source /opt/venv/bin/activate
 echo "activated virtual environment"
 
-# Generate the gRPC code from the protobuf definitions
-python -m grpc_tools.protoc -I/app/addon --python_out=/app/addon --grpc_python_out=/app/addon /app/addon/workloads.proto
-echo "generated protobuf files"
+# The image ships the gRPC code generated at build time; only regenerate it
+# when the protobuf definitions are newer (e.g. a mounted development tree)
+if [ ! -f /app/addon/workloads_pb2_grpc.py ] || [ /app/addon/workloads.proto -nt /app/addon/workloads_pb2_grpc.py ]; then
+    python -m grpc_tools.protoc -I/app/addon --python_out=/app/addon --grpc_python_out=/app/addon /app/addon/workloads.proto
+    echo "generated protobuf files"
+fi
 
 # Start the main application
 echo "starting the addon"
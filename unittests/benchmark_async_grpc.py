@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'addon'))
+
+from external_device_manager import ExternalDeviceManager
+from async_external_device_manager import AsyncExternalDeviceManager
+from fake_edge_server import start_fake_server
+
+# Compares thread-per-device gRPC calls against a single asyncio event loop.
+# Requires the generated workloads_pb2 modules (see run.sh):
+#   python unittests/benchmark_async_grpc.py --devices 32 --requests 200
+
+
+class SyntheticFrameSource:
+    codec = 'mjpeg'
+    processing_type = 'motion_detection'
+
+    def __init__(self, frame_count, frame_size):
+        self.remaining = frame_count
+        self.frame = b'\xff\xd8' + b'\x00' * (frame_size - 4) + b'\xff\xd9'
+
+    def get_next_frame(self):
+        if self.remaining <= 0:
+            return None
+        self.remaining -= 1
+        return self.frame
+
+    async def get_next_frame_async(self):
+        return self.get_next_frame()
+
+
+def bench_threads_send_task(address, devices, requests):
+    managers = [ExternalDeviceManager(address) for _ in range(devices)]
+
+    def worker(manager):
+        for i in range(requests):
+            manager.send_task(f"task{i}", "benchmark")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=devices) as executor:
+        list(executor.map(worker, managers))
+    elapsed = time.perf_counter() - start
+    for manager in managers:
+        manager.channel.close()
+    return elapsed
+
+
+def bench_async_send_task(address, devices, requests):
+    async def run():
+        managers = [AsyncExternalDeviceManager(address) for _ in range(devices)]
+
+        async def worker(manager):
+            for i in range(requests):
+                await manager.send_task(f"task{i}", "benchmark")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(manager) for manager in managers))
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*(manager.close() for manager in managers))
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def bench_threads_stream(address, devices, frames, frame_size):
+    managers = [ExternalDeviceManager(address) for _ in range(devices)]
+
+    def worker(manager):
+        manager.stream_video("benchmark", SyntheticFrameSource(frames, frame_size))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=devices) as executor:
+        list(executor.map(worker, managers))
+    elapsed = time.perf_counter() - start
+    for manager in managers:
+        manager.channel.close()
+    return elapsed
+
+
+def bench_async_stream(address, devices, frames, frame_size):
+    async def run():
+        managers = [AsyncExternalDeviceManager(address) for _ in range(devices)]
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            manager.stream_video("benchmark", SyntheticFrameSource(frames, frame_size))
+            for manager in managers
+        ))
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*(manager.close() for manager in managers))
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def report(name, elapsed, operations, size=None):
+    line = f"{name:<24} {elapsed:8.3f}s {operations / elapsed:12.1f} ops/s"
+    if size is not None:
+        line += f" {operations * size / elapsed / 1e6:10.1f} MB/s"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thread vs asyncio gRPC client throughput")
+    parser.add_argument('--devices', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--frame-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    server, address, _, _ = start_fake_server(max_workers=max(args.devices * 2, 16))
+    try:
+        print(f"devices={args.devices} requests={args.requests} frames={args.frames} frame_size={args.frame_size}")
+        tasks = args.devices * args.requests
+        report("SendTask threads", bench_threads_send_task(address, args.devices, args.requests), tasks)
+        report("SendTask asyncio", bench_async_send_task(address, args.devices, args.requests), tasks)
+        chunks = args.devices * args.frames
+        report("StreamVideo threads", bench_threads_stream(address, args.devices, args.frames, args.frame_size),
+               chunks, args.frame_size)
+        report("StreamVideo asyncio", bench_async_stream(address, args.devices, args.frames, args.frame_size),
+               chunks, args.frame_size)
+    finally:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
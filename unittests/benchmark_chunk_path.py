@@ -0,0 +1,119 @@
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'addon'))
+
+import workloads_pb2
+from mjpeg_demuxer import MJPEGDemuxer, SOI_MARKER, EOI_MARKER
+from chunk_codec import RawVideoChunk, encode_video_chunk
+
+# Pipe-to-wire cost of one MJPEG stream, without the network: ffmpeg stdout is
+# replayed from memory, demuxed and serialised into VideoChunk wire bytes.
+# CPython exposes no allocation counter, so allocation pressure is reported as
+# the tracemalloc peak of transient memory per chunk.
+# Requires the generated workloads_pb2 modules (see run.sh):
+#   python unittests/benchmark_chunk_path.py --frames 2000 --frame-size 131072
+
+
+class PreviousMJPEGDemuxer:
+    # The demuxer as it was before frames were assembled in place: a separate
+    # read buffer, appended into a growing bytearray, then trimmed from the front
+    def __init__(self, stream, read_size=64 * 1024):
+        self.read_buffer = bytearray(read_size)
+        self.read_view = memoryview(self.read_buffer)
+        self.buffer = bytearray()
+        self._readinto = getattr(stream, 'readinto1', None) or stream.readinto
+        self.eof = False
+
+    def read_frame(self):
+        while True:
+            start = self.buffer.find(SOI_MARKER)
+            end = self.buffer.find(EOI_MARKER, start + 2) if start >= 0 else -1
+            if end >= 0:
+                end += 2
+                with memoryview(self.buffer) as view:
+                    frame = bytes(view[start:end])
+                del self.buffer[:end]
+                return frame
+            if self.eof:
+                return None
+            size = self._readinto(self.read_buffer)
+            if not size:
+                self.eof = True
+                continue
+            self.buffer += self.read_view[:size]
+
+
+def previous_path(stream, processing_type):
+    demuxer = PreviousMJPEGDemuxer(stream)
+    while True:
+        frame = demuxer.read_frame()
+        if frame is None:
+            return
+        yield workloads_pb2.VideoChunk(data=frame, processing_type=processing_type, codec='mjpeg').SerializeToString()
+
+
+def zero_copy_path(stream, processing_type):
+    demuxer = MJPEGDemuxer(stream)
+    sent_type = None
+    while True:
+        frame = demuxer.read_frame()
+        if frame is None:
+            return
+        chunk = RawVideoChunk(frame, processing_type if processing_type != sent_type else '', 'mjpeg')
+        sent_type = processing_type
+        yield encode_video_chunk(chunk)
+
+
+def make_stream(frames, frame_size):
+    frame = SOI_MARKER + bytes(range(256)) * ((frame_size - 4) // 256) + EOI_MARKER
+    return frame * frames
+
+
+def bench(path, data, processing_type='motion_detection'):
+    start = time.perf_counter()
+    chunks = 0
+    wire_bytes = 0
+    for encoded in path(io.BytesIO(data), processing_type):
+        chunks += 1
+        wire_bytes += len(encoded)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    stream = path(io.BytesIO(data), processing_type)
+    while True:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        encoded = next(stream, None)
+        if encoded is None:
+            break
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        del encoded
+    tracemalloc.stop()
+    return elapsed, chunks, wire_bytes, sum(peaks) / max(len(peaks), 1)
+
+
+def report(name, elapsed, chunks, wire_bytes, peak_per_chunk, input_bytes):
+    print(f"{name:<12} {elapsed:8.3f}s {chunks / elapsed:10.1f} chunks/s {input_bytes / elapsed / 1e6:9.1f} MB/s "
+          f"{wire_bytes / chunks:10.0f} B/chunk {peak_per_chunk / 1024:9.1f} KiB alloc/chunk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ffmpeg pipe to VideoChunk bytes: previous vs zero-copy path")
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--frame-size', type=int, default=128 * 1024)
+    args = parser.parse_args()
+
+    data = make_stream(args.frames, args.frame_size)
+    print(f"frames={args.frames} frame_size={args.frame_size}")
+    for name, path in (("previous", previous_path), ("zero-copy", zero_copy_path)):
+        report(name, *bench(path, data), len(data))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'addon'))
+
+import workloads_pb2
+from distribution_manager import DistributionManager
+from fake_edge_server import FakeVideoStreamer, start_fake_server
+from ffmpeg_supervisor import process_usage
+from log_setup import configure_logging, stop_logging
+
+# The whole add-on path under load: ffmpeg captures a synthetic lavfi source,
+# DistributionManager streams it over gRPC to fake edge devices that run in a
+# separate process, so their CPU is not billed to the add-on. Latency is from
+# a frame entering the capture ring to its arrival at the edge, matched by
+# camera and CRC32 of the frame (CLOCK_MONOTONIC is shared between processes
+# on Linux). Requires ffmpeg and the generated workloads_pb2 modules:
+#   python unittests/benchmark_end_to_end.py --cameras 1,2,4 --devices 1,2 --output results.json
+#   python unittests/benchmark_end_to_end.py --baseline results.json
+
+
+class TimedVideoStreamer(FakeVideoStreamer):
+    # Notes when each frame arrives, under the stream's processing_type, which
+    # the benchmark sets to a per-camera name
+    def __init__(self):
+        super().__init__()
+        self.arrivals = []
+
+    def StreamVideo(self, request_iterator, context):
+        camera = ''
+        chunks = 0
+        for chunk in request_iterator:
+            arrived = time.monotonic()
+            if chunk.processing_type:
+                camera = chunk.processing_type
+            if chunk.data:
+                chunks += 1
+                self.arrivals.append((camera, zlib.crc32(chunk.data), arrived, len(chunk.data)))
+        return workloads_pb2.TaskResponse(message=f"Received {chunks} chunks")
+
+    def collect(self):
+        arrivals, self.arrivals = self.arrivals, []
+        return arrivals
+
+
+def serve(connection, devices, max_workers):
+    servers = [start_fake_server(max_workers=max_workers, video_streamer=TimedVideoStreamer()) for _ in range(devices)]
+    connection.send([address for _, address, _, _ in servers])
+    while True:
+        command = connection.recv()
+        if command == 'collect':
+            connection.send([arrival for _, _, streamer, _ in servers for arrival in streamer.collect()])
+        elif command == 'stop':
+            for server, _, _, _ in servers:
+                server.stop(None)
+            connection.send(None)
+            return
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def own_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def ffmpeg_usage(manager):
+    cpu = rss = 0
+    for stats in manager.ffmpeg_manager.list_stream_stats().values():
+        cpu += stats.get('cpu_seconds') or 0
+        rss += stats.get('rss_bytes') or 0
+    return cpu, rss
+
+
+def run_scenario(args, addresses, connection, cameras, devices):
+    root_dir = tempfile.mkdtemp(prefix='benchmark_end_to_end')
+    manager = DistributionManager(max_stream_workers=max(16, cameras), frame_store_dir=os.path.join(root_dir, 'frames'),
+                                  events_dir=os.path.join(root_dir, 'events'))
+    captured = {}
+    task_ids = []
+    try:
+        for index in range(devices):
+            manager.add_client(f"edge{index}", addresses[index])
+        for camera in range(cameras):
+            name = f"camera{camera}"
+            # The duration only makes each input distinct, so every camera gets its own capture
+            input_device = f"lavfi:{args.source}=size={args.size}:rate={args.fps}:duration={86400 + camera}"
+            task_id = manager.start_task('video_stream', f"edge{camera % devices}", input_device,
+                                         profile=args.profile, settings={'processing_type': name})
+            times = captured[name] = {}
+            manager.subscriptions[task_id].capture.add_listener(
+                lambda entry, times=times: times.__setitem__(zlib.crc32(entry[2]), time.monotonic()))
+            task_ids.append(task_id)
+
+        time.sleep(args.warmup)
+        connection.send('collect')
+        connection.recv()
+        started = time.monotonic()
+        cpu_started = own_cpu_seconds()
+        ffmpeg_cpu_started, _ = ffmpeg_usage(manager)
+        dropped_started = sum((manager.get_task_status(task_id) or {}).get('dropped_frames', 0)
+                              for task_id in task_ids)
+
+        time.sleep(args.duration)
+        connection.send('collect')
+        arrivals = connection.recv()
+        elapsed = time.monotonic() - started
+        cpu = own_cpu_seconds() - cpu_started
+        ffmpeg_cpu, ffmpeg_rss = ffmpeg_usage(manager)
+        statuses = [manager.get_task_status(task_id) or {'task_id': task_id, 'state': 'gone'} for task_id in task_ids]
+        dropped = sum(status.get('dropped_frames', 0) for status in statuses) - dropped_started
+        failed = [status['task_id'] for status in statuses if status['state'] != 'running']
+        rss = (process_usage(os.getpid()) or {}).get('rss_bytes')
+    finally:
+        manager.shutdown()
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    latencies = sorted(
+        round((arrived - captured[camera][checksum]) * 1000, 3)
+        for camera, checksum, arrived, _ in arrivals
+        if camera in captured and checksum in captured[camera]
+    )
+    frames = len(arrivals)
+    return {
+        'cameras': cameras,
+        'devices': devices,
+        'seconds': round(elapsed, 3),
+        'frames': frames,
+        'fps': round(frames / elapsed, 2),
+        'fps_per_camera': round(frames / elapsed / cameras, 2),
+        'mb_per_second': round(sum(arrival[3] for arrival in arrivals) / elapsed / 1e6, 3),
+        'dropped_frames': dropped,
+        'failed_streams': failed,
+        'latency_ms': {
+            'matched': len(latencies),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None
+        },
+        'addon_cpu_percent': round(cpu / elapsed * 100, 1),
+        'ffmpeg_cpu_percent': round((ffmpeg_cpu - ffmpeg_cpu_started) / elapsed * 100, 1),
+        'addon_rss_mb': round(rss / 1e6, 1) if rss else None,
+        'ffmpeg_rss_mb': round(ffmpeg_rss / 1e6, 1)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, baseline=None):
+    latency = result['latency_ms']
+    line = (f"cameras={result['cameras']:<3} devices={result['devices']:<3} {result['fps']:8.1f} fps "
+            f"{result['mb_per_second']:8.2f} MB/s  p50 {latency['p50'] or 0:7.1f}ms  p99 {latency['p99'] or 0:7.1f}ms  "
+            f"cpu {result['addon_cpu_percent']:6.1f}% + ffmpeg {result['ffmpeg_cpu_percent']:6.1f}%  "
+            f"rss {result['addon_rss_mb'] or 0:7.1f}MB")
+    if baseline is not None:
+        base_latency = baseline['latency_ms']
+        line += f"  | fps {result['fps'] / baseline['fps'] - 1:+.1%}" if baseline['fps'] else ''
+        if latency['p99'] is not None and base_latency['p99'] is not None:
+            line += f" p99 {latency['p99'] - base_latency['p99']:+.1f}ms"
+        line += f" cpu {result['addon_cpu_percent'] - baseline['addon_cpu_percent']:+.1f}pt"
+    print(line)
+
+
+def parse_counts(value):
+    return sorted({int(count) for count in value.split(',') if count.strip()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end streaming benchmark against fake edge devices")
+    parser.add_argument('--cameras', type=parse_counts, default=[1, 2, 4], help="comma separated camera counts")
+    parser.add_argument('--devices', type=parse_counts, default=[1, 2], help="comma separated edge device counts")
+    parser.add_argument('--source', default='testsrc', help="lavfi test source, e.g. testsrc2 or smptebars")
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--profile', default='mjpeg_high', help="capture profile for every camera")
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', default='benchmark_end_to_end.json')
+    parser.add_argument('--baseline', help="results file of an earlier run to compare against")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        sys.exit("ffmpeg is not on PATH")
+    configure_logging(args.log_level)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = {(result['cameras'], result['devices']): result
+                        for result in json.load(baseline_file)['scenarios']}
+
+    # spawn rather than fork: grpc does not survive being forked
+    context = multiprocessing.get_context('spawn')
+    connection, child_connection = context.Pipe()
+    server = context.Process(target=serve, args=(child_connection, max(args.devices), 64), daemon=True)
+    server.start()
+    addresses = connection.recv()
+    results = []
+    try:
+        print(f"source={args.source} size={args.size} fps={args.fps} profile={args.profile} "
+              f"duration={args.duration}s")
+        for cameras in args.cameras:
+            for devices in args.devices:
+                if devices > cameras:
+                    continue
+                result = run_scenario(args, addresses, connection, cameras, devices)
+                results.append(result)
+                report(result, baseline.get((cameras, devices)))
+    finally:
+        connection.send('stop')
+        connection.recv()
+        server.join(timeout=5)
+        stop_logging()
+
+    with open(args.output, 'w') as output_file:
+        json.dump({
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'scenarios': results
+        }, output_file, indent=2)
+    print(f"wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'addon'))
+
+# Load test for the dashboard and control routes.
+#   Against a running add-on:  python unittests/benchmark_frontend_load.py --url http://127.0.0.1:5000 --client-id cam1
+#   Self-hosted HTTP layer:    python unittests/benchmark_frontend_load.py --self-host --mode production
+
+
+class StubDistributionManager:
+    def __init__(self):
+        self.task_count = 0
+        self.snapshot = None
+
+    def restore(self):
+        return None
+
+    def list_clients(self):
+        return ['client1', 'client2']
+
+    def get_alerts(self, since=0, min_severity=None, client_id=None, limit=100):
+        return {'alerts': [{'seq': 1, 'message': 'motion', 'client_id': 'client1', 'severity': 'info'}],
+                'next': 1, 'has_more': False}
+
+    def start_task(self, task_type, client_id, **kwargs):
+        self.task_count += 1
+        return f"task{self.task_count}"
+
+    def stop_task(self, task_id):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def serve(mode, port, workers, threads):
+    from frontend_manager import FrontendManager
+    FrontendManager(StubDistributionManager()).run(mode=mode, host='127.0.0.1', port=port, workers=workers, threads=threads)
+
+
+def wait_for_server(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{url}/list_clients", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def run_route(session_factory, method, url, payload, requests_per_worker, concurrency):
+    def worker(_):
+        session = session_factory()
+        latencies = []
+        errors = 0
+        task_ids = []
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            response = session.request(method, url, json=payload, timeout=30)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            elif method == 'POST':
+                task_id = response.json().get('task_id')
+                if task_id is not None:
+                    task_ids.append(task_id)
+        return latencies, errors, task_ids
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    task_ids = [task_id for result in results for task_id in result[2]]
+    return elapsed, latencies, errors, task_ids
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for /list_clients, /alerts and /start_stream")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--client-id', default='client1')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100, help="requests per concurrent client")
+    parser.add_argument('--self-host', action='store_true', help="serve the frontend with a stub distribution manager")
+    parser.add_argument('--mode', default='production', choices=['production', 'development'])
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.self_host:
+        url = f"http://127.0.0.1:{args.port}"
+        server = multiprocessing.Process(target=serve, args=(args.mode, args.port, args.workers, args.threads))
+        server.start()
+    try:
+        wait_for_server(url)
+        routes = [
+            ('GET', '/list_clients', None),
+            ('GET', '/alerts', None),
+            ('POST', '/start_stream', {'client_id': args.client_id}),
+        ]
+        print(f"url={url} concurrency={args.concurrency} requests={args.requests}")
+        started_tasks = []
+        for method, route, payload in routes:
+            elapsed, latencies, errors, task_ids = run_route(
+                requests.Session, method, url + route, payload, args.requests, args.concurrency
+            )
+            total = len(latencies)
+            print(f"{method:<5}{route:<16} {total / elapsed:9.1f} req/s"
+                  f"  p50 {percentile(latencies, 0.5) * 1000:7.2f} ms"
+                  f"  p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+                  f"  mean {statistics.mean(latencies) * 1000:7.2f} ms  errors {errors}")
+            # Only the streams this run started, a live add-on may be running others
+            started_tasks += task_ids
+        for task_id in started_tasks:
+            requests.post(f"{url}/stop_stream", json={'task_id': task_id})
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    main()
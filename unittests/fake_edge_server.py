@@ -0,0 +1,87 @@
+import threading
+from concurrent import futures
+import grpc
+import workloads_pb2
+import workloads_pb2_grpc
+
+
+class FakeVideoStreamer(workloads_pb2_grpc.VideoStreamerServicer):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.chunks = 0
+        self.bytes = 0
+
+    def StreamVideo(self, request_iterator, context):
+        chunks = 0
+        size = 0
+        for chunk in request_iterator:
+            chunks += 1
+            size += len(chunk.data)
+        with self.lock:
+            self.streams += 1
+            self.chunks += chunks
+            self.bytes += size
+        return workloads_pb2.TaskResponse(message=f"Received {chunks} chunks")
+
+
+class FakeTaskManager(workloads_pb2_grpc.TaskManagerServicer):
+    def __init__(self, frames=None, processing_types=()):
+        self.lock = threading.Lock()
+        self.processing_types = list(processing_types)
+        self.tasks = 0
+        self.batches = 0
+        self.frames = frames or []
+
+    def SendTask(self, request, context):
+        with self.lock:
+            self.tasks += 1
+        return workloads_pb2.TaskResponse(message="ok", task_id=request.task_id)
+
+    def SendTaskBatch(self, request, context):
+        with self.lock:
+            self.tasks += len(request.tasks)
+            self.batches += 1
+        return workloads_pb2.TaskBatchResponse(
+            responses=[workloads_pb2.TaskResponse(message="ok", task_id=task.task_id) for task in request.tasks]
+        )
+
+    def Ping(self, request, context):
+        return workloads_pb2.PingResponse(processing_types=self.processing_types)
+
+    def RetrieveFrames(self, request, context):
+        return workloads_pb2.FrameResponse(
+            frames=[workloads_pb2.FrameData(image=image, timestamp=timestamp) for image, timestamp in self.frames]
+        )
+
+    def RetrieveFramesStream(self, request, context):
+        count = 0
+        for image, timestamp in self.frames:
+            if request.since_timestamp and timestamp <= request.since_timestamp:
+                continue
+            if request.limit and count >= request.limit:
+                return
+            count += 1
+            yield workloads_pb2.FrameData(
+                image=b'' if request.metadata_only else image,
+                timestamp=timestamp,
+                size=len(image)
+            )
+
+
+class LegacyTaskManager(FakeTaskManager):
+    # An edge device from before RetrieveFramesStream, SendTaskBatch and Ping
+    RetrieveFramesStream = workloads_pb2_grpc.TaskManagerServicer.RetrieveFramesStream
+    SendTaskBatch = workloads_pb2_grpc.TaskManagerServicer.SendTaskBatch
+    Ping = workloads_pb2_grpc.TaskManagerServicer.Ping
+
+
+def start_fake_server(max_workers=64, video_streamer=None, task_manager=None):
+    video_streamer = video_streamer or FakeVideoStreamer()
+    task_manager = task_manager or FakeTaskManager()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    workloads_pb2_grpc.add_VideoStreamerServicer_to_server(video_streamer, server)
+    workloads_pb2_grpc.add_TaskManagerServicer_to_server(task_manager, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, f"127.0.0.1:{port}", video_streamer, task_manager
@@ -0,0 +1,75 @@
+import threading
+import unittest
+from alert_store import AlertStore
+
+
+class TestAlertStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = AlertStore(capacity=3)
+
+    def test_add_assigns_sequence_ids(self):
+        first = self.store.add({'message': 'motion', 'client_id': 'client1'})
+        second = self.store.add('plain text')
+
+        self.assertEqual(first['seq'], 1)
+        self.assertEqual(first['severity'], 'info')
+        self.assertEqual(second['seq'], 2)
+        self.assertEqual(second['message'], 'plain text')
+
+    def test_add_rejects_unknown_severity(self):
+        with self.assertRaises(ValueError):
+            self.store.add({'message': 'motion', 'severity': 'loud'})
+
+    def test_ring_drops_oldest(self):
+        for index in range(5):
+            self.store.add({'message': f"alert{index}"})
+
+        result = self.store.query()
+        self.assertEqual([alert['seq'] for alert in result['alerts']], [3, 4, 5])
+        self.assertEqual(len(self.store), 3)
+
+    def test_query_pages_with_cursor(self):
+        for index in range(3):
+            self.store.add({'message': f"alert{index}"})
+
+        page = self.store.query(limit=2)
+        self.assertEqual([alert['seq'] for alert in page['alerts']], [1, 2])
+        self.assertTrue(page['has_more'])
+
+        page = self.store.query(since=page['next'], limit=2)
+        self.assertEqual([alert['seq'] for alert in page['alerts']], [3])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(page['next'], 3)
+
+    def test_query_filters_advance_cursor(self):
+        self.store.add({'message': 'a', 'severity': 'debug', 'client_id': 'client1'})
+        self.store.add({'message': 'b', 'severity': 'error', 'client_id': 'client2'})
+        self.store.add({'message': 'c', 'severity': 'critical', 'client_id': 'client1'})
+
+        result = self.store.query(min_severity='error', client_id='client1')
+        self.assertEqual([alert['message'] for alert in result['alerts']], ['c'])
+        self.assertEqual(result['next'], 3)
+        with self.assertRaises(ValueError):
+            self.store.query(min_severity='loud')
+
+    def test_clear_keeps_cursor(self):
+        self.store.add({'message': 'a'})
+        self.store.clear()
+
+        self.assertEqual(self.store.query(), {'alerts': [], 'next': 1, 'has_more': False})
+        self.assertEqual(self.store.add({'message': 'b'})['seq'], 2)
+
+    def test_wait_for_wakes_on_add(self):
+        timer = threading.Timer(0.05, self.store.add, args=({'message': 'a'},))
+        timer.start()
+        self.assertTrue(self.store.wait_for(0, timeout=2))
+        timer.join()
+
+    def test_wait_for_returns_on_close(self):
+        self.store.close()
+        self.assertFalse(self.store.wait_for(0, timeout=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import unittest
+import distribution_manager
+import workloads_pb2
+from async_external_device_manager import AsyncExternalDeviceManager
+import grpc
+from fake_edge_server import start_fake_server, FakeTaskManager, FakeVideoStreamer, LegacyTaskManager
+
+
+class FrameSource:
+    codec = 'mjpeg'
+    processing_type = 'motion_detection'
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    async def get_next_frame_async(self):
+        return self.frames.pop(0) if self.frames else None
+
+
+class StreamState:
+    def __init__(self):
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+
+    def record_chunk(self, size, send_seconds=None):
+        self.chunks_sent += 1
+        self.bytes_sent += size
+
+
+class TestAsyncExternalDeviceManager(unittest.TestCase):
+
+    def setUp(self):
+        task_manager = FakeTaskManager(frames=[(b'img', '2024-01-01T00:00:00')])
+        self.server, self.address, self.video_streamer, self.task_manager = start_fake_server(task_manager=task_manager)
+
+    def tearDown(self):
+        self.server.stop(None)
+
+    def run_with_manager(self, coro_fn):
+        async def run():
+            manager = AsyncExternalDeviceManager(self.address)
+            try:
+                return await coro_fn(manager)
+            finally:
+                await manager.close()
+        return asyncio.run(run())
+
+    def test_send_task(self):
+        response = self.run_with_manager(lambda manager: manager.send_task('task1', 'detect'))
+        self.assertEqual(response.task_id, 'task1')
+        self.assertEqual(self.task_manager.tasks, 1)
+
+    def test_concurrent_send_task(self):
+        async def send_many(manager):
+            return await asyncio.gather(*(manager.send_task(f'task{i}', 'detect') for i in range(20)))
+
+        responses = self.run_with_manager(send_many)
+        self.assertEqual(len(responses), 20)
+        self.assertEqual(self.task_manager.tasks, 20)
+
+    def test_stream_video(self):
+        state = StreamState()
+        source = FrameSource([b'a' * 10, b'b' * 20])
+
+        self.run_with_manager(lambda manager: manager.stream_video('task1', source, state))
+
+        self.assertEqual(state.chunks_sent, 2)
+        self.assertEqual(state.bytes_sent, 30)
+        self.assertEqual(self.video_streamer.bytes, 30)
+
+    def test_failover_cancels_call_to_hung_device(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class HungVideoStreamer(FakeVideoStreamer):
+            def StreamVideo(self, request_iterator, context):
+                release.wait(10)
+                return workloads_pb2.TaskResponse()
+
+        server, address, _, _ = start_fake_server(video_streamer=HungVideoStreamer())
+        self.addCleanup(server.stop, None)
+        state = distribution_manager.StreamState('task1', 'client1')
+
+        class StalledSource(FrameSource):
+            # Stalls after its frames, so only cancelling the call can end the stream
+            async def get_next_frame_async(self):
+                if self.frames:
+                    return self.frames.pop(0)
+                await asyncio.sleep(10)
+
+        async def run():
+            manager = AsyncExternalDeviceManager(address)
+            try:
+                stream = asyncio.ensure_future(manager.stream_video('task1', StalledSource([b'x'] * 3), state))
+                while state.chunks_sent < 3:
+                    await asyncio.sleep(0.01)
+                # From another thread, like the health checker
+                threading.Thread(target=state.request_failover).start()
+                with self.assertRaises(RuntimeError):
+                    await asyncio.wait_for(stream, timeout=2)
+            finally:
+                await manager.close()
+
+        asyncio.run(run())
+        self.assertIsNone(state.call)
+
+    def test_retrieve_frames(self):
+        frames = self.run_with_manager(lambda manager: manager.retrieve_frames())
+        self.assertEqual(frames, [{'image': b'img', 'timestamp': '2024-01-01T00:00:00'}])
+
+
+class FlakyTaskManager(FakeTaskManager):
+    # Answers UNAVAILABLE a few times, like an edge device that is restarting
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def SendTask(self, request, context):
+        self.calls += 1
+        if self.calls <= self.failures:
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'restarting')
+        return super().SendTask(request, context)
+
+
+class FlakyVideoStreamer(FakeVideoStreamer):
+    # Drops the first stream after two frames
+    def __init__(self):
+        super().__init__()
+        self.received = []
+        self.attempts = 0
+
+    def StreamVideo(self, request_iterator, context):
+        self.attempts += 1
+        for chunk in request_iterator:
+            if chunk.data:
+                self.received.append(chunk.data)
+            if self.attempts == 1 and len(self.received) == 2:
+                context.abort(grpc.StatusCode.UNAVAILABLE, 'restarting')
+        return workloads_pb2.TaskResponse(message='done')
+
+
+class TestAsyncExternalDeviceManagerRetry(unittest.TestCase):
+    FRAMES = [
+        (b'frame1', '2024-01-01T00:00:01'),
+        (b'frame22', '2024-01-01T00:00:02'),
+        (b'frame333', '2024-01-01T00:00:03'),
+    ]
+
+    def run_against(self, coro_fn, **servicers):
+        server, address, _, _ = start_fake_server(**servicers)
+        self.addCleanup(server.stop, None)
+
+        async def run():
+            manager = AsyncExternalDeviceManager(address, initial_backoff=0, max_retries=2)
+            try:
+                return await coro_fn(manager)
+            finally:
+                await manager.close()
+        return asyncio.run(run())
+
+    def test_send_task_retries_unavailable(self):
+        task_manager = FlakyTaskManager(failures=2)
+        response = self.run_against(lambda manager: manager.send_task('task1', 'detect'), task_manager=task_manager)
+        self.assertEqual(response.task_id, 'task1')
+        self.assertEqual(task_manager.calls, 3)
+
+    def test_send_task_gives_up_after_max_retries(self):
+        task_manager = FlakyTaskManager(failures=5)
+        with self.assertRaises(grpc.RpcError):
+            self.run_against(lambda manager: manager.send_task('task1', 'detect'), task_manager=task_manager)
+        self.assertEqual(task_manager.calls, 3)
+
+    def test_stream_video_resumes_after_unavailable(self):
+        class PacedSource(FrameSource):
+            # Paced like a camera, so the stream is still running when the device drops it
+            async def get_next_frame_async(self):
+                await asyncio.sleep(0.02)
+                return await super().get_next_frame_async()
+
+        video_streamer = FlakyVideoStreamer()
+        state = StreamState()
+        source = PacedSource([b'a', b'b', b'c', b'd', b'e', b'f'])
+
+        response = self.run_against(lambda manager: manager.stream_video('task1', source, state),
+                                    video_streamer=video_streamer)
+
+        self.assertEqual(response.message, 'done')
+        self.assertEqual(video_streamer.attempts, 2)
+        self.assertEqual(video_streamer.received[:2], [b'a', b'b'])
+        self.assertEqual(video_streamer.received[-1], b'f')
+
+    def test_iter_frames_falls_back_to_retrieve_frames(self):
+        async def collect(manager):
+            return [frame async for frame in manager.iter_frames(since_timestamp='2024-01-01T00:00:01', limit=1)]
+
+        frames = self.run_against(collect, task_manager=LegacyTaskManager(frames=self.FRAMES))
+        self.assertEqual(frames, [{'image': b'frame22', 'timestamp': '2024-01-01T00:00:02', 'size': 7}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+import queue
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+from capture_hub import CaptureHub, DeviceCapture
+
+KEYFRAME = b'\x00\x00\x00\x01\x09\xf0\x00\x00\x01\x65\x88'
+P_FRAME = b'\x00\x00\x00\x01\x09\xf0\x00\x00\x01\x41\x9a'
+
+
+class FakeFFmpegManager:
+    def __init__(self):
+        self.processes = {}
+        self.frames = {}
+        self.started = []
+        self.profiles = {}
+
+    def start_stream(self, stream_id, input_device='/dev/video0', profile=None):
+        self.processes[stream_id] = MagicMock()
+        self.frames[stream_id] = queue.Queue()
+        self.started.append(input_device)
+        self.profiles[stream_id] = profile
+
+    def reconfigure_stream(self, stream_id, input_device, profile):
+        self.profiles[stream_id] = profile
+
+    def get_stream_codec(self, stream_id):
+        return self.profiles[stream_id]['codec']
+
+    def stop_stream(self, stream_id):
+        self.processes.pop(stream_id, None)
+        self.frames[stream_id].put(None)
+
+    def get_next_frame(self, stream_id):
+        return self.frames[stream_id].get(timeout=5)
+
+    def push(self, input_device, frame):
+        self.frames[f"capture:{input_device}"].put(frame)
+
+
+class TestDeviceCapture(unittest.TestCase):
+
+    def test_slow_subscriber_drops_oldest_frames(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=3)
+        subscription = capture.subscribe('task1')
+        for i in range(5):
+            capture.publish(bytes([i]))
+
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x02')
+        self.assertEqual(subscription.dropped_frames, 2)
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x03')
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x04')
+        self.assertIsNone(subscription.get_next_frame(timeout=0))
+
+    def test_wait_for_frame_returns_newest_without_consuming(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=3)
+        subscription = capture.subscribe('task1')
+        self.assertIsNone(capture.wait_for_frame(timeout=0))
+        for i in range(3):
+            capture.publish(bytes([i]))
+
+        seq, _, frame, codec, _ = capture.wait_for_frame(timeout=0)
+        self.assertEqual((seq, frame, codec), (2, b'\x02', 'mjpeg'))
+        self.assertIsNone(capture.wait_for_frame(after_seq=2, timeout=0))
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x00')
+
+    def test_listeners_see_every_frame(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=2)
+        seen = []
+        capture.add_listener(seen.append)
+        capture.add_listener(MagicMock(side_effect=RuntimeError('broken listener')))
+        for i in range(3):
+            capture.publish(bytes([i]))
+        capture.remove_listener(seen.append)
+        capture.publish(b'\x03')
+
+        self.assertEqual([(seq, frame) for seq, _, frame, _, _ in seen], [(0, b'\x00'), (1, b'\x01'), (2, b'\x02')])
+
+    def test_max_frames_bounds_queue_depth(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=10)
+        subscription = capture.subscribe('task1', max_frames=2)
+        for i in range(5):
+            capture.publish(bytes([i]))
+
+        self.assertEqual(subscription.queue_depth(), 5)
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x03')
+        self.assertEqual(subscription.dropped_frames, 3)
+        self.assertEqual(subscription.queue_depth(), 1)
+
+    def test_keep_latest_policy(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=10)
+        subscription = capture.subscribe('task1', policy='keep_latest')
+        for i in range(5):
+            capture.publish(bytes([i]))
+
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x04')
+        self.assertEqual(subscription.dropped_frames, 4)
+
+    @patch('capture_hub.time.time')
+    def test_max_latency_skips_stale_frames(self, mock_time):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=10)
+        subscription = capture.subscribe('task1', max_latency_ms=100)
+        for i, timestamp in enumerate([1.0, 1.05, 1.2, 1.25]):
+            mock_time.return_value = timestamp
+            capture.publish(bytes([i]))
+
+        mock_time.return_value = 1.3
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x02')
+        self.assertEqual(subscription.dropped_frames, 2)
+
+        capture.publish(b'\x04')
+        mock_time.return_value = 10.0
+        self.assertEqual(subscription.get_next_frame(timeout=0), b'\x04')
+
+    def test_unknown_policy_rejected(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0')
+        with self.assertRaises(ValueError):
+            capture.subscribe('task1', policy='block')
+
+    def test_subscribers_have_independent_cursors(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0')
+        first = capture.subscribe('task1')
+        capture.publish(b'a')
+        second = capture.subscribe('task2')
+        capture.publish(b'b')
+
+        self.assertEqual(first.get_next_frame(timeout=0), b'a')
+        self.assertEqual(first.get_next_frame(timeout=0), b'b')
+        self.assertEqual(second.get_next_frame(timeout=0), b'b')
+        self.assertEqual(capture.latest_frame(), b'b')
+
+    def test_closed_subscription_returns_none(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0')
+        subscription = capture.subscribe('task1')
+        capture.publish(b'a')
+        subscription.close()
+        self.assertIsNone(subscription.get_next_frame())
+
+    def test_h264_subscriber_waits_for_keyframe(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=10, profile='h264_low')
+        subscription = capture.subscribe('task1')
+        capture.publish(P_FRAME, 'h264')
+        self.assertIsNone(subscription.get_next_frame(timeout=0))
+        capture.publish(KEYFRAME, 'h264')
+        capture.publish(P_FRAME, 'h264')
+
+        self.assertEqual(subscription.get_next_frame(timeout=0), KEYFRAME)
+        self.assertEqual(subscription.get_next_frame(timeout=0), P_FRAME)
+        self.assertEqual(subscription.dropped_frames, 1)
+        self.assertEqual(subscription.codec, 'h264')
+
+    def test_h264_drop_resumes_at_next_keyframe(self):
+        capture = DeviceCapture(MagicMock(), '/dev/video0', ring_size=10)
+        subscription = capture.subscribe('task1', max_frames=2)
+        for frame in (KEYFRAME, P_FRAME, P_FRAME, P_FRAME, KEYFRAME, P_FRAME):
+            capture.publish(frame, 'h264')
+
+        self.assertEqual(subscription.get_next_frame(timeout=0), KEYFRAME)
+        self.assertEqual(subscription.cursor, 5)
+        self.assertEqual(subscription.dropped_frames, 4)
+
+
+class TestCaptureHub(unittest.TestCase):
+
+    def setUp(self):
+        self.ffmpeg_manager = FakeFFmpegManager()
+        self.hub = CaptureHub(self.ffmpeg_manager)
+
+    def tearDown(self):
+        self.hub.stop_all()
+
+    def test_one_capture_per_device(self):
+        first = self.hub.subscribe('/dev/video0', 'task1')
+        second = self.hub.subscribe('/dev/video0', 'task2')
+        self.ffmpeg_manager.push('/dev/video0', b'frame')
+
+        self.assertEqual(self.ffmpeg_manager.started, ['/dev/video0'])
+        self.assertEqual(first.get_next_frame(timeout=5), b'frame')
+        self.assertEqual(second.get_next_frame(timeout=5), b'frame')
+
+    def test_capture_stops_with_last_subscriber(self):
+        first = self.hub.subscribe('/dev/video0', 'task1')
+        second = self.hub.subscribe('/dev/video0', 'task2')
+
+        self.hub.unsubscribe(first)
+        self.assertIn('capture:/dev/video0', self.ffmpeg_manager.processes)
+        self.hub.unsubscribe(second)
+        self.assertNotIn('capture:/dev/video0', self.ffmpeg_manager.processes)
+        self.assertEqual(self.hub.list_captures(), {})
+
+    def test_stopping_capture_does_not_hold_the_hub(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        stop_stream = self.ffmpeg_manager.stop_stream
+
+        def slow_stop_stream(stream_id):
+            release.wait(5)
+            stop_stream(stream_id)
+
+        self.ffmpeg_manager.stop_stream = slow_stop_stream
+        subscription = self.hub.subscribe('/dev/video0', 'task1')
+        stopping = threading.Thread(target=self.hub.unsubscribe, args=(subscription,))
+        stopping.start()
+        deadline = time.monotonic() + 5
+        while '/dev/video0' not in self.hub.stopping and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        self.hub.subscribe('/dev/video1', 'task2')
+        self.assertEqual(self.hub.list_captures(), {'/dev/video1': ['task2']})
+        self.assertLess(time.monotonic() - started, 1)
+
+        # Reopening the same device waits for the old capture to let go of it
+        reopened = []
+        reopen = threading.Thread(target=lambda: reopened.append(self.hub.subscribe('/dev/video0', 'task3')))
+        reopen.start()
+        time.sleep(0.1)
+        self.assertEqual(reopened, [])
+        release.set()
+        stopping.join(timeout=5)
+        reopen.join(timeout=5)
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(self.ffmpeg_manager.started, ['/dev/video0', '/dev/video1', '/dev/video0'])
+
+    def test_profile_conflict_on_shared_device(self):
+        self.hub.subscribe('/dev/video0', 'task1', profile='mjpeg_low')
+        self.hub.subscribe('/dev/video0', 'task2')
+        self.hub.subscribe('/dev/video0', 'task3', profile={'name': 'mjpeg_low'})
+        with self.assertRaises(ValueError):
+            self.hub.subscribe('/dev/video0', 'task4', profile='h264_low')
+
+    def test_set_profile_reconfigures_capture(self):
+        subscription = self.hub.subscribe('/dev/video0', 'task1')
+        self.assertTrue(self.hub.set_profile('/dev/video0', 'h264_low'))
+        self.assertFalse(self.hub.set_profile('/dev/video0', 'h264_low'))
+
+        self.assertEqual(self.ffmpeg_manager.profiles['capture:/dev/video0']['name'], 'h264_low')
+        self.assertEqual(self.hub.get_profile('/dev/video0')['codec'], 'h264')
+        with self.assertRaises(ValueError):
+            self.hub.set_profile('/dev/video1', 'h264_low')
+        subscription.close()
+
+    def test_failed_reconfigure_keeps_profile(self):
+        subscription = self.hub.subscribe('/dev/video0', 'task1')
+        with patch.object(self.ffmpeg_manager, 'reconfigure_stream',
+                          side_effect=[ValueError('A capture change is already in progress'), None]) as reconfigure:
+            with self.assertRaises(ValueError):
+                self.hub.set_profile('/dev/video0', 'h264_low')
+            self.assertEqual(self.hub.get_profile('/dev/video0')['name'], 'mjpeg_high')
+
+            self.assertTrue(self.hub.set_profile('/dev/video0', 'h264_low'))
+        self.assertEqual(reconfigure.call_count, 2)
+        self.assertEqual(self.hub.get_profile('/dev/video0')['name'], 'h264_low')
+        subscription.close()
+
+    def test_subscribers_see_end_of_capture(self):
+        subscription = self.hub.subscribe('/dev/video0', 'task1')
+        self.ffmpeg_manager.push('/dev/video0', None)
+        self.assertIsNone(subscription.get_next_frame(timeout=5))
+
+
+if __name__ == '__main__':
+    unittest.main()
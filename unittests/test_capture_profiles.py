@@ -0,0 +1,59 @@
+import unittest
+from capture_profiles import build_ffmpeg_command, resolve_profile, validate_input_device
+
+
+class TestCaptureProfiles(unittest.TestCase):
+
+    def test_default_profile_keeps_full_quality_mjpeg(self):
+        command = build_ffmpeg_command('/dev/video0', resolve_profile())
+        self.assertEqual(command, [
+            'ffmpeg', '-nostats', '-progress', 'pipe:2', '-i', '/dev/video0',
+            '-f', 'image2pipe', '-vcodec', 'mjpeg', '-qscale:v', '2', 'pipe:1'
+        ])
+
+    def test_overrides_extend_named_profile(self):
+        profile = resolve_profile({'name': 'mjpeg_low', 'fps': 5})
+        self.assertEqual(profile['name'], 'mjpeg_low')
+        self.assertEqual(profile['width'], 640)
+        self.assertEqual(profile['fps'], 5)
+
+    def test_grayscale_profile_filters(self):
+        command = build_ffmpeg_command('/dev/video0', resolve_profile('detection_gray'))
+        self.assertEqual(command[command.index('-vf') + 1], 'fps=5,scale=640:360,hue=s=0')
+        self.assertEqual(command[command.index('-qscale:v') + 1], '8')
+
+    def test_h264_profile_uses_low_latency_x264(self):
+        command = build_ffmpeg_command('/dev/video0', resolve_profile('h264_low'))
+        self.assertEqual(command[command.index('-c:v') + 1], 'libx264')
+        self.assertEqual(command[command.index('-preset') + 1], 'ultrafast')
+        self.assertEqual(command[command.index('-tune') + 1], 'zerolatency')
+        self.assertEqual(command[command.index('-g') + 1], '20')
+        self.assertEqual(command[command.index('-b:v') + 1], '500k')
+        self.assertEqual(command[-3:], ['-f', 'h264', 'pipe:1'])
+
+    def test_synthetic_lavfi_input(self):
+        command = build_ffmpeg_command('lavfi:testsrc=size=640x360:rate=30', resolve_profile())
+        self.assertEqual(command[3:9], ['pipe:2', '-re', '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30'])
+        for source in ('lavfi:movie=/etc/passwd', 'lavfi:testsrc,drawtext=text=x', 'lavfi:testsrc;[out]'):
+            with self.assertRaises(ValueError, msg=source):
+                build_ffmpeg_command(source, resolve_profile())
+
+    def test_input_devices_limited_to_cameras(self):
+        self.assertEqual(validate_input_device('/dev/video2'), '/dev/video2')
+        self.assertEqual(validate_input_device('lavfi:testsrc'), 'lavfi:testsrc')
+        self.assertEqual(validate_input_device('rtsp://camera1/stream', ('rtsp://camera1/stream',)),
+                         'rtsp://camera1/stream')
+        for input_device in ('/etc/passwd', 'http://169.254.169.254/latest', '/dev/video0/../../etc/passwd',
+                             'lavfi:movie=/etc/passwd', 'rtsp://camera2/stream', None):
+            with self.assertRaises(ValueError, msg=input_device):
+                validate_input_device(input_device, ('rtsp://camera1/stream',))
+
+    def test_invalid_profiles(self):
+        for profile in ('missing', {'codec': 'vp9'}, {'width': 640}, {'width': 641, 'height': 360},
+                        {'quality': 40}, {'fps': 0}, {'colour': True}, 42):
+            with self.assertRaises(ValueError, msg=profile):
+                resolve_profile(profile)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import grpc
+from channel_pool import ChannelPool, DEFAULT_CHANNEL_OPTIONS
+
+
+class TestChannelPool(unittest.TestCase):
+
+    @patch('grpc.insecure_channel')
+    def test_channel_shared_per_address(self, mock_insecure_channel):
+        pool = ChannelPool(compression='gzip')
+
+        first = pool.acquire('localhost:50051')
+        second = pool.acquire('localhost:50051')
+
+        self.assertIs(first, second)
+        mock_insecure_channel.assert_called_once_with(
+            'localhost:50051', options=DEFAULT_CHANNEL_OPTIONS, compression=grpc.Compression.Gzip
+        )
+
+    @patch('grpc.insecure_channel')
+    def test_channel_closed_with_last_reference(self, mock_insecure_channel):
+        channel = MagicMock()
+        mock_insecure_channel.return_value = channel
+        pool = ChannelPool()
+
+        pool.acquire('localhost:50051')
+        pool.acquire('localhost:50051')
+        pool.release('localhost:50051')
+        channel.close.assert_not_called()
+        pool.release('localhost:50051')
+        channel.close.assert_called_once()
+        self.assertIsNone(pool.get('localhost:50051'))
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            ChannelPool(compression='brotli')
+
+    def test_wait_ready_times_out(self):
+        pool = ChannelPool()
+        pool.acquire('127.0.0.1:1')
+        self.assertFalse(pool.wait_ready('127.0.0.1:1', timeout=0.1))
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
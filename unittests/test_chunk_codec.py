@@ -0,0 +1,38 @@
+import unittest
+from unittest.mock import MagicMock
+import workloads_pb2
+from chunk_codec import RawVideoChunk, RawVideoStreamerStub, encode_varint, encode_video_chunk
+
+
+class TestChunkCodec(unittest.TestCase):
+
+    def test_matches_protobuf_serialization(self):
+        for data, processing_type, codec in [
+            (b'\xff\xd8' + b'\x01' * 300 + b'\xff\xd9', 'motion_detection', 'mjpeg'),
+            (b'\x00' * 70000, '', 'h264'),
+            (b'', 'object_detection', ''),
+            (b'', '', ''),
+        ]:
+            expected = workloads_pb2.VideoChunk(data=data, processing_type=processing_type, codec=codec)
+            self.assertEqual(encode_video_chunk(RawVideoChunk(data, processing_type, codec)),
+                             expected.SerializeToString())
+
+    def test_accepts_memoryview_data(self):
+        frame = bytearray(b'\xff\xd8frame\xff\xd9')
+        decoded = workloads_pb2.VideoChunk.FromString(encode_video_chunk(RawVideoChunk(memoryview(frame), 'x', 'mjpeg')))
+        self.assertEqual(decoded.data, bytes(frame))
+
+    def test_varint(self):
+        self.assertEqual(encode_varint(1), b'\x01')
+        self.assertEqual(encode_varint(300), b'\xac\x02')
+
+    def test_stub_registers_serializer(self):
+        channel = MagicMock()
+        RawVideoStreamerStub(channel)
+        path = channel.stream_unary.call_args[0][0]
+        self.assertEqual(path, '/workloads.VideoStreamer/StreamVideo')
+        self.assertIs(channel.stream_unary.call_args[1]['request_serializer'], encode_video_chunk)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,64 +1,560 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-from server.distribution_manager import DistributionManager
+import grpc
+from unittest.mock import patch, MagicMock, AsyncMock
+from distribution_manager import DistributionManager, StreamCapacityError, StreamSupervisor
 
 class TestDistributionManager(unittest.TestCase):
 
     def setUp(self):
-        self.manager = DistributionManager()
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+        self.manager = self._manager()
+
+    def _manager(self, **kwargs):
+        return DistributionManager(frame_store_dir=os.path.join(self.root_dir, 'frames'),
+                                   events_dir=os.path.join(self.root_dir, 'events'), **kwargs)
 
     @patch('distribution_manager.ExternalDeviceManager')
     def test_add_client(self, mock_external_device_manager):
         self.manager.add_client('client1', 'localhost:50051')
-        self.assertIn('client1', self.manager.external_devices)
-        mock_external_device_manager.assert_called_once_with('localhost:50051')
+        self.assertIn('client1', self.manager.list_clients())
+        mock_external_device_manager.assert_called_once_with('localhost:50051', channel_pool=self.manager.channel_pool)
 
     def test_remove_client(self):
-        self.manager.external_devices = {'client1': MagicMock()}
+        self.manager.registry.add_client('client1', MagicMock())
         self.manager.remove_client('client1')
-        self.assertNotIn('client1', self.manager.external_devices)
+        self.assertNotIn('client1', self.manager.list_clients())
 
     def test_list_clients(self):
-        self.manager.external_devices = {'client1': MagicMock(), 'client2': MagicMock()}
+        self.manager.registry.add_client('client1', MagicMock())
+        self.manager.registry.add_client('client2', MagicMock())
         clients = self.manager.list_clients()
         self.assertEqual(clients, ['client1', 'client2'])
 
-    @patch('distribution_manager.FFmpegManager')
-    @patch('distribution_manager.ExternalDeviceManager')
-    def test_start_video_stream_task(self, mock_external_device_manager, mock_ffmpeg_manager):
-        mock_device = MagicMock()
-        mock_external_device_manager.return_value = mock_device
-        self.manager.external_devices['client1'] = mock_device
+    def test_start_video_stream_task(self):
+        mock_device = MagicMock(processing_type='motion_detection')
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
 
-        self.manager.start_task('task1', 'video_stream', 'client1')
-        self.assertIn('task1', self.manager.tasks)
-        mock_ffmpeg_manager().start_stream.assert_called_once_with('task1')
-        mock_device.stream_video.assert_called_once_with('task1', mock_ffmpeg_manager())
+        task_id = self.manager.start_task('video_stream', 'client1')
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
 
-    @patch('distribution_manager.FFmpegManager')
-    @patch('distribution_manager.ExternalDeviceManager')
-    def test_start_non_video_stream_task(self, mock_external_device_manager, mock_ffmpeg_manager):
-        mock_device = MagicMock()
-        mock_external_device_manager.return_value = mock_device
-        self.manager.external_devices['client1'] = mock_device
-
-        self.manager.start_task('task1', 'other_task', 'client1')
-        self.assertIn('task1', self.manager.tasks)
-        mock_device.send_task.assert_called_once_with('task1', 'other_task')
-
-    @patch('distribution_manager.FFmpegManager')
-    def test_stop_task(self, mock_ffmpeg_manager):
-        self.manager.tasks = {'task1': {'type': 'video_stream', 'client_id': 'client1'}}
-        self.manager.stop_task('task1')
-        self.assertNotIn('task1', self.manager.tasks)
-        mock_ffmpeg_manager().stop_stream.assert_called_once_with('task1')
+        self.assertTrue(self.manager.registry.has_task(task_id))
+        self.manager.capture_hub.subscribe.assert_called_once_with(
+            '/dev/video0', task_id, profile=None, max_frames=5, max_latency_ms=500, policy='drop_oldest')
+        mock_device.stream_video.assert_called_once()
+        self.assertEqual(mock_device.stream_video.call_args.args[0], task_id)
+
+    def test_start_non_video_stream_task(self):
+        mock_device = MagicMock(processing_type='motion_detection')
+        self.manager.registry.add_client('client1', mock_device)
+
+        task_id = self.manager.start_task('other_task', 'client1')
+
+        self.assertEqual(self.manager.registry.get_task(task_id)['state'], 'sent')
+        mock_device.send_task.assert_called_once_with(task_id, 'other_task')
+
+    def test_stop_task(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        mock_device = MagicMock(processing_type='motion_detection')
+        mock_device.stream_video.side_effect = lambda task_id, subscription, state: release.wait(5)
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
+        task_id = self.manager.start_task('video_stream', 'client1')
+
+        self.manager.stop_task(task_id)
+
+        self.assertTrue(self.manager.stream_supervisor.get_state(task_id).stop_requested)
+        self.assertIn(self.manager.registry.get_task(task_id)['state'], ('stopping', 'stopped'))
+        self.manager.capture_hub.unsubscribe.assert_called_once()
+        release.set()
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+        self.assertEqual(self.manager.registry.get_task(task_id)['state'], 'stopped')
 
     def test_update_task_settings(self):
-        self.manager.tasks = {'task1': {'type': 'video_stream', 'client_id': 'client1'}}
+        self.manager.registry.add_task('task1', 'video_stream', 'client1')
         settings = {'setting1': 'value1'}
         with self.assertLogs(level='INFO') as log:
             self.manager.update_task_settings('task1', settings)
             self.assertIn('Updated settings for task task1 with settings', log.output[0])
 
+    def test_update_task_settings_profile(self):
+        self.manager.capture_hub = MagicMock()
+        self.manager.registry.add_task('task1', 'video_stream', 'client1', state='running', input_device='/dev/video2')
+        self.manager.subscriptions['task1'] = MagicMock()
+
+        self.manager.update_task_settings('task1', {'profile': 'h264_low'})
+
+        self.manager.capture_hub.set_profile.assert_called_once_with('/dev/video2', 'h264_low')
+
+    def test_update_task_settings_applies_live_settings_per_task(self):
+        mock_device = MagicMock(processing_type='motion_detection')
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
+        task_id = 'task1'
+        self.manager._subscribe_stream(task_id, 'client1', '/dev/video0', None,
+                                       stream_settings=self.manager._stream_settings(mock_device, None))
+
+        self.manager.update_task_settings(task_id, {'processing_type': 'object_detection', 'frame_skip': 2})
+
+        task_stream = self.manager.task_streams[task_id]
+        self.assertEqual(task_stream.processing_type, 'object_detection')
+        self.assertEqual(task_stream.settings.frame_skip, 2)
+        mock_device.update_processing_type.assert_not_called()
+        self.assertEqual(self.manager.get_task_status(task_id)['settings']['frame_skip'], 2)
+
+    def test_update_task_settings_profile_needs_video_stream(self):
+        self.manager.registry.add_task('task2', 'detect', 'client1', state='sent')
+        with self.assertRaises(ValueError):
+            self.manager.update_task_settings('task2', {'profile': 'h264_low'})
+
+    def test_start_video_stream_returns_before_stream_ends(self):
+        release = threading.Event()
+        mock_device = MagicMock(processing_type='motion_detection')
+        mock_device.stream_video.side_effect = lambda task_id, subscription, state: release.wait(5)
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
+
+        task_id = self.manager.start_task('video_stream', 'client1')
+
+        self.assertIsNotNone(task_id)
+        self.assertEqual(self.manager.get_task_status(task_id)['type'], 'video_stream')
+        release.set()
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+        self.assertEqual(self.manager.get_task_status(task_id)['state'], 'stopped')
+
+    def test_start_stream_rejects_other_inputs(self):
+        self.manager.registry.add_client('client1', MagicMock(processing_type='motion_detection'))
+        self.manager.capture_hub = MagicMock()
+
+        with self.assertRaises(ValueError):
+            self.manager.start_task('video_stream', 'client1', '/etc/passwd')
+
+        self.manager.capture_hub.subscribe.assert_not_called()
+        self.assertEqual(self.manager.registry.list_task_ids(), [])
+
+    def test_streams_past_capacity_are_refused(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        mock_device = MagicMock(processing_type='motion_detection')
+        mock_device.stream_video.side_effect = lambda task_id, subscription, state: release.wait(5)
+        manager = self._manager(max_stream_workers=2)
+        self.addCleanup(manager.shutdown)
+        manager.registry.add_client('client1', mock_device)
+        manager.capture_hub = MagicMock()
+        running = [manager.start_task('video_stream', 'client1') for _ in range(2)]
+
+        with self.assertRaises(StreamCapacityError):
+            manager.start_task('video_stream', 'client1')
+
+        self.assertEqual(sorted(manager.registry.list_task_ids()), sorted(running))
+        self.assertEqual(manager.capture_hub.unsubscribe.call_count, 1)
+        release.set()
+        manager.stream_supervisor.wait(running[0], timeout=5)
+        self.assertIsNotNone(manager.start_task('video_stream', 'client1'))
+
+    def test_failed_stream_reports_error(self):
+        mock_device = MagicMock(processing_type='motion_detection')
+        mock_device.stream_video.side_effect = RuntimeError('edge device gone')
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
+
+        task_id = self.manager.start_task('video_stream', 'client1')
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+
+        status = self.manager.get_task_status(task_id)
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['error'], 'edge device gone')
+
+    @patch('distribution_manager.AsyncExternalDeviceManager')
+    def test_start_video_stream_task_async(self, mock_async_device_manager):
+        mock_async_device = MagicMock(processing_type='motion_detection')
+        mock_async_device.stream_video = AsyncMock()
+        mock_async_device_manager.return_value = mock_async_device
+        self.manager.registry.add_client('client1', MagicMock(address='localhost:50051', processing_type='motion_detection'))
+        self.manager.capture_hub = MagicMock()
+
+        async def run():
+            task_id = await self.manager.start_task_async('video_stream', 'client1')
+            await self.manager.stream_supervisor.wait_async(task_id)
+            return task_id
+
+        task_id = asyncio.run(run())
+
+        mock_async_device_manager.assert_called_once_with(
+            'localhost:50051',
+            options=self.manager.channel_pool.options,
+            compression=self.manager.channel_pool.compression
+        )
+        mock_async_device.stream_video.assert_awaited_once()
+        self.assertEqual(self.manager.get_task_status(task_id)['state'], 'stopped')
+
+    @patch('distribution_manager.AsyncExternalDeviceManager')
+    def test_stream_stopped_while_pending_is_finished(self, mock_async_device_manager):
+        mock_async_device = MagicMock(processing_type='motion_detection')
+        mock_async_device.stream_video = AsyncMock()
+        mock_async_device_manager.return_value = mock_async_device
+        self.manager.registry.add_client('client1', MagicMock(address='localhost:50051', processing_type='motion_detection'))
+        self.manager.capture_hub = MagicMock()
+
+        async def run():
+            task_id = await self.manager.start_task_async('video_stream', 'client1')
+            # The worker task has not run yet
+            self.assertEqual(self.manager.get_task_status(task_id)['state'], 'pending')
+            self.manager.stop_task(task_id)
+            await self.manager.stream_supervisor.wait_async(task_id)
+            return task_id
+
+        task_id = asyncio.run(run())
+
+        mock_async_device.stream_video.assert_not_awaited()
+        self.assertEqual(self.manager.get_task_status(task_id)['state'], 'stopped')
+        self.assertEqual(self.manager.registry.task_ids_in_state('stopping'), [])
+        self.assertEqual(self.manager.registry.get_task(task_id)['state'], 'stopped')
+
+    @patch('distribution_manager.AsyncExternalDeviceManager')
+    def test_start_non_video_stream_task_async(self, mock_async_device_manager):
+        mock_async_device = MagicMock(processing_type='motion_detection')
+        mock_async_device.send_task = AsyncMock()
+        mock_async_device_manager.return_value = mock_async_device
+        self.manager.registry.add_client('client1', MagicMock(address='localhost:50051', processing_type='motion_detection'))
+
+        task_id = asyncio.run(self.manager.start_task_async('other_task', 'client1', payload='data'))
+
+        self.assertTrue(self.manager.registry.has_task(task_id))
+        mock_async_device.send_task.assert_awaited_once_with(task_id, 'other_task', 'data')
+
+    @patch('distribution_manager.AsyncExternalDeviceManager')
+    def test_async_devices_are_per_event_loop(self, mock_async_device_manager):
+        mock_async_device_manager.side_effect = lambda *args, **kwargs: MagicMock(close=AsyncMock())
+        self.manager.registry.add_client('client1', MagicMock(address='localhost:50051', processing_type='motion_detection'))
+
+        async def get_device():
+            return self.manager._get_async_device('client1')
+
+        first = asyncio.run(get_device())
+        second = asyncio.run(get_device())
+
+        self.assertIsNot(first, second)
+        self.assertEqual(mock_async_device_manager.call_count, 2)
+        # The first loop is closed, so its device was dropped
+        self.assertEqual(len(self.manager.async_external_devices), 1)
+
+    @patch('distribution_manager.AsyncExternalDeviceManager')
+    def test_remove_client_closes_async_channel_on_its_loop(self, mock_async_device_manager):
+        device = MagicMock(close=AsyncMock())
+        mock_async_device_manager.return_value = device
+        self.manager.registry.add_client('client1', MagicMock(address='localhost:50051', processing_type='motion_detection'))
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(loop.close)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+
+        async def get_device():
+            return self.manager._get_async_device('client1')
+
+        asyncio.run_coroutine_threadsafe(get_device(), loop).result(5)
+        self.manager.remove_client('client1')
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(5)
+
+        device.close.assert_awaited_once()
+        self.assertEqual(self.manager._async_devices_for('client1'), [])
+
+    def test_failed_send_marks_task_failed(self):
+        device = MagicMock(processing_type='motion_detection')
+        device.send_task.side_effect = grpc.RpcError('edge device gone')
+        self.manager.registry.add_client('client1', device)
+
+        with self.assertRaises(grpc.RpcError):
+            self.manager.start_task('detect', 'client1')
+
+        task_id = self.manager.registry.task_ids_for_client('client1').pop()
+        status = self.manager.get_task_status(task_id)
+        self.assertEqual((status['state'], status['error']), ('failed', 'edge device gone'))
+        self.assertEqual(self.manager.registry.count_tasks(client_id='client1', state='pending'), 0)
+
+    def test_collect_metrics_reports_streams_and_ffmpeg(self):
+        self.manager.ffmpeg_manager = MagicMock()
+        self.manager.ffmpeg_manager.list_stream_stats.return_value = {
+            'capture:/dev/video0': {'running': True, 'restarts': 1, 'fps': 25.0, 'cpu_seconds': 1.5, 'rss_bytes': 2048}
+        }
+        self.manager.stream_supervisor.submit('task1', 'client1', lambda state: state.record_chunk(100, 0.002))
+        self.manager.stream_supervisor.wait('task1', timeout=5)
+
+        families = {name: samples for name, kind, help_text, samples in self.manager.collect_metrics()}
+
+        labels = {'task_id': 'task1', 'client_id': 'client1'}
+        self.assertIn(('addon_stream_bytes_total', labels, 100), families['addon_stream_bytes_total'])
+        self.assertIn(('addon_stream_send_latency_seconds_count', labels, 1),
+                      families['addon_stream_send_latency_seconds'])
+        self.assertIn(('addon_ffmpeg_resident_memory_bytes', {'stream_id': 'capture:/dev/video0'}, 2048),
+                      families['addon_ffmpeg_resident_memory_bytes'])
+
+    def test_start_tasks_batches_per_device(self):
+        camera1 = MagicMock(processing_type='motion_detection')
+        camera2 = MagicMock(processing_type='motion_detection')
+        camera2.send_task_batch.side_effect = RuntimeError('edge device gone')
+        self.manager.registry.add_client('camera1', camera1)
+        self.manager.registry.add_client('camera2', camera2)
+
+        results = self.manager.start_tasks([
+            {'task_type': 'detect', 'client_id': 'camera1', 'payload': 'a'},
+            {'task_type': 'detect', 'client_id': 'camera2'},
+            {'task_type': 'count', 'client_id': 'camera1'},
+            {'task_type': 'detect', 'client_id': 'unknown'},
+        ])
+
+        self.assertEqual([result['state'] for result in results], ['sent', 'failed', 'sent', 'failed'])
+        batch = camera1.send_task_batch.call_args[0][0]
+        self.assertEqual(batch, [(results[0]['task_id'], 'detect', 'a'), (results[2]['task_id'], 'count', '')])
+        self.assertEqual(results[1]['error'], 'edge device gone')
+        self.assertEqual(self.manager.get_task_status(results[1]['task_id'])['state'], 'failed')
+        self.assertIsNone(results[3]['task_id'])
+
+    def test_schedule_task_places_on_least_loaded_device(self):
+        camera1 = MagicMock(processing_type='motion_detection')
+        camera2 = MagicMock(processing_type='motion_detection')
+        self.manager.registry.add_client('camera1', camera1)
+        self.manager.registry.add_client('camera2', camera2)
+        self.manager.registry.add_task('stream1', 'video_stream', 'camera1', state='running')
+
+        task_id = self.manager.schedule_task('detect', 'zone=1')
+        self.manager.dispatch_executor.shutdown(wait=True)
+
+        camera2.send_task.assert_called_once_with(task_id, 'detect', 'zone=1')
+        status = self.manager.get_task_status(task_id)
+        self.assertEqual((status['client_id'], status['state']), ('camera2', 'sent'))
+
+    def test_schedule_task_waits_for_a_device(self):
+        task_id = self.manager.schedule_task('detect')
+        self.assertEqual(self.manager.get_task_status(task_id)['state'], 'queued')
+        with self.assertRaises(ValueError):
+            self.manager.schedule_task('video_stream')
+
+    def test_stream_fails_over_to_healthy_device(self):
+        camera1 = MagicMock(processing_type='motion_detection')
+        camera1.stream_video.side_effect = grpc.RpcError('edge device gone')
+        camera2 = MagicMock(processing_type='motion_detection')
+        self.manager.registry.add_client('camera1', camera1)
+        self.manager.registry.add_client('camera2', camera2)
+        self.manager.capture_hub = MagicMock()
+
+        task_id = self.manager.start_task('video_stream', 'camera1')
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+
+        camera2.stream_video.assert_called_once()
+        status = self.manager.get_task_status(task_id)
+        self.assertEqual((status['client_id'], status['state'], status['failovers']), ('camera2', 'stopped', 1))
+        alert = self.manager.get_alerts()['alerts'][-1]
+        self.assertEqual((alert['type'], alert['target_client_id']), ('stream_failover', 'camera2'))
+
+    def test_stream_fails_when_no_device_supports_it(self):
+        camera1 = MagicMock(processing_type='motion_detection')
+        camera1.stream_video.side_effect = grpc.RpcError('edge device gone')
+        self.manager.registry.add_client('camera1', camera1)
+        self.manager.registry.add_client('camera2', MagicMock())
+        self.manager.health_checker._record_success('camera2', {'latency': 0.01, 'processing_types': ['ocr']})
+        self.manager.capture_hub = MagicMock()
+
+        task_id = self.manager.start_task('video_stream', 'camera1')
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+
+        self.assertEqual(self.manager.get_task_status(task_id)['state'], 'failed')
+
+    def test_device_down_requests_failover(self):
+        release = threading.Event()
+        call = MagicMock()
+        camera1 = MagicMock(processing_type='motion_detection')
+
+        def stream_video(task_id, subscription, state):
+            state.call = call
+            release.wait(5)
+
+        camera1.stream_video.side_effect = stream_video
+        self.manager.registry.add_client('camera1', camera1)
+        self.manager.capture_hub = MagicMock()
+        task_id = self.manager.start_task('video_stream', 'camera1')
+        deadline = time.monotonic() + 5
+        while self.manager.stream_supervisor.get_state(task_id).call is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.manager._on_device_down('camera1', 'timeout')
+
+        self.assertTrue(self.manager.stream_supervisor.get_state(task_id).failover_requested)
+        call.cancel.assert_called_once()
+        self.assertEqual(self.manager.get_alerts()['alerts'][-1]['type'], 'device_down')
+        release.set()
+        self.manager.stream_supervisor.wait(task_id, timeout=5)
+
+    def test_get_latest_frame_reads_capture_ring(self):
+        subscription = MagicMock()
+        subscription.capture.wait_for_frame.return_value = (7, 0.0, b'jpeg', 'mjpeg', True)
+        self.manager.subscriptions['task1'] = subscription
+
+        self.assertEqual(self.manager.get_latest_frame('task1', 3, timeout=1), (7, b'jpeg', 'mjpeg'))
+        subscription.capture.wait_for_frame.assert_called_once_with(3, 1)
+        subscription.capture.wait_for_frame.return_value = None
+        subscription.capture.ended = False
+        subscription.capture.stopping = False
+        subscription.capture.profile = {'codec': 'mjpeg'}
+        self.assertEqual(self.manager.get_latest_frame('task1', 7), (7, None, 'mjpeg'))
+        self.assertIsNone(self.manager.get_latest_frame('missing'))
+
+    def test_alerts_trigger_event_recordings(self):
+        self.manager.event_recorder = MagicMock()
+        record = self.manager.add_alert({'message': 'person detected', 'client_id': 'client1'})
+        self.manager.event_recorder.trigger.assert_called_once_with(record)
+
+        self.manager.event_recorder.trigger.side_effect = OSError('disk full')
+        self.assertEqual(self.manager.add_alert({'message': 'again', 'client_id': 'client1'})['seq'], 2)
+        self.manager.add_alert({'type': 'device_up', 'message': 'back', 'client_id': 'client1'})
+        self.manager.add_alert({'type': 'device_down', 'message': 'gone', 'client_id': 'client1'})
+        self.manager.add_alert({'type': 'stream_failover', 'message': 'moved', 'client_id': 'client1'})
+        self.assertEqual(self.manager.event_recorder.trigger.call_count, 2)
+
+    def test_streams_feed_the_event_recorder(self):
+        self.manager.event_recorder = MagicMock()
+        self.manager.capture_hub = MagicMock()
+        self.manager.registry.add_client('client1', MagicMock())
+        task_stream = self.manager._subscribe_stream('task1', 'client1', '/dev/video0', None)
+
+        self.manager.event_recorder.attach.assert_called_once_with('task1', 'client1', task_stream.subscription.capture)
+        self.manager._release_subscription('task1')
+        self.manager.event_recorder.detach.assert_called_once_with('task1')
+
+    @patch('distribution_manager.ExternalDeviceManager')
+    def test_snapshot_restores_clients_and_streams(self, mock_external_device_manager):
+        path = os.path.join(self.root_dir, 'registry.json')
+        release = threading.Event()
+        self.addCleanup(release.set)
+        mock_device = mock_external_device_manager.return_value
+        mock_device.processing_type = 'motion_detection'
+        mock_device.address = 'localhost:50051'
+        mock_device.stream_video.side_effect = lambda task_id, subscription, state: release.wait(5)
+
+        manager = self._manager(snapshot_path=path)
+        manager.capture_hub = MagicMock()
+        manager.capture_hub.subscribe.return_value.capture.profile = {'name': 'mjpeg_low', 'codec': 'mjpeg'}
+        manager.add_client('client1', 'localhost:50051')
+        task_id = manager.start_task('video_stream', 'client1', '/dev/video2', {'max_frames': 5},
+                                     settings={'frame_skip': 2})
+        manager.snapshot.close()
+
+        restarted = self._manager(snapshot_path=path)
+        restarted.capture_hub = MagicMock()
+        restarted.capture_hub.subscribe.return_value.capture.profile = {'name': 'mjpeg_low', 'codec': 'mjpeg'}
+        summary = restarted.restore()
+        self.addCleanup(restarted.shutdown)
+        self.addCleanup(manager.shutdown)
+
+        self.assertEqual(summary, {'clients': 1, 'streams': 1, 'failed': []})
+        self.assertEqual(restarted.list_clients(), ['client1'])
+        status = restarted.get_task_status(task_id)
+        self.assertEqual(status['state'], 'running')
+        self.assertEqual(status['settings']['frame_skip'], 2)
+        restarted.capture_hub.subscribe.assert_called_once_with(
+            '/dev/video2', task_id, profile={'name': 'mjpeg_low', 'codec': 'mjpeg'}, max_frames=5,
+            max_latency_ms=500, policy='drop_oldest')
+
+    def test_restore_without_snapshot(self):
+        self.assertIsNone(self.manager.restore())
+
+    def test_remove_client_stops_its_streams(self):
+        release = threading.Event()
+        mock_device = MagicMock(processing_type='motion_detection')
+        mock_device.stream_video.side_effect = lambda task_id, subscription, state: release.wait(5)
+        self.manager.registry.add_client('client1', mock_device)
+        self.manager.capture_hub = MagicMock()
+        task_id = self.manager.start_task('video_stream', 'client1')
+
+        self.manager.remove_client('client1')
+        release.set()
+
+        self.manager.capture_hub.unsubscribe.assert_called_once()
+        self.assertIsNone(self.manager.get_task_status(task_id))
+        self.assertEqual(self.manager.list_task_statuses(client_id='client1'), [])
+        mock_device.close.assert_called_once()
+
+
+class TestStreamSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = StreamSupervisor(max_streams=2)
+
+    def tearDown(self):
+        self.supervisor.shutdown()
+
+    def test_counts_chunks_and_bytes(self):
+        def stream(state):
+            state.record_chunk(10)
+            state.record_chunk(20)
+
+        self.supervisor.submit('task1', 'client1', stream)
+        self.supervisor.wait('task1', timeout=5)
+
+        status = self.supervisor.get_status('task1')
+        self.assertEqual(status['chunks_sent'], 2)
+        self.assertEqual(status['bytes_sent'], 30)
+        self.assertEqual(status['state'], 'stopped')
+
+    def test_error_after_stop_request_is_stopped(self):
+        started = threading.Event()
+
+        def stream(state):
+            started.set()
+            while not state.stop_requested:
+                time.sleep(0.01)
+            raise RuntimeError('pipe closed')
+
+        self.supervisor.submit('task1', 'client1', stream)
+        started.wait(5)
+        self.supervisor.request_stop('task1')
+        self.supervisor.wait('task1', timeout=5)
+
+        self.assertEqual(self.supervisor.get_status('task1')['state'], 'stopped')
+
+    def test_each_stream_gets_its_own_worker(self):
+        release = threading.Event()
+        states = [self.supervisor.submit(f'task{i}', 'client1', lambda state: release.wait(5)) for i in range(2)]
+        deadline = time.monotonic() + 5
+        while any(state.state != 'running' for state in states) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual([state.state for state in states], ['running', 'running'])
+        with self.assertRaises(StreamCapacityError):
+            self.supervisor.submit('task3', 'client1', lambda state: None)
+        self.assertIsNone(self.supervisor.get_state('task3'))
+        release.set()
+
+    def test_stop_before_start_calls_on_exit(self):
+        on_exit = MagicMock()
+        stream = MagicMock()
+
+        async def run():
+            self.supervisor.submit_async('task1', 'client1', stream, on_exit=on_exit)
+            self.supervisor.request_stop('task1')
+            await self.supervisor.wait_async('task1')
+
+        asyncio.run(run())
+
+        stream.assert_not_called()
+        on_exit.assert_called_once()
+        self.assertEqual(self.supervisor.get_status('task1')['state'], 'stopped')
+
+    def test_on_exit_called(self):
+        on_exit = MagicMock()
+        self.supervisor.submit('task1', 'client1', lambda state: None, on_exit=on_exit)
+        self.supervisor.wait('task1', timeout=5)
+        on_exit.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
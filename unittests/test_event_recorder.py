@@ -0,0 +1,190 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from event_recorder import EventRecorder, PreRoll
+
+
+class FakeCapture:
+    def __init__(self, codec='mjpeg'):
+        self.profile = {'codec': codec}
+        self.listeners = []
+        self.seq = 0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def publish(self, frame, captured_at=None, codec='mjpeg', keyframe=True):
+        entry = (self.seq, time.time() if captured_at is None else captured_at, frame, codec, keyframe)
+        self.seq += 1
+        for listener in list(self.listeners):
+            listener(entry)
+
+
+class TestPreRoll(unittest.TestCase):
+
+    def test_keeps_only_the_last_seconds(self):
+        pre_roll = PreRoll(2.0)
+        for second in range(6):
+            pre_roll.append((second, float(second), b'f%d' % second, 'mjpeg', True))
+        self.assertEqual([entry[2] for entry in pre_roll.snapshot()], [b'f3', b'f4', b'f5'])
+
+    def test_h264_snapshot_starts_on_a_keyframe(self):
+        pre_roll = PreRoll(10.0)
+        for seq, keyframe in enumerate([False, False, True, False]):
+            pre_roll.append((seq, float(seq), b'f%d' % seq, 'h264', keyframe))
+        self.assertEqual([entry[0] for entry in pre_roll.snapshot()], [2, 3])
+
+
+class TestEventRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+
+    def make_recorder(self, **kwargs):
+        kwargs.setdefault('pre_roll_seconds', 2.0)
+        kwargs.setdefault('post_roll_seconds', 5.0)
+        recorder = EventRecorder(self.root_dir, **kwargs)
+        self.addCleanup(recorder.close)
+        return recorder
+
+    def test_alert_writes_pre_roll_and_post_roll(self):
+        recorder = self.make_recorder()
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        now = time.time()
+        for offset, frame in [(-4, b'old'), (-1.5, b'pre1'), (-0.5, b'pre2')]:
+            capture.publish(frame, now + offset)
+
+        paths = recorder.trigger({'seq': 7, 'client_id': 'client1', 'timestamp': now})
+        self.assertEqual(len(paths), 1)
+        capture.publish(b'post1', now + 1)
+        capture.publish(b'post2', now + 4)
+        # Past the post-roll: closes the segment and is not part of it
+        capture.publish(b'after', now + 6)
+        recorder.flush()
+
+        with open(paths[0], 'rb') as segment:
+            self.assertEqual(segment.read(), b'pre1pre2post1post2')
+        with open(paths[0] + '.json') as sidecar:
+            metadata = json.load(sidecar)
+        self.assertEqual(metadata['frames'], 4)
+        self.assertEqual(metadata['alerts'], [7])
+        self.assertEqual(metadata['task_id'], 'task1')
+        self.assertEqual(recorder.list_segments('client1'), [metadata])
+        self.assertEqual(recorder.segment_path('client1', os.path.basename(paths[0])), paths[0])
+
+    def test_overlapping_alerts_extend_the_recording(self):
+        recorder = self.make_recorder()
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        now = time.time()
+        first = recorder.trigger({'seq': 1, 'client_id': 'client1'})
+        self.assertEqual(recorder.trigger({'seq': 2, 'client_id': 'client1'}), [])
+        capture.publish(b'a', now + 1)
+        capture.publish(b'b', now + 60)
+        recorder.flush()
+
+        metadata = recorder.list_segments()
+        self.assertEqual(len(metadata), 1)
+        self.assertEqual(metadata[0]['alerts'], [1, 2])
+        with open(first[0], 'rb') as segment:
+            self.assertEqual(segment.read(), b'a')
+
+    def test_alerts_for_other_clients_are_ignored(self):
+        recorder = self.make_recorder()
+        recorder.attach('task1', 'client1', FakeCapture())
+        self.assertEqual(recorder.trigger({'seq': 1, 'client_id': 'client2'}), [])
+        self.assertEqual(recorder.trigger({'seq': 2}), [])
+
+        recorder.reassign('task1', 'client2')
+        self.assertEqual(len(recorder.trigger({'seq': 3, 'client_id': 'client2'})), 1)
+
+    def test_detach_finishes_the_recording(self):
+        recorder = self.make_recorder()
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        capture.publish(b'pre')
+        recorder.trigger({'seq': 1, 'client_id': 'client1'})
+        capture.publish(b'post')
+        recorder.detach('task1')
+        recorder.flush()
+
+        self.assertEqual(capture.listeners, [])
+        self.assertEqual(recorder.list_segments()[0]['frames'], 2)
+
+    def test_stalled_writer_never_blocks_the_capture_thread(self):
+        recorder = self.make_recorder(queue_size=1)
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        write = recorder._write
+
+        def slow_write(recording, entry):
+            release.wait(5)
+            write(recording, entry)
+
+        recorder._write = slow_write
+        now = time.time()
+        capture.publish(b'pre', now - 0.5)
+        recorder.trigger({'seq': 1, 'client_id': 'client1', 'timestamp': now})
+        started = time.monotonic()
+        for offset in range(1, 5):
+            capture.publish(b'post%d' % offset, now + offset / 10)
+        # Past the post-roll: the finish is queued even though the frames are not
+        capture.publish(b'after', now + 60)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertGreater(recorder.stats()['dropped_frames'], 0)
+
+        release.set()
+        recorder.flush()
+        segment = recorder.list_segments('client1')[0]
+        self.assertEqual(segment['frames'], 5 - recorder.stats()['dropped_frames'])
+
+    def test_retention_drops_oldest_segments(self):
+        recorder = self.make_recorder(pre_roll_seconds=10.0, max_bytes=2500)
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        names = []
+        for seq in range(1, 4):
+            capture.publish(b'x' * 1000)
+            names.extend(os.path.basename(path) for path in recorder.trigger({'seq': seq, 'client_id': 'client1'}))
+            recorder.detach('task1')
+            recorder.attach('task1', 'client1', capture)
+        recorder.flush()
+
+        remaining = [segment['name'] for segment in recorder.list_segments()]
+        self.assertEqual(remaining, names[1:])
+        self.assertFalse(os.path.exists(os.path.join(self.root_dir, 'client1', names[0])))
+        self.assertLessEqual(recorder.stats()['bytes'], 2500)
+
+    def test_existing_segments_count_against_the_budget(self):
+        recorder = self.make_recorder()
+        capture = FakeCapture()
+        recorder.attach('task1', 'client1', capture)
+        capture.publish(b'frame')
+        recorder.trigger({'seq': 1, 'client_id': 'client1'})
+        recorder.detach('task1')
+        recorder.flush()
+
+        restarted = self.make_recorder()
+        self.assertEqual(restarted.stats()['segments'], 1)
+        self.assertEqual(len(restarted.list_segments('client1')), 1)
+
+    def test_segment_path_rejects_traversal(self):
+        recorder = self.make_recorder()
+        self.assertIsNone(recorder.segment_path('..', 'x.mjpeg'))
+        self.assertIsNone(recorder.segment_path('client1', '../x.mjpeg'))
+        self.assertIsNone(recorder.segment_path('client1', 'missing.mjpeg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock, call
 import grpc
-from server.external_device_manager import ExternalDeviceManager
+from distribution_manager import StreamState
+from external_device_manager import ExternalDeviceManager
 import workloads_pb2
+import workloads_pb2_grpc
+from fake_edge_server import start_fake_server, FakeTaskManager, FakeVideoStreamer, LegacyTaskManager
 
 class TestExternalDeviceManager(unittest.TestCase):
 
@@ -20,7 +25,7 @@ class TestExternalDeviceManager(unittest.TestCase):
     @patch('external_device_manager.ExternalDeviceManager.stream_video')
     def test_stream_video(self, mock_stream_video, mock_stream_video_return, mock_stream_video_method):
         ffmpeg_manager = MagicMock()
-        ffmpeg_manager.get_stream_output.return_value = b'fake_chunk'
+        ffmpeg_manager.get_next_frame.return_value = b'fake_chunk'
         
         self.manager.stream_video('test_task_id', ffmpeg_manager)
         
@@ -30,7 +35,7 @@ class TestExternalDeviceManager(unittest.TestCase):
         ]
         self.mock_video_stub.assert_has_calls(calls)
         mock_stream_video_method.assert_called_with('test_task_id', ffmpeg_manager)
-        ffmpeg_manager.get_stream_output.assert_called_with('test_task_id')
+        ffmpeg_manager.get_next_frame.assert_called_with()
 
     @patch('workloads_pb2_grpc.TaskManagerStub.SendTask')
     def test_send_task(self, mock_send_task):
@@ -76,5 +81,223 @@ class TestExternalDeviceManager(unittest.TestCase):
         with self.assertRaises(grpc.RpcError):
             self.manager.stream_task('test_task_id', data_chunks)
 
+class TestExternalDeviceManagerFrames(unittest.TestCase):
+    FRAMES = [
+        (b'frame1', '2024-01-01T00:00:01'),
+        (b'frame22', '2024-01-01T00:00:02'),
+        (b'frame333', '2024-01-01T00:00:03'),
+    ]
+
+    def start(self, task_manager):
+        self.server, address, _, _ = start_fake_server(task_manager=task_manager)
+        self.addCleanup(self.server.stop, None)
+        return ExternalDeviceManager(address)
+
+    def test_iter_frames_since_and_limit(self):
+        manager = self.start(FakeTaskManager(frames=self.FRAMES))
+        frames = list(manager.iter_frames(since_timestamp='2024-01-01T00:00:01', limit=1))
+        self.assertEqual(frames, [{'image': b'frame22', 'timestamp': '2024-01-01T00:00:02', 'size': 7}])
+
+    def test_frame_summary_is_metadata_only(self):
+        manager = self.start(FakeTaskManager(frames=self.FRAMES))
+        frames = list(manager.iter_frames(metadata_only=True))
+        self.assertEqual([frame['image'] for frame in frames], [b'', b'', b''])
+        self.assertEqual([frame['size'] for frame in frames], [6, 7, 8])
+        self.assertEqual(manager.retrieve_frame_summary(), {'count': 3, 'latest': '2024-01-01T00:00:03'})
+
+    def test_iter_frames_falls_back_to_retrieve_frames(self):
+        manager = self.start(LegacyTaskManager(frames=self.FRAMES))
+        frames = list(manager.iter_frames(since_timestamp='2024-01-01T00:00:02'))
+        self.assertEqual(frames, [{'image': b'frame333', 'timestamp': '2024-01-01T00:00:03', 'size': 8}])
+
+
+class TestExternalDeviceManagerBatch(unittest.TestCase):
+    TASKS = [('task1', 'detect', 'a'), ('task2', 'detect', 'b'), ('task3', 'count', '')]
+
+    def start(self, task_manager):
+        self.server, address, _, _ = start_fake_server(task_manager=task_manager)
+        self.addCleanup(self.server.stop, None)
+        return ExternalDeviceManager(address)
+
+    def test_send_task_batch_is_one_rpc(self):
+        task_manager = FakeTaskManager()
+        manager = self.start(task_manager)
+
+        responses = manager.send_task_batch(self.TASKS)
+
+        self.assertEqual([response.task_id for response in responses], ['task1', 'task2', 'task3'])
+        self.assertEqual(task_manager.batches, 1)
+        self.assertEqual(task_manager.tasks, 3)
+
+    def test_send_task_batch_falls_back_to_send_task(self):
+        task_manager = LegacyTaskManager()
+        manager = self.start(task_manager)
+
+        responses = manager.send_task_batch(self.TASKS)
+
+        self.assertEqual([response.task_id for response in responses], ['task1', 'task2', 'task3'])
+        self.assertEqual(task_manager.batches, 0)
+        self.assertEqual(task_manager.tasks, 3)
+
+
+class TestExternalDeviceManagerPing(unittest.TestCase):
+
+    def test_ping_reports_processing_types(self):
+        server, address, _, _ = start_fake_server(task_manager=FakeTaskManager(processing_types=['motion_detection']))
+        self.addCleanup(server.stop, None)
+        result = ExternalDeviceManager(address).ping(timeout=2)
+        self.assertEqual(result['processing_types'], ['motion_detection'])
+        self.assertGreater(result['latency'], 0)
+
+    def test_ping_without_ping_rpc(self):
+        server, address, _, _ = start_fake_server(task_manager=LegacyTaskManager())
+        self.addCleanup(server.stop, None)
+        self.assertEqual(ExternalDeviceManager(address).ping(timeout=2)['processing_types'], [])
+
+    def test_ping_unreachable_device_raises(self):
+        manager = ExternalDeviceManager('localhost:50051', channel_pool=MagicMock())
+        manager.task_stub = MagicMock()
+        manager.task_stub.Ping.side_effect = UnavailableError()
+        with self.assertRaises(grpc.RpcError):
+            manager.ping(timeout=0.1)
+
+
+class TestExternalDeviceManagerRetry(unittest.TestCase):
+
+    def make_manager(self):
+        manager = ExternalDeviceManager('localhost:50051', channel_pool=MagicMock(), initial_backoff=0)
+        manager.task_stub = MagicMock()
+        manager.video_stub = MagicMock()
+        return manager
+
+    def test_send_task_retries_unavailable(self):
+        manager = self.make_manager()
+        manager.task_stub.SendTask.side_effect = [UnavailableError(), 'fake_response']
+
+        self.assertEqual(manager.send_task('task1', 'detect'), 'fake_response')
+        self.assertEqual(manager.task_stub.SendTask.call_count, 2)
+        manager.channel_pool.wait_ready.assert_called_once_with('localhost:50051')
+
+    def test_send_task_gives_up_after_max_retries(self):
+        manager = self.make_manager()
+        manager.max_retries = 2
+        manager.task_stub.SendTask.side_effect = UnavailableError()
+
+        with self.assertRaises(grpc.RpcError):
+            manager.send_task('task1', 'detect')
+        self.assertEqual(manager.task_stub.SendTask.call_count, 3)
+
+    def test_stream_video_resumes_after_unavailable(self):
+        manager = self.make_manager()
+        frames = iter([b'a', b'b', b'c', None])
+        source = MagicMock()
+        source.codec = 'mjpeg'
+        source.processing_type = 'motion_detection'
+        source.get_next_frame.side_effect = lambda: next(frames)
+        sent = []
+
+        def stream(chunks):
+            for chunk in chunks:
+                sent.append(chunk.data)
+                if chunk.data == b'b' and len(sent) == 3:
+                    raise UnavailableError()
+            return workloads_pb2.TaskResponse(message='done')
+
+        manager.video_stub.StreamVideo.future.side_effect = lambda chunks: FakeCall(stream, chunks)
+
+        response = manager.stream_video('task1', source)
+
+        self.assertEqual(response.message, 'done')
+        self.assertEqual(manager.video_stub.StreamVideo.future.call_count, 2)
+        self.assertEqual([data for data in sent if data], [b'a', b'b', b'c'])
+
+
+    def test_stream_video_sends_processing_type_on_change(self):
+        manager = self.make_manager()
+        source = MagicMock()
+        source.codec = 'mjpeg'
+        source.processing_type = 'motion_detection'
+        frames = iter([b'a', b'b', b'c', None])
+
+        def next_frame():
+            frame = next(frames)
+            if frame == b'c':
+                source.processing_type = 'object_detection'
+            return frame
+
+        source.get_next_frame.side_effect = next_frame
+        sent = []
+
+        def stream(chunks):
+            sent.extend((chunk.data, chunk.processing_type) for chunk in chunks)
+            return workloads_pb2.TaskResponse(message='done')
+
+        manager.video_stub.StreamVideo.future.side_effect = lambda chunks: FakeCall(stream, chunks)
+
+        manager.stream_video('task1', source)
+
+        self.assertEqual(sent, [(b'', 'motion_detection'), (b'a', ''), (b'b', ''), (b'c', 'object_detection')])
+
+
+class TestExternalDeviceManagerFailover(unittest.TestCase):
+
+    def test_failover_cancels_call_to_hung_device(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class HungVideoStreamer(FakeVideoStreamer):
+            def StreamVideo(self, request_iterator, context):
+                # Stops reading, so the client's flow-control window fills up
+                release.wait(10)
+                return workloads_pb2.TaskResponse()
+
+        server, address, _, _ = start_fake_server(video_streamer=HungVideoStreamer())
+        self.addCleanup(server.stop, None)
+        manager = ExternalDeviceManager(address)
+        self.addCleanup(manager.close)
+        source = MagicMock(codec='mjpeg', processing_type='motion_detection')
+        frames = [b'x' * 65536] * 5
+        # Stalls after its frames, so only cancelling the call can end the stream
+        source.get_next_frame.side_effect = lambda: frames.pop() if frames else release.wait(10)
+        state = StreamState('task1', 'client1')
+        errors = []
+
+        def stream():
+            try:
+                manager.stream_video('task1', source, state)
+            except Exception as e:
+                errors.append(e)
+
+        worker = threading.Thread(target=stream, daemon=True)
+        worker.start()
+        deadline = time.monotonic() + 5
+        while state.chunks_sent < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        state.request_failover()
+        worker.join(timeout=2)
+
+        self.assertFalse(worker.is_alive())
+        self.assertIsInstance(errors[0], RuntimeError)
+        self.assertIsNone(state.call)
+
+
+class FakeCall:
+    # StreamVideo.future() stand-in that runs the handler when the result is asked for
+    def __init__(self, handler, chunks):
+        self.handler = handler
+        self.chunks = chunks
+
+    def cancel(self):
+        return False
+
+    def result(self):
+        return self.handler(self.chunks)
+
+
+class UnavailableError(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
 if __name__ == '__main__':
     unittest.main()
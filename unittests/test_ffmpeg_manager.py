@@ -1,7 +1,8 @@
+import io
 import subprocess
 import unittest
 from unittest.mock import patch, MagicMock
-from server.ffmpeg_manager import FFmpegManager
+from ffmpeg_manager import FFmpegManager
 
 class TestFFmpegManager(unittest.TestCase):
 
@@ -15,8 +16,8 @@ class TestFFmpegManager(unittest.TestCase):
 
         self.assertIn('test_stream', manager.processes)
         mock_popen.assert_called_once_with([
-            'ffmpeg', '-i', '/dev/video0', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-qscale:v', '2', 'pipe:1'
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=10**8)
+            'ffmpeg', '-nostats', '-progress', 'pipe:2', '-i', '/dev/video0', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-qscale:v', '2', 'pipe:1'
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
         mock_process.poll.assert_called_once()
 
     @patch('subprocess.Popen')
@@ -59,5 +60,47 @@ class TestFFmpegManager(unittest.TestCase):
             self.assertIsNone(output)
             self.assertIn('Stream nonexistent_stream does not exist', log.output[0])
 
+    @patch('subprocess.Popen')
+    def test_get_next_frame(self, mock_popen):
+        frame_1 = b'\xff\xd8\x01\x02\xff\xd9'
+        frame_2 = b'\xff\xd8\x03\x04\x05\xff\xd9'
+        mock_process = MagicMock()
+        mock_process.stdout = io.BytesIO(frame_1 + frame_2)
+        mock_popen.return_value = mock_process
+
+        manager = FFmpegManager(max_restarts=0)
+        manager.start_stream('test_stream')
+
+        self.assertEqual(manager.get_next_frame('test_stream'), frame_1)
+        self.assertEqual(manager.get_next_frame('test_stream'), frame_2)
+        self.assertIsNone(manager.get_next_frame('test_stream'))
+
+    @patch('subprocess.Popen')
+    def test_get_next_frame_restarts_dead_process(self, mock_popen):
+        frame = b'\xff\xd8\x01\x02\xff\xd9'
+        dead_process = MagicMock()
+        dead_process.stdout = io.BytesIO(b'')
+        dead_process.wait.return_value = 1
+        live_process = MagicMock()
+        live_process.stdout = io.BytesIO(frame)
+        mock_popen.side_effect = [dead_process, live_process]
+        on_restart = MagicMock()
+
+        manager = FFmpegManager(on_restart=on_restart)
+        manager.start_stream('test_stream')
+        manager.streams['test_stream'].initial_backoff = 0
+
+        self.assertEqual(manager.get_next_frame('test_stream'), frame)
+        self.assertEqual(mock_popen.call_count, 2)
+        on_restart.assert_called_once_with('test_stream', 'exited with code 1', 1, False)
+        self.assertIs(manager.processes['test_stream'], live_process)
+
+    def test_get_next_frame_nonexistent_stream(self):
+        manager = FFmpegManager()
+        with self.assertLogs(level='ERROR') as log:
+            output = manager.get_next_frame('nonexistent_stream')
+            self.assertIsNone(output)
+            self.assertIn('Stream nonexistent_stream does not exist', log.output[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from ffmpeg_supervisor import SupervisedStream, parse_progress_value, process_usage
+
+FRAME = b'\xff\xd8\x01\x02\xff\xd9'
+
+# Stand-in for ffmpeg: reports progress on stderr, writes one frame, then exits or hangs
+FAKE_FFMPEG = '''
+import sys, time
+sys.stderr.write("Input #0, video4linux2\\nframe=1\\nfps=25.0\\nbitrate=1024.5kbits/s\\ndrop_frames=2\\nspeed=1.01x\\nprogress=continue\\n")
+sys.stderr.flush()
+sys.stdout.buffer.write(%r)
+sys.stdout.flush()
+if %r:
+    time.sleep(30)
+sys.exit(%d)
+'''
+
+# Stand-in for a camera that keeps delivering frames
+LOOPING_FFMPEG = '''
+import sys, time
+while True:
+    sys.stdout.buffer.write(%r)
+    sys.stdout.flush()
+    time.sleep(0.01)
+''' % FRAME
+
+
+def fake_command(hang=False, exit_code=1):
+    return [sys.executable, '-c', FAKE_FFMPEG % (FRAME, hang, exit_code)]
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestSupervisedStream(unittest.TestCase):
+
+    def test_parse_progress_value(self):
+        self.assertEqual(parse_progress_value('1024.5kbits/s'), 1024.5)
+        self.assertEqual(parse_progress_value('1.01x'), 1.01)
+        self.assertEqual(parse_progress_value(' 25 '), 25.0)
+        self.assertIsNone(parse_progress_value('N/A'))
+
+    def test_drains_stderr_into_log_and_metrics(self):
+        stream = SupervisedStream('test', fake_command(hang=True))
+        stream.spawn()
+        try:
+            self.assertEqual(stream.read_frame(), FRAME)
+            self.assertTrue(wait_until(lambda: 'speed' in stream.metrics))
+            stats = stream.stats()
+            self.assertEqual(stats['frames'], 1)
+            self.assertEqual(stats['fps'], 25.0)
+            self.assertEqual(stats['bitrate_kbps'], 1024.5)
+            self.assertEqual(stats['dropped_frames'], 2)
+            self.assertTrue(stats['running'])
+            self.assertEqual(list(stream.log), ['Input #0, video4linux2'])
+        finally:
+            stream.stop()
+
+    def test_restarts_with_backoff_then_gives_up(self):
+        on_restart = MagicMock()
+        stream = SupervisedStream('test', fake_command(exit_code=3), on_restart=on_restart,
+                                  initial_backoff=0.01, max_restarts=2)
+        stream.spawn()
+
+        frames = [stream.read_frame() for _ in range(4)]
+
+        self.assertEqual(frames, [FRAME, FRAME, FRAME, None])
+        self.assertEqual(stream.restarts, 2)
+        reasons = [call.args[1] for call in on_restart.call_args_list]
+        self.assertTrue(all(reason.startswith('exited with code 3') for reason in reasons))
+        self.assertEqual([call.args[3] for call in on_restart.call_args_list], [False, False, True])
+
+    def test_stalled_process_is_killed_and_restarted(self):
+        on_restart = MagicMock()
+        stream = SupervisedStream('test', fake_command(hang=True), on_restart=on_restart, initial_backoff=0)
+        stream.spawn()
+        try:
+            self.assertEqual(stream.read_frame(), FRAME)
+            first_process = stream.process
+            stream.last_progress_at -= 60
+
+            self.assertTrue(stream.check_stall(10))
+            self.assertEqual(stream.read_frame(), FRAME)
+
+            self.assertIsNot(stream.process, first_process)
+            self.assertIn('stalled', on_restart.call_args.args[1])
+        finally:
+            stream.stop()
+
+    def test_reconfigure_swaps_before_stopping_old_process(self):
+        new_frame = b'\xff\xd8\x09\xff\xd9'
+        new_command = [sys.executable, '-c', FAKE_FFMPEG % (new_frame, True, 0)]
+        on_restart = MagicMock()
+        stream = SupervisedStream('test', [sys.executable, '-c', LOOPING_FFMPEG], on_restart=on_restart)
+        stream.spawn()
+        try:
+            self.assertEqual(stream.read_frame(), FRAME)
+            old_process = stream.process
+            stream.reconfigure(new_command, stream.demuxer_factory, 'mjpeg')
+
+            self.assertTrue(wait_until(lambda: stream.swap is not None))
+            self.assertIsNone(old_process.poll())
+            for _ in range(100):
+                if stream.read_frame() == new_frame:
+                    break
+            else:
+                self.fail("Stream never switched to the new process")
+
+            self.assertIsNot(stream.process, old_process)
+            self.assertTrue(wait_until(lambda: old_process.poll() is not None))
+            self.assertEqual(stream.command, new_command)
+            on_restart.assert_not_called()
+        finally:
+            stream.stop()
+
+    def test_reconfigure_falls_back_to_restart_in_place(self):
+        stream = SupervisedStream('test', [sys.executable, '-c', LOOPING_FFMPEG])
+        stream.spawn()
+        try:
+            self.assertEqual(stream.read_frame(), FRAME)
+            # The replacement exits without a frame, like a V4L2 device that is busy
+            failing = [sys.executable, '-c', 'import sys; sys.exit(1)']
+            stream.reconfigure(failing, stream.demuxer_factory, 'mjpeg')
+            old_process = stream.process
+            self.assertTrue(wait_until(lambda: stream.kill_reason == 'reconfigured'))
+
+            self.assertTrue(wait_until(lambda: old_process.poll() is not None))
+            self.assertFalse(stream.swapping)
+            self.assertEqual(stream.pending_config[0], failing)
+        finally:
+            stream.stop()
+
+    def test_process_usage_reads_proc(self):
+        usage = process_usage(os.getpid())
+        if usage is None:
+            self.skipTest('/proc is not available')
+        self.assertGreater(usage['rss_bytes'], 0)
+        self.assertGreaterEqual(usage['cpu_seconds'], 0)
+        self.assertIsNone(process_usage(-1))
+
+    def test_stop_interrupts_backoff(self):
+        stream = SupervisedStream('test', fake_command(), initial_backoff=30)
+        stream.spawn()
+        self.assertEqual(stream.read_frame(), FRAME)
+        stream.consecutive_restarts = 0
+
+        start = time.monotonic()
+        timer = threading.Timer(0.1, stream.stop)
+        timer.start()
+        self.assertIsNone(stream.read_frame())
+        self.assertLess(time.monotonic() - start, 5)
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import io
+import unittest
+from PIL import Image, ImageDraw
+from frame_filter import FrameDecimator, MotionGate, gray_thumbnail
+
+
+def make_jpeg(offset, size=(640, 480)):
+    image = Image.new('RGB', size, (90, 120, 60))
+    draw = ImageDraw.Draw(image)
+    # A bright block that moves with the offset
+    draw.rectangle([100 + offset * 4, 100, 260 + offset * 4, 260], fill=(250, 250, 250))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=80)
+    return output.getvalue()
+
+
+class TestFrameDecimator(unittest.TestCase):
+
+    def test_frame_skip(self):
+        decimator = FrameDecimator()
+        self.assertEqual([decimator.accept(frame_skip=2) for _ in range(6)], [True, False, False, True, False, False])
+
+    def test_max_fps(self):
+        decimator = FrameDecimator()
+        times = [0.0, 0.1, 0.2, 0.5, 0.6, 1.0]
+        self.assertEqual([decimator.accept(max_fps=2, now=now) for now in times],
+                         [True, False, False, True, False, True])
+
+
+class TestMotionGate(unittest.TestCase):
+
+    def test_gray_thumbnail_is_small(self):
+        thumbnail = gray_thumbnail(make_jpeg(0))
+        self.assertEqual(thumbnail.shape, (48, 64))
+
+    def test_static_scene_is_suppressed_until_keepalive(self):
+        gate = MotionGate(keepalive_seconds=10)
+        frame = make_jpeg(0)
+        self.assertTrue(gate.accept(frame, 0.02, now=0))
+        self.assertFalse(gate.accept(frame, 0.02, now=1))
+        self.assertFalse(gate.accept(make_jpeg(0, size=(640, 480)), 0.02, now=5))
+        self.assertTrue(gate.accept(frame, 0.02, now=10))
+
+    def test_motion_passes(self):
+        gate = MotionGate()
+        self.assertTrue(gate.accept(make_jpeg(0), 0.02, now=0))
+        self.assertTrue(gate.accept(make_jpeg(30), 0.02, now=0.1))
+        self.assertGreater(gate.last_change, 0.02)
+
+    def test_undecodable_frame_passes(self):
+        gate = MotionGate()
+        self.assertTrue(gate.accept(b'\xff\xd8broken\xff\xd9', 0.02))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from frame_store import FrameStore, parse_timestamp
+
+
+def frame(timestamp, image):
+    return {'timestamp': timestamp, 'image': image}
+
+
+class TestFrameStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+
+    def make_store(self, **kwargs):
+        kwargs.setdefault('max_age_seconds', None)
+        store = FrameStore(self.root_dir, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_append_and_range_query(self):
+        store = self.make_store()
+        store.append_many('client1', [frame('100', b'a'), frame('200', b'bb'), frame('300', b'ccc')])
+
+        frames = store.query('client1', start='150', end='300')
+        self.assertEqual([f['image'] for f in frames], [b'bb', b'ccc'])
+        self.assertEqual(store.last_timestamp('client1'), '300')
+        self.assertEqual(store.count('client1'), 3)
+
+    def test_duplicates_are_skipped(self):
+        store = self.make_store()
+        store.append_many('client1', [frame('100', b'a'), frame('200', b'b')])
+        added = store.append_many('client1', [frame('200', b'b'), frame('300', b'c')])
+        self.assertEqual(added, 1)
+        self.assertEqual(store.count('client1'), 3)
+
+    def test_metadata_only_query_and_limit(self):
+        store = self.make_store()
+        store.append_many('client1', [frame('2024-01-01T00:00:0%d' % i, b'x' * i) for i in range(1, 5)])
+
+        frames = store.query('client1', limit=2, with_images=False)
+        self.assertEqual(frames, [
+            {'timestamp': '2024-01-01T00:00:01', 'image': b'', 'size': 1},
+            {'timestamp': '2024-01-01T00:00:02', 'image': b'', 'size': 2},
+        ])
+
+    def test_reopen_restores_index(self):
+        store = self.make_store(segment_size=16)
+        store.append_many('client1', [frame(str(i), bytes([i]) * 10) for i in range(1, 6)])
+        store.close()
+
+        reopened = self.make_store(segment_size=16)
+        self.assertEqual(reopened.count('client1'), 5)
+        self.assertEqual(reopened.last_timestamp('client1'), '5')
+        self.assertEqual(reopened.query('client1', start='4')[0]['image'], b'\x04' * 10)
+        reopened.append('client1', '6', b'new')
+        self.assertEqual(reopened.query('client1', start='6')[0]['image'], b'new')
+
+    def test_size_eviction_drops_oldest_segments(self):
+        store = self.make_store(segment_size=20, max_bytes=60)
+        store.append_many('client1', [frame(str(i), b'x' * 12) for i in range(1, 11)])
+
+        self.assertLessEqual(store.total_bytes(), 60)
+        timestamps = [f['timestamp'] for f in store.query('client1', with_images=False)]
+        self.assertEqual(timestamps[-1], '10')
+        self.assertNotIn('1', timestamps)
+
+    def test_age_eviction(self):
+        store = self.make_store(segment_size=1, max_age_seconds=60)
+        now = time.time()
+        store.append_many('client1', [frame(str(now - 120), b'old'), frame(str(now), b'new')])
+
+        self.assertEqual([f['image'] for f in store.query('client1')], [b'new'])
+        # Evicted frames are not pulled again on the next sync
+        self.assertFalse(store.append('client1', str(now - 120), b'old'))
+
+    def test_stalled_sync_does_not_block_other_clients(self):
+        store = self.make_store()
+        store.append('client2', '100', b'a')
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stalled_stream():
+            yield frame('100', b'a')
+            release.wait(5)
+
+        sync = threading.Thread(target=store.append_many, args=('client1', stalled_stream()))
+        sync.start()
+        started = time.monotonic()
+        self.assertEqual(len(store.query('client2')), 1)
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+        sync.join()
+        self.assertEqual(store.count('client1'), 1)
+
+    def test_reads_age_out_clients_that_stopped_syncing(self):
+        store = self.make_store(segment_size=1, max_age_seconds=60, evict_interval=0)
+        now = time.time()
+        store.append('client1', str(now - 30), b'old')
+        store.max_age_seconds = 10
+
+        self.assertEqual(store.query('client2'), [])
+        self.assertEqual(store.count('client1'), 0)
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('12.5'), 12.5)
+        self.assertLess(parse_timestamp('2024-01-01T00:00:00'), parse_timestamp('2024-01-01T00:00:01'))
+        with self.assertRaises(ValueError):
+            parse_timestamp('yesterday')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import MagicMock, patch
 from flask import Flask, jsonify
 from frontend_manager import FrontendManager
+from distribution_manager import StreamCapacityError
 
 class TestFrontendManager(unittest.TestCase):
     def setUp(self):
@@ -76,5 +77,211 @@ class TestFrontendManager(unittest.TestCase):
         self.assertEqual(response.json, {'clients': ['client1', 'client2']})
         self.distribution_manager.list_clients.assert_called_once()
 
+    def test_retrieve_frames(self):
+        self.distribution_manager.sync_saved_frames.return_value = {'new': 2, 'count': 5, 'latest': '2024-01-01T00:00:05'}
+        response = self.client.post('/retrieve_frames', json={'client_id': 'client1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'frames': 5, 'latest': '2024-01-01T00:00:05', 'new': 2})
+        self.distribution_manager.sync_saved_frames.assert_called_once_with('client1')
+
+    def test_frames_range(self):
+        self.distribution_manager.get_stored_frames.return_value = [
+            {'timestamp': '2024-01-01T00:00:01', 'image': b'', 'size': 10}
+        ]
+        response = self.client.post('/frames_range', json={'client_id': 'client1', 'start': '2024-01-01T00:00:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'frames': [{'timestamp': '2024-01-01T00:00:01', 'size': 10}]})
+        self.distribution_manager.get_stored_frames.assert_called_once_with(
+            'client1', start='2024-01-01T00:00:00', end=None, limit=0, with_images=False
+        )
+
+    def test_alerts_query_params(self):
+        self.distribution_manager.get_alerts.return_value = {'alerts': [{'seq': 4}], 'next': 4, 'has_more': False}
+        response = self.client.get('/alerts?since=3&severity=error&client_id=client1&limit=5000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['next'], 4)
+        self.distribution_manager.get_alerts.assert_called_once_with(
+            since=3, min_severity='error', client_id='client1', limit=1000
+        )
+
+    def test_alerts_bad_severity(self):
+        self.distribution_manager.get_alerts.side_effect = ValueError("Unknown alert severity: loud")
+        response = self.client.get('/alerts?severity=loud')
+        self.assertEqual(response.status_code, 400)
+
+    def test_alerts_stream_resumes_from_last_event_id(self):
+        self.distribution_manager.wait_for_alerts.side_effect = [True, False]
+        self.distribution_manager.alert_store.closed = True
+        self.distribution_manager.get_alerts.side_effect = [
+            {'alerts': [], 'next': 7, 'has_more': False},
+            {'alerts': [{'seq': 8, 'message': 'motion'}], 'next': 8, 'has_more': False},
+        ]
+        response = self.client.get('/alerts/stream', headers={'Last-Event-ID': '7'})
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn('id: 8\nevent: alert\n', body)
+        self.distribution_manager.wait_for_alerts.assert_any_call(7, timeout=15)
+
+    def test_alerts_stream_limits_open_connections(self):
+        self.distribution_manager.get_alerts.return_value = {'alerts': [], 'next': 0, 'has_more': False}
+        self.distribution_manager.wait_for_alerts.return_value = False
+        self.distribution_manager.alert_store.closed = False
+        frontend_manager = FrontendManager(self.distribution_manager, max_streaming_connections=1)
+        client = frontend_manager.app.test_client()
+
+        first = client.get('/alerts/stream', buffered=False)
+        self.assertEqual(first.status_code, 200)
+        refused = client.get('/alerts/stream')
+        self.assertEqual(refused.status_code, 503)
+        self.assertEqual(refused.headers['Retry-After'], '5')
+        first.close()
+        self.assertEqual(frontend_manager.streaming_connections, 0)
+        second = client.get('/alerts/stream', buffered=False)
+        self.assertEqual(second.status_code, 200)
+        second.close()
+
+    def test_start_tasks(self):
+        self.distribution_manager.start_tasks.return_value = [{'task_id': 't1', 'state': 'sent'}]
+        tasks = [{'task_type': 'detect', 'client_id': 'client1'}]
+        response = self.client.post('/start_tasks', json={'tasks': tasks})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'results': [{'task_id': 't1', 'state': 'sent'}]})
+        self.distribution_manager.start_tasks.assert_called_once_with(tasks)
+
+    def test_start_tasks_rejects_malformed_batch(self):
+        response = self.client.post('/start_tasks', json={'tasks': [{'client_id': 'client1'}]})
+        self.assertEqual(response.status_code, 400)
+        self.distribution_manager.start_tasks.assert_not_called()
+
+    def test_submit_task(self):
+        self.distribution_manager.schedule_task.return_value = 'task1'
+        response = self.client.post('/submit_task', json={'task_type': 'detect', 'payload': 'zone=1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'message': 'Task scheduled', 'task_id': 'task1'})
+        self.distribution_manager.schedule_task.assert_called_once_with('detect', 'zone=1', '/dev/video0')
+
+    def test_submit_task_without_devices(self):
+        self.distribution_manager.schedule_task.side_effect = ValueError('No edge devices registered')
+        response = self.client.post('/submit_task', json={'task_type': 'video_stream'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_start_stream_at_capacity(self):
+        self.distribution_manager.start_task.side_effect = StreamCapacityError('All 2 stream workers are busy')
+        response = self.client.post('/start_stream', json={'client_id': 'client1'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+
+    def test_device_health(self):
+        self.distribution_manager.get_device_health.return_value = {'detection_time': 5.0, 'devices': {}}
+        response = self.client.get('/devices/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['detection_time'], 5.0)
+
+    def test_snapshot(self):
+        self.distribution_manager.get_latest_frame.return_value = (4, b'\xff\xd8jpeg\xff\xd9', 'mjpeg')
+        response = self.client.get('/snapshot/task1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.data, b'\xff\xd8jpeg\xff\xd9')
+        self.assertEqual(response.headers['X-Frame-Seq'], '4')
+
+    def test_snapshot_errors(self):
+        self.distribution_manager.get_latest_frame.return_value = None
+        self.assertEqual(self.client.get('/snapshot/task1').status_code, 404)
+        self.distribution_manager.get_latest_frame.return_value = (1, b'au', 'h264')
+        self.assertEqual(self.client.get('/snapshot/task1').status_code, 409)
+        self.distribution_manager.get_latest_frame.return_value = (-1, None, 'mjpeg')
+        self.assertEqual(self.client.get('/snapshot/task1').status_code, 503)
+
+    def test_post_alert(self):
+        self.distribution_manager.add_alert.return_value = {'seq': 3, 'message': 'person', 'client_id': 'client1'}
+        response = self.client.post('/alerts', json={'message': 'person', 'client_id': 'client1'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['seq'], 3)
+        self.distribution_manager.add_alert.assert_called_once_with({'message': 'person', 'client_id': 'client1'})
+        self.assertEqual(self.client.post('/alerts', json={'client_id': 'client1'}).status_code, 400)
+
+    def test_event_segments(self):
+        self.distribution_manager.list_event_segments.return_value = [{'name': 'a.mjpeg'}]
+        self.distribution_manager.get_event_recorder_stats.return_value = {'segments': 1}
+        response = self.client.get('/events?client_id=client1')
+        self.assertEqual(response.json['segments'], [{'name': 'a.mjpeg'}])
+        self.distribution_manager.list_event_segments.assert_called_once_with('client1')
+
+        self.distribution_manager.get_event_segment_path.return_value = None
+        self.assertEqual(self.client.get('/events/client1/a.mjpeg').status_code, 404)
+
+    def test_preview_streams_multipart_until_task_ends(self):
+        self.distribution_manager.get_latest_frame.side_effect = [
+            (-1, None, 'mjpeg'), (1, b'one', 'mjpeg'), (2, b'two', 'mjpeg'), None
+        ]
+        response = self.client.get('/preview/task1?fps=15')
+        body = response.get_data()
+        self.assertEqual(response.mimetype, 'multipart/x-mixed-replace')
+        self.assertEqual(body.count(b'--frame\r\nContent-Type: image/jpeg'), 2)
+        self.assertIn(b'Content-Length: 3\r\n\r\ntwo\r\n', body)
+
+    def test_preview_shares_the_streaming_limit(self):
+        self.distribution_manager.get_latest_frame.return_value = (1, b'one', 'mjpeg')
+        frontend_manager = FrontendManager(self.distribution_manager, max_streaming_connections=1)
+        client = frontend_manager.app.test_client()
+
+        first = client.get('/preview/task1', buffered=False)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(client.get('/preview/task1').status_code, 503)
+        first.close()
+        self.assertEqual(frontend_manager.streaming_connections, 0)
+
+    def test_preview_rejects_bad_fps(self):
+        self.assertEqual(self.client.get('/preview/task1?fps=100').status_code, 400)
+
+    def test_metrics(self):
+        self.distribution_manager.collect_metrics.return_value = [
+            ('addon_stream_queue_depth', 'gauge', 'Queue depth', [('addon_stream_queue_depth', {'task_id': 't1'}, 2)])
+        ]
+        self.client.get('/list_clients')
+        response = self.client.get('/metrics')
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertIn('addon_stream_queue_depth{task_id="t1"} 2', body)
+        self.assertIn('addon_log_records_dropped_total 0', body)
+        self.assertIn('addon_http_request_duration_seconds_count{method="GET",route="/list_clients",status="200"}', body)
+
+    def test_shutdown_stops_distribution_manager_once(self):
+        frontend_manager = FrontendManager(self.distribution_manager)
+        frontend_manager.shutdown()
+        frontend_manager.shutdown()
+        self.distribution_manager.shutdown.assert_called_once()
+
+    @patch('frontend_manager.ProductionServer')
+    def test_run_production_server(self, mock_production_server):
+        frontend_manager = FrontendManager(self.distribution_manager, max_streaming_connections=2)
+        frontend_manager.run(workers=1, threads=4)
+        options = mock_production_server.call_args[0][1]
+        self.assertEqual(options['bind'], '0.0.0.0:5000')
+        self.assertEqual(options['threads'], 4)
+        self.assertEqual(options['worker_class'], 'gthread')
+        mock_production_server.return_value.run.assert_called_once()
+
+    @patch('frontend_manager.ProductionServer')
+    def test_run_rejects_snapshot_with_several_workers(self, mock_production_server):
+        with self.assertRaises(ValueError):
+            FrontendManager(self.distribution_manager).run(workers=2)
+        mock_production_server.assert_not_called()
+        self.distribution_manager.snapshot = None
+        FrontendManager(self.distribution_manager).run(workers=2)
+        mock_production_server.return_value.run.assert_called_once()
+
+    @patch('frontend_manager.ProductionServer')
+    def test_run_keeps_threads_for_control_routes(self, mock_production_server):
+        with self.assertRaises(ValueError):
+            FrontendManager(self.distribution_manager, max_streaming_connections=4).run(threads=4)
+        mock_production_server.assert_not_called()
+
+    def test_run_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            FrontendManager(self.distribution_manager).run(mode='turbo')
+
 if __name__ == '__main__':
     unittest.main()
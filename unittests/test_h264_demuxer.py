@@ -0,0 +1,51 @@
+import io
+import unittest
+from h264_demuxer import H264Demuxer, is_keyframe
+
+AUD = b'\x00\x00\x00\x01\x09\xf0'
+SPS = b'\x00\x00\x00\x01\x67\x42\x00\x1f'
+IDR = b'\x00\x00\x01\x65\x88\x84\x00'
+P_SLICE = b'\x00\x00\x01\x41\x9a\x02'
+
+ACCESS_UNIT_1 = AUD + SPS + IDR
+ACCESS_UNIT_2 = AUD + P_SLICE
+ACCESS_UNIT_3 = AUD + P_SLICE + b'\x33'
+
+
+class TrickleStream(io.RawIOBase):
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data[self.pos:self.pos + min(self.step, len(buffer))]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+
+class TestH264Demuxer(unittest.TestCase):
+
+    def test_splits_on_access_unit_delimiters(self):
+        demuxer = H264Demuxer(io.BytesIO(ACCESS_UNIT_1 + ACCESS_UNIT_2 + ACCESS_UNIT_3))
+        self.assertEqual(demuxer.read_frame(), ACCESS_UNIT_1)
+        self.assertEqual(demuxer.read_frame(), ACCESS_UNIT_2)
+        self.assertEqual(demuxer.read_frame(), ACCESS_UNIT_3)
+        self.assertIsNone(demuxer.read_frame())
+
+    def test_delimiters_split_across_reads(self):
+        demuxer = H264Demuxer(TrickleStream(b'\x00\x12' + ACCESS_UNIT_1 + ACCESS_UNIT_2 + ACCESS_UNIT_3, 1))
+        self.assertEqual([demuxer.read_frame() for _ in range(4)], [ACCESS_UNIT_1, ACCESS_UNIT_2, ACCESS_UNIT_3, None])
+
+    def test_is_keyframe(self):
+        self.assertTrue(is_keyframe(ACCESS_UNIT_1))
+        self.assertFalse(is_keyframe(ACCESS_UNIT_2))
+        self.assertFalse(is_keyframe(b'\x00\x00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from task_registry import TaskRegistry
+from health_checker import HealthChecker
+
+
+class TestHealthChecker(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = TaskRegistry()
+        self.device = MagicMock()
+        self.device.ping.return_value = {'latency': 0.004, 'processing_types': ['motion_detection']}
+        self.registry.add_client('camera1', self.device)
+        self.on_down = MagicMock()
+        self.on_up = MagicMock()
+        self.checker = HealthChecker(self.registry, on_down=self.on_down, on_up=self.on_up, interval=0.5,
+                                     timeout=0.25, failure_threshold=2)
+        self.addCleanup(self.checker.stop)
+
+    def test_unprobed_devices_are_healthy(self):
+        self.assertTrue(self.checker.is_healthy('camera1'))
+        self.assertTrue(self.checker.supports('camera1', 'object_detection'))
+
+    def test_down_after_consecutive_failures_then_up(self):
+        self.device.ping.side_effect = ConnectionError('refused')
+        self.checker.check_all()
+        self.assertTrue(self.checker.is_healthy('camera1'))
+        self.checker.check_all()
+        self.assertFalse(self.checker.is_healthy('camera1'))
+        self.on_down.assert_called_once()
+
+        self.device.ping.side_effect = None
+        self.checker.check_all()
+        self.assertTrue(self.checker.is_healthy('camera1'))
+        self.on_up.assert_called_once_with('camera1')
+
+    def test_records_latency_and_processing_types(self):
+        self.checker.check_all()
+        self.device.ping.assert_called_with(timeout=0.25)
+        self.assertFalse(self.checker.supports('camera1', 'object_detection'))
+        stats = self.checker.stats()
+        self.assertEqual(stats['detection_time'], 1.25)
+        self.assertEqual(stats['devices']['camera1']['latency_ms'], 4.0)
+        slow = HealthChecker(self.registry, interval=0.5, timeout=1.0, failure_threshold=2)
+        self.addCleanup(slow.stop)
+        self.assertEqual(slow.detection_time, 3.0)
+
+    def test_slow_probes_are_detected_within_detection_time(self):
+        down = threading.Event()
+        checker = HealthChecker(self.registry, on_down=lambda client_id, error: down.set(), interval=0.3,
+                                timeout=0.25, failure_threshold=3)
+        self.addCleanup(checker.stop)
+
+        def ping(timeout):
+            time.sleep(timeout)
+            raise TimeoutError('deadline exceeded')
+
+        self.device.ping.side_effect = ping
+        started = time.monotonic()
+        checker.start()
+
+        self.assertTrue(down.wait(5))
+        # Waiting a full interval after each probe would take 1.65s here
+        self.assertLess(time.monotonic() - started, checker.detection_time + 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
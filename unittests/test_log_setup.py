@@ -0,0 +1,88 @@
+import io
+import logging
+import queue
+import unittest
+from log_setup import DeferredQueueHandler, Lazy, RateLimitFilter, configure_logging, parse_module_levels, \
+    stop_logging
+
+
+def make_record(lineno=1, msg='frame %d', args=(1,)):
+    return logging.LogRecord('capture_hub', logging.WARNING, 'capture_hub.py', lineno, msg, args, None)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_limits_each_call_site_separately(self):
+        clock = FakeClock()
+        limiter = RateLimitFilter(rate=1.0, burst=2, clock=clock)
+        passed = [limiter.filter(make_record()) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        self.assertTrue(limiter.filter(make_record(lineno=2)))
+
+        clock.now = 1.0
+        record = make_record()
+        self.assertTrue(limiter.filter(record))
+        self.assertEqual(record.getMessage(), 'frame 1 (3 similar messages suppressed)')
+
+    def test_zero_rate_disables_limiting(self):
+        limiter = RateLimitFilter(rate=0)
+        self.assertTrue(all(limiter.filter(make_record()) for _ in range(100)))
+
+
+class TestDeferredQueueHandler(unittest.TestCase):
+
+    def test_formatting_is_left_to_the_listener(self):
+        calls = []
+        handler = DeferredQueueHandler(queue.Queue())
+        handler.emit(make_record(msg='response %s', args=(Lazy(lambda: calls.append(1) or 'ok'),)))
+        record = handler.queue.get_nowait()
+        self.assertEqual(calls, [])
+        self.assertEqual(record.getMessage(), 'response ok')
+
+    def test_full_queue_drops_records(self):
+        handler = DeferredQueueHandler(queue.Queue(1))
+        handler.emit(make_record())
+        handler.emit(make_record())
+        self.assertEqual(handler.dropped, 1)
+
+
+class TestConfigureLogging(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved = (list(root.handlers), root.level)
+
+    def tearDown(self):
+        stop_logging()
+        root = logging.getLogger()
+        root.handlers[:] = self.saved[0]
+        root.setLevel(self.saved[1])
+        logging.getLogger('frame_store').setLevel(logging.NOTSET)
+
+    def test_module_levels_and_output(self):
+        stream = io.StringIO()
+        configure_logging('WARNING', {'frame_store': 'DEBUG'}, stream=stream)
+        logging.getLogger('frame_store').debug('kept %s', 'debug')
+        logging.getLogger('capture_hub').info('dropped')
+        stop_logging()
+        output = stream.getvalue()
+        self.assertIn('DEBUG frame_store: kept debug', output)
+        self.assertNotIn('dropped', output)
+
+    def test_parse_module_levels(self):
+        self.assertEqual(parse_module_levels('a=debug, b=WARNING,'), {'a': 'DEBUG', 'b': 'WARNING'})
+        self.assertEqual(parse_module_levels(''), {})
+        with self.assertRaises(ValueError):
+            parse_module_levels('debug')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+import grpc
+from metrics import MetricsRegistry, MetricFamilies, HistogramChild, REGISTRY, record_rpc, format_labels
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_sums_across_threads(self):
+        counter = self.registry.counter('frames_total', 'Frames', ('task_id',))
+        child = counter.labels('task1')
+
+        def work():
+            for _ in range(1000):
+                child.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn('frames_total{task_id="task1"} 4000', self.registry.render())
+
+    def test_exited_threads_fold_into_totals(self):
+        histogram = self.registry.histogram('request_seconds', 'Requests', ('route',))
+        child = histogram.labels('/start_stream')
+
+        # A thread per request, like app.run(threaded=True)
+        for _ in range(50):
+            thread = threading.Thread(target=child.observe, args=(0.01,))
+            thread.start()
+            thread.join()
+        child.observe(0.01)
+
+        self.assertEqual(len(child.cells.cells), 1)
+        self.assertIn('request_seconds_count{route="/start_stream"} 51', self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        text = self.registry.render()
+
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count 3', text)
+        self.assertIn('latency_seconds_sum 5.55', text)
+
+    def test_registering_twice_returns_same_metric(self):
+        first = self.registry.counter('errors_total', 'Errors', ('code',))
+        self.assertIs(self.registry.counter('errors_total', 'Errors', ('code',)), first)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('errors_total', 'Errors')
+
+    def test_labels_must_match(self):
+        counter = self.registry.counter('errors_total', 'Errors', ('code',))
+        with self.assertRaises(ValueError):
+            counter.labels()
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(format_labels({'path': 'a"b\\c'}), '{path="a\\"b\\\\c"}')
+
+    def test_render_includes_scrape_time_families(self):
+        families = MetricFamilies()
+        families.add('queue_depth', 'gauge', 'Queue depth', {'task_id': 't1'}, 3)
+        families.add('missing', 'gauge', 'Skipped when unknown', {}, None)
+        histogram = HistogramChild((10,))
+        histogram.observe(4)
+        families.add_histogram('frame_size_bytes', 'Frame size', {'task_id': 't1'}, histogram)
+
+        text = self.registry.render(families)
+
+        self.assertIn('queue_depth{task_id="t1"} 3', text)
+        self.assertNotIn('missing', text)
+        self.assertIn('frame_size_bytes_bucket{task_id="t1",le="10"} 1', text)
+
+
+class TestRecordRpc(unittest.TestCase):
+
+    def test_errors_are_counted_by_status_code(self):
+        error = grpc.RpcError()
+        error.code = MagicMock(return_value=grpc.StatusCode.UNAVAILABLE)
+
+        record_rpc('edge-test:50051', 'SendTask', 0.0, error)
+
+        text = REGISTRY.render()
+        self.assertIn('addon_rpc_errors_total{address="edge-test:50051",method="SendTask",code="UNAVAILABLE"} 1', text)
+        self.assertIn('addon_rpc_latency_seconds_count{address="edge-test:50051",method="SendTask"} 1', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import unittest
+from mjpeg_demuxer import MJPEGDemuxer
+
+FRAME_1 = b'\xff\xd8' + b'\x01\x02\xff\x00' + b'\xff\xd9'
+FRAME_2 = b'\xff\xd8' + b'\x03' * 100 + b'\xff\xd9'
+
+
+class TrickleStream(io.RawIOBase):
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data[self.pos:self.pos + min(self.step, len(buffer))]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+
+class TestMJPEGDemuxer(unittest.TestCase):
+
+    def test_read_frame_returns_whole_frames(self):
+        demuxer = MJPEGDemuxer(io.BytesIO(FRAME_1 + FRAME_2))
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+        self.assertEqual(demuxer.read_frame(), FRAME_2)
+        self.assertIsNone(demuxer.read_frame())
+
+    def test_markers_split_across_reads(self):
+        demuxer = MJPEGDemuxer(TrickleStream(FRAME_1 + FRAME_2 + FRAME_1, 1), read_size=3)
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+        self.assertEqual(demuxer.read_frame(), FRAME_2)
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+        self.assertIsNone(demuxer.read_frame())
+
+    def test_skips_garbage_before_start_of_image(self):
+        demuxer = MJPEGDemuxer(io.BytesIO(b'\x00\xff\x12' + FRAME_1))
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+
+    def test_truncated_frame_at_eof(self):
+        demuxer = MJPEGDemuxer(io.BytesIO(FRAME_1 + FRAME_2[:10]))
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+        self.assertIsNone(demuxer.read_frame())
+
+    def test_frame_larger_than_buffer_grows_it(self):
+        large = b'\xff\xd8' + b'\x07' * 5000 + b'\xff\xd9'
+        demuxer = MJPEGDemuxer(TrickleStream(FRAME_1 + large + FRAME_2, 100), read_size=64)
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+        self.assertEqual(demuxer.read_frame(), large)
+        self.assertEqual(demuxer.read_frame(), FRAME_2)
+
+    def test_oversized_frame_is_discarded(self):
+        demuxer = MJPEGDemuxer(io.BytesIO(b'\xff\xd8' + b'\x00' * 64 + FRAME_1), read_size=16, max_frame_size=32)
+        self.assertEqual(demuxer.read_frame(), FRAME_1)
+
+
+if __name__ == '__main__':
+    unittest.main()
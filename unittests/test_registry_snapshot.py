@@ -0,0 +1,57 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from registry_snapshot import RegistrySnapshot
+
+
+class TestRegistrySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+        self.path = os.path.join(self.root_dir, 'state', 'registry.json')
+        self.state = {'clients': {'client1': 'localhost:50051'}, 'streams': []}
+
+    def make_snapshot(self, **kwargs):
+        snapshot = RegistrySnapshot(self.path, lambda: self.state, **kwargs)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_save_and_load(self):
+        snapshot = self.make_snapshot()
+        self.assertIsNone(snapshot.load())
+        snapshot.save(self.state)
+
+        loaded = snapshot.load()
+        self.assertEqual(loaded['clients'], {'client1': 'localhost:50051'})
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_unreadable_or_foreign_snapshots_are_ignored(self):
+        snapshot = self.make_snapshot()
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('{"clients": {')
+        self.assertIsNone(snapshot.load())
+        with open(self.path, 'w') as snapshot_file:
+            json.dump({'version': 99, 'clients': {}}, snapshot_file)
+        self.assertIsNone(snapshot.load())
+
+    def test_changes_are_coalesced_and_flushed_on_close(self):
+        snapshot = self.make_snapshot(min_interval=60)
+        snapshot.mark_dirty()
+        self.state = {'clients': {}, 'streams': [{'task_id': 'task1'}]}
+        snapshot.mark_dirty()
+        snapshot.mark_dirty()
+        snapshot.close()
+
+        self.assertEqual(snapshot.load()['streams'], [{'task_id': 'task1'}])
+        self.assertLessEqual(snapshot.writes, 2)
+        self.state = {'clients': {}, 'streams': []}
+        snapshot.mark_dirty()
+        self.assertEqual(snapshot.load()['streams'], [{'task_id': 'task1'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
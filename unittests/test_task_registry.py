@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock
+from task_registry import TaskRegistry
+
+
+class TestTaskRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = TaskRegistry(max_finished_tasks=2)
+        self.registry.add_client('client1', MagicMock())
+        self.registry.add_client('client2', MagicMock())
+
+    def test_secondary_indexes(self):
+        self.registry.add_task('task1', 'video_stream', 'client1', state='running')
+        self.registry.add_task('task2', 'detect', 'client1', state='sent')
+        self.registry.add_task('task3', 'video_stream', 'client2', state='running')
+
+        self.assertEqual(sorted(self.registry.task_ids_for_client('client1')), ['task1', 'task2'])
+        self.assertEqual(sorted(self.registry.task_ids_of_type('video_stream')), ['task1', 'task3'])
+        self.assertEqual(sorted(self.registry.task_ids_in_state('running')), ['task1', 'task3'])
+        self.assertEqual(self.registry.count_tasks(client_id='client1', task_type='video_stream'), 1)
+
+    def test_set_state_moves_index(self):
+        self.registry.add_task('task1', 'video_stream', 'client1', state='running')
+        self.registry.set_state('task1', 'stopped')
+
+        self.assertEqual(self.registry.task_ids_in_state('running'), [])
+        self.assertEqual(self.registry.task_ids_in_state('stopped'), ['task1'])
+        self.assertFalse(self.registry.set_state('missing', 'stopped'))
+
+    def test_finished_tasks_are_compacted(self):
+        on_evict = MagicMock()
+        self.registry.on_evict = on_evict
+        self.registry.add_task('running', 'video_stream', 'client1', state='running')
+        for i in range(4):
+            self.registry.add_task(f'task{i}', 'detect', 'client1', state='sent')
+
+        self.assertEqual(sorted(self.registry.list_task_ids()), ['running', 'task2', 'task3'])
+        self.assertEqual(sorted(self.registry.task_ids_for_client('client1')), ['running', 'task2', 'task3'])
+        self.assertEqual(sorted(self.registry.task_ids_of_type('detect')), ['task2', 'task3'])
+        self.assertEqual([c[0][0] for c in on_evict.call_args_list], ['task0', 'task1'])
+
+    def test_remove_client_cascades(self):
+        self.registry.add_task('task1', 'video_stream', 'client1', state='running')
+        self.registry.add_task('task2', 'video_stream', 'client2', state='running')
+
+        device, tasks = self.registry.remove_client('client1')
+
+        self.assertIsNotNone(device)
+        self.assertEqual([task['task_id'] for task in tasks], ['task1'])
+        self.assertEqual(self.registry.list_task_ids(), ['task2'])
+        self.assertEqual(self.registry.task_ids_in_state('running'), ['task2'])
+        self.assertEqual(self.registry.list_clients(), ['client2'])
+
+    def test_get_task_returns_copy(self):
+        self.registry.add_task('task1', 'video_stream', 'client1')
+        task = self.registry.get_task('task1')
+        task['state'] = 'failed'
+        self.assertEqual(self.registry.get_task('task1')['state'], 'pending')
+
+
+if __name__ == '__main__':
+    unittest.main()
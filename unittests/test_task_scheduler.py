@@ -0,0 +1,75 @@
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from task_registry import TaskRegistry
+from task_scheduler import TaskScheduler
+
+
+class TestTaskScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = TaskRegistry()
+        for client_id in ('camera1', 'camera2', 'camera3'):
+            self.registry.add_client(client_id, MagicMock())
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.addCleanup(self.executor.shutdown)
+
+    def make_scheduler(self, send=None, **kwargs):
+        return TaskScheduler(self.registry, send or MagicMock(), self.executor, **kwargs)
+
+    def test_least_loaded_avoids_streams_and_slow_devices(self):
+        scheduler = self.make_scheduler()
+        self.registry.add_task('stream1', 'video_stream', 'camera1', state='running')
+        scheduler.choose()
+        scheduler.loads['camera2'].observe_latency(0.5, 0.2)
+
+        self.assertEqual(scheduler.choose(), 'camera3')
+
+    def test_per_device_limit_queues_the_burst(self):
+        release = threading.Event()
+        placed = []
+        lock = threading.Lock()
+
+        def send(client_id, task):
+            with lock:
+                placed.append(client_id)
+            release.wait(5)
+
+        scheduler = self.make_scheduler(send, max_in_flight=2)
+        for index in range(8):
+            scheduler.submit({'task_id': f'task{index}', 'task_type': 'detect', 'payload': ''})
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(sorted(device['in_flight'] for device in stats['devices'].values()), [2, 2, 2])
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while len(placed) < 8 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(placed), 8)
+        self.assertEqual(scheduler.stats()['queued'], 0)
+
+    def test_power_of_two_compares_two_random_devices(self):
+        scheduler = self.make_scheduler(policy='power_of_two', rng=random.Random(1))
+        choices = {scheduler.choose() for _ in range(50)}
+        self.assertTrue(choices <= {'camera1', 'camera2', 'camera3'})
+        self.assertGreater(len(choices), 1)
+
+    def test_failed_send_is_counted(self):
+        scheduler = self.make_scheduler(MagicMock(side_effect=RuntimeError('edge device gone')))
+        scheduler.submit({'task_id': 'task1', 'task_type': 'detect', 'payload': ''})
+        self.executor.shutdown(wait=True)
+
+        self.assertEqual(sum(device['errors'] for device in scheduler.stats()['devices'].values()), 1)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_scheduler(policy='round_robin')
+
+
+if __name__ == '__main__':
+    unittest.main()
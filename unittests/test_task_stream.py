@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from test_frame_filter import make_jpeg
+from task_stream import StreamSettings, TaskStream
+
+
+class FakeSubscription:
+    codec = 'mjpeg'
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def get_next_frame(self, timeout=None):
+        return self.frames.pop(0) if self.frames else None
+
+    async def get_next_frame_async(self):
+        return self.get_next_frame()
+
+
+class TestStreamSettings(unittest.TestCase):
+
+    def test_update_validates(self):
+        settings = StreamSettings()
+        self.assertEqual(settings.update(frame_skip=2), 2)
+        for changes in ({'frame_skip': -1}, {'processing_type': ''}, {'profile': 'h264_low'}):
+            with self.assertRaises(ValueError):
+                settings.update(**changes)
+        for changes in ({'max_fps': 0}, {'motion_threshold': 1.5}):
+            with self.assertRaises(ValueError):
+                settings.update(**changes)
+        self.assertEqual(settings.to_dict(), {'processing_type': 'motion_detection', 'frame_skip': 2, 'max_fps': None,
+                                              'motion_threshold': None, 'version': 2})
+
+
+class TestTaskStream(unittest.TestCase):
+
+    def test_frame_skip_sends_every_nth_frame(self):
+        stream = TaskStream(FakeSubscription([b'1', b'2', b'3', b'4', b'5']), StreamSettings(frame_skip=1))
+        self.assertEqual(stream.get_next_frame(), b'1')
+        self.assertEqual(stream.get_next_frame(), b'3')
+        self.assertEqual(stream.get_next_frame(), b'5')
+        self.assertIsNone(stream.get_next_frame())
+        self.assertEqual(stream.skipped_frames, 2)
+
+    def test_changes_apply_to_next_frame(self):
+        settings = StreamSettings()
+        stream = TaskStream(FakeSubscription([b'1', b'2', b'3']), settings)
+        self.assertEqual(stream.get_next_frame(), b'1')
+        settings.update(processing_type='object_detection', frame_skip=1)
+
+        self.assertEqual(stream.processing_type, 'object_detection')
+        self.assertEqual(asyncio.run(stream.get_next_frame_async()), b'3')
+        self.assertEqual(stream.codec, 'mjpeg')
+
+    def test_h264_is_never_decimated(self):
+        subscription = FakeSubscription([b'1', b'2', b'3'])
+        subscription.codec = 'h264'
+        stream = TaskStream(subscription, StreamSettings(frame_skip=1, motion_threshold=0.5))
+        self.assertEqual([stream.get_next_frame() for _ in range(3)], [b'1', b'2', b'3'])
+
+    def test_motion_gate_suppresses_static_frames(self):
+        static = make_jpeg(0)
+        moved = make_jpeg(40)
+        stream = TaskStream(FakeSubscription([static, static, static, moved]), StreamSettings(motion_threshold=0.05))
+
+        self.assertEqual(stream.get_next_frame(), static)
+        self.assertEqual(asyncio.run(stream.get_next_frame_async()), moved)
+        self.assertEqual(stream.suppressed_frames, 2)
+        self.assertGreater(stream.to_dict()['motion'], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()